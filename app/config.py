@@ -1,5 +1,7 @@
+import json
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, fields, replace
+from typing import List, Tuple
 
 # Carga variables del .env si usas python-dotenv
 from dotenv import load_dotenv
@@ -19,8 +21,79 @@ class Settings:
 
     gemini_api_key: str = os.environ.get("GEMINI_API_KEY", "")
     gemini_model: str = os.environ.get("GEMINI_MODEL", "gemini-1.5-flash")
+    # Modelo barato que se intenta primero; se escala a GEMINI_MODEL si la validación falla
+    gemini_model_fast: str = os.environ.get("GEMINI_MODEL_FAST", "gemini-2.0-flash-lite")
+    # TTL (s) del prefijo estático cacheado en Gemini; 0 lo desactiva
+    gemini_cache_ttl: int = int(os.environ.get("GEMINI_CACHE_TTL", "3600"))
+    # Respuestas en streaming con parseo incremental (1 = activo)
+    gemini_stream: bool = os.environ.get("GEMINI_STREAM", "0") == "1"
+    # Extracción dividida (metadatos + un prompt por equipo, en paralelo); 0 = desactivado
+    ai_split_min_equipos: int = int(os.environ.get("AI_SPLIT_MIN_EQUIPOS", "3"))
+    ai_split_workers: int = int(os.environ.get("AI_SPLIT_WORKERS", "4"))
+    # Lotes de documentos cortos en una sola petición (1 = desactivado)
+    ai_batch_max_docs: int = int(os.environ.get("AI_BATCH_MAX_DOCS", "5"))
+    ai_batch_short_chars: int = int(os.environ.get("AI_BATCH_SHORT_CHARS", "6000"))
+    ai_batch_max_chars: int = int(os.environ.get("AI_BATCH_MAX_CHARS", "20000"))
+    # Documentos en vuelo a la vez en el modo asíncrono (`IngestPipeline.run`)
+    async_max_in_flight: int = int(os.environ.get("ASYNC_MAX_IN_FLIGHT", "8"))
+    # Parseo de .docx en procesos aparte con tiempo límite por archivo (0 procesos = en el mismo proceso)
+    docx_parse_workers: int = int(os.environ.get("DOCX_PARSE_WORKERS", "2"))
+    docx_parse_timeout: float = float(os.environ.get("DOCX_PARSE_TIMEOUT", "60"))
+    # Descargas: en RAM hasta DOWNLOAD_SPOOL_MB por archivo y DOWNLOAD_MEMORY_BUDGET_MB en total; el resto a disco
+    download_spool_mb: int = int(os.environ.get("DOWNLOAD_SPOOL_MB", "8"))
+    download_memory_budget_mb: int = int(os.environ.get("DOWNLOAD_MEMORY_BUDGET_MB", "64"))
+    # Traza detallada de escrituras en Sheets: "jsonl" (archivo local) o "sheet" (pestaña aparte)
+    audit_log: str = os.environ.get("AUDIT_LOG", "jsonl")
+    audit_log_path: str = os.environ.get("AUDIT_LOG_PATH", "logs/sheets_audit.jsonl")
+    audit_worksheet: str = os.environ.get("AUDIT_WORKSHEET", "Trazabilidad IA")
+    # Archivo histórico (`pipeline.rollover`): bloques con fecha anterior a ARCHIVE_BEFORE (aaaa-mm-dd)
+    # o radicados listados en ARCHIVE_CLOSED_FILE pasan a pestañas <hoja>_<año>
+    archive_before: str = os.environ.get("ARCHIVE_BEFORE", "")
+    archive_date_col: str = os.environ.get("ARCHIVE_DATE_COL", "FECHA")
+    archive_closed_file: str = os.environ.get("ARCHIVE_CLOSED_FILE", "")
+    archive_index_path: str = os.environ.get("ARCHIVE_INDEX_PATH", "state/archive_index.json")
+    # Copia local de la hoja entre corridas, validada con la versión del archivo en Drive ("" = desactivada)
+    sheets_snapshot_path: str = os.environ.get("SHEETS_SNAPSHOT_PATH", "state/sheet_snapshot.json.gz")
+    # Tabla maestra: "sheets" (directo en Google Sheets) o "sqlite" (copia local, enviada en lote a la hoja)
+    table_backend: str = os.environ.get("TABLE_BACKEND", "sheets")
+    sqlite_table_path: str = os.environ.get("SQLITE_TABLE_PATH", "state/master_table.sqlite")
+    table_auto_sync: bool = os.environ.get("TABLE_AUTO_SYNC", "1") == "1"
+    # Varios workers sobre la misma carpeta: leases por radicado en este SQLite compartido ("" = un solo proceso)
+    lease_db_path: str = os.environ.get("LEASE_DB_PATH", "")
+    worker_id: str = os.environ.get("WORKER_ID", "")  # "" = <host>-<pid>
+    lease_ttl: float = float(os.environ.get("LEASE_TTL", "900"))
+    # Corrida planificada (`pipeline.process_folder_scheduled`): presupuestos diarios (0 = sin límite),
+    # hora límite HH:MM ("" = sin límite) y archivo con el consumo del día y el punto de control
+    budget_ai_calls: int = int(os.environ.get("BUDGET_AI_CALLS", "0"))
+    budget_ai_tokens: int = int(os.environ.get("BUDGET_AI_TOKENS", "0"))
+    budget_sheet_writes: int = int(os.environ.get("BUDGET_SHEET_WRITES", "0"))
+    schedule_deadline: str = os.environ.get("SCHEDULE_DEADLINE", "")
+    schedule_state_path: str = os.environ.get("SCHEDULE_STATE_PATH", "state/schedule.json")
+    # Varias carpetas/hojas en un proceso (`MultiTenantRunner`): JSON con una entrada por tenant
+    tenants_file: str = os.environ.get("TENANTS_FILE", "tenants.json")
+    # Cupos por minuto compartidos por todos los tenants (0 = sin límite)
+    drive_max_rpm: float = float(os.environ.get("DRIVE_MAX_RPM", "600"))
+    sheets_max_rpm: float = float(os.environ.get("SHEETS_MAX_RPM", "60"))
+    gemini_max_rpm: float = float(os.environ.get("GEMINI_MAX_RPM", "60"))
+
+    # Varios .docx del mismo radicado: una sola extracción con el texto unido ("merge"),
+    # solo con el más reciente ("latest") o uno por archivo ("off")
+    coalesce_by_radicado: str = os.environ.get("COALESCE_BY_RADICADO", "merge")
+    coalesce_max_chars: int = int(os.environ.get("COALESCE_MAX_CHARS", "60000"))
+
+    # Grabación/reproducción de Gemini, Drive y Sheets ("" = desactivado, "record" o "replay");
+    # al reproducir: latencia = grabada × CASSETTE_LATENCY_SCALE y errores al azar con CASSETTE_ERROR_RATE
+    cassette_mode: str = os.environ.get("CASSETTE_MODE", "")
+    cassette_path: str = os.environ.get("CASSETTE_PATH", "cassettes/pipeline.jsonl")
+    cassette_latency_scale: float = float(os.environ.get("CASSETTE_LATENCY_SCALE", "0"))
+    cassette_error_rate: float = float(os.environ.get("CASSETTE_ERROR_RATE", "0"))
+    cassette_seed: int = int(os.environ.get("CASSETTE_SEED", "0"))
 
     out_dir: str = os.environ.get("OUT_DIR", "out_json")
+    # Textos extraídos (gzip, por sha256) para re-extraer sin descargar; "" = <OUT_DIR>/textos
+    text_store_dir: str = os.environ.get("TEXT_STORE_DIR", "")
+    # Documentos en paralelo al re-extraer resultados de versiones anteriores del prompt (`pipeline.reprocess`)
+    reprocess_workers: int = int(os.environ.get("REPROCESS_WORKERS", "8"))
 
     # Columnas de la hoja
     col_radicado: str = os.environ.get("COL_RADICADO", "RADICADO")
@@ -28,4 +101,47 @@ class Settings:
     col_archivo: str = os.environ.get("COL_ARCHIVO", "ARCHIVO")
     col_updated: str = os.environ.get("COL_UPDATED", "Última actualización")
 
-settings = Settings()
\ No newline at end of file
+settings = Settings()
+
+# Rutas de estado que cada tenant necesita propias (si su entrada no las fija, van a una subcarpeta con su nombre)
+TENANT_STATE_FIELDS = (
+    "out_dir",
+    "audit_log_path",
+    "archive_index_path",
+    "sheets_snapshot_path",
+    "sqlite_table_path",
+    "schedule_state_path",
+    "lease_db_path",
+)
+
+
+def load_tenants(path: str, base: Settings = settings) -> List[Tuple[str, Settings]]:
+    """
+    Lee la lista de tenants: `[{"name": "oficina_a", "spreadsheet_id": "...",
+    "drive_folder_id": "...", ...}, ...]`. Cada clave es un campo de Settings
+    (en minúsculas); lo que no se indique se toma de `base`.
+    """
+    with open(get_relative_path(path), "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    known = {f.name for f in fields(Settings)}
+    tenants: List[Tuple[str, Settings]] = []
+    for entry in entries:
+        entry = dict(entry)
+        name = str(entry.pop("name", "")).strip()
+        if not name or any(name == n for n, _ in tenants):
+            raise ValueError(f"Cada tenant necesita un 'name' único en {path}: {name!r}")
+        unknown = sorted(set(entry) - known)
+        if unknown:
+            raise ValueError(f"Campos desconocidos para el tenant '{name}': {unknown}")
+        for key in TENANT_STATE_FIELDS:
+            value = getattr(base, key)
+            if key in entry or not value:
+                continue
+            if key == "out_dir":
+                entry[key] = os.path.join(value, name)
+            else:
+                entry[key] = os.path.join(os.path.dirname(value), name, os.path.basename(value))
+        if "service_account_path" in entry:
+            entry["service_account_path"] = get_relative_path(entry["service_account_path"])
+        tenants.append((name, replace(base, **entry)))
+    return tenants
\ No newline at end of file
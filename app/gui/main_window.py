@@ -32,6 +32,7 @@ from PySide6.QtWidgets import (
 
 from app.config import settings
 from app.pipeline.ingest import IngestPipeline
+from app.services.docx_pool import DocxParsePool
 from .config_store import GuiConfig, load_config, save_config
 from .constants import (
     CategoriaTipo,
@@ -41,8 +42,8 @@ from .constants import (
     PersonaTipo,
 )
 from .doc_processing import (
+    DocumentData,
     build_output_name,
-    extract_from_docx,
     generate_from_template,
 )
 from .text_utils import format_today_date, normalize_value, split_resolution_date
@@ -62,6 +63,8 @@ class LicenseGeneratorWindow(QMainWindow):
 
         self.config: GuiConfig = load_config()
         self.thread_pool = QThreadPool()
+        # Un documento dañado no debe congelar la ventana: se lee en otro proceso
+        self.docx_pool = DocxParsePool(workers=1, timeout=settings.docx_parse_timeout)
 
         self.source_path: Optional[Path] = None
         self.field_inputs: Dict[str, QWidget] = {}
@@ -166,9 +169,9 @@ class LicenseGeneratorWindow(QMainWindow):
         self.source_label = QLabel("Sin archivo cargado")
         layout.addWidget(self.source_label, stretch=1)
 
-        load_button = QPushButton("Cargar documento .docx")
-        load_button.clicked.connect(self.load_source_document)
-        layout.addWidget(load_button)
+        self.load_button = QPushButton("Cargar documento .docx")
+        self.load_button.clicked.connect(self.load_source_document)
+        layout.addWidget(self.load_button)
 
         clear_button = QPushButton("Ingresar datos manualmente")
         clear_button.clicked.connect(self.clear_form)
@@ -415,6 +418,22 @@ class LicenseGeneratorWindow(QMainWindow):
         btn_pending.clicked.connect(lambda: self.run_pipeline_task("process_folder_only_pending"))
         buttons_layout.addWidget(btn_pending)
 
+        btn_scheduled = QPushButton("Por prioridad")
+        btn_scheduled.clicked.connect(lambda: self.run_pipeline_task("process_folder_scheduled"))
+        buttons_layout.addWidget(btn_scheduled)
+
+        btn_backfill = QPushButton("Resincronizar desde cache")
+        btn_backfill.clicked.connect(lambda: self.run_pipeline_task("backfill"))
+        buttons_layout.addWidget(btn_backfill)
+
+        btn_reprocess = QPushButton("Reprocesar (prompt nuevo)")
+        btn_reprocess.clicked.connect(lambda: self.run_pipeline_task("reprocess"))
+        buttons_layout.addWidget(btn_reprocess)
+
+        btn_audit = QPushButton("Auditar hoja")
+        btn_audit.clicked.connect(lambda: self.run_pipeline_task("audit"))
+        buttons_layout.addWidget(btn_audit)
+
         layout.addWidget(buttons_container)
         layout.addWidget(self._build_log_section("pipeline_log", "Bitácora"))
         return container
@@ -690,11 +709,20 @@ class LicenseGeneratorWindow(QMainWindow):
         path = Path(file_path)
         self.config.last_open_dir = str(path.parent)
         save_config(self.config)
-        try:
-            document_data = extract_from_docx(path)
-        except Exception as exc:  # noqa: BLE001
-            QMessageBox.critical(self, "Error al leer", str(exc))
-            return
+        # La lectura va al pool de procesos; la interfaz sigue respondiendo mientras tanto
+        self.load_button.setEnabled(False)
+        self.log(f"Leyendo {path.name}…")
+        worker = Worker(self.docx_pool.docx_fields, path)
+        worker.signals.finished.connect(lambda document_data: self._on_source_document_loaded(path, document_data))
+        worker.signals.error.connect(self._on_source_document_error)
+        self.thread_pool.start(worker)
+
+    def _on_source_document_error(self, exc: Exception) -> None:
+        self.load_button.setEnabled(True)
+        QMessageBox.critical(self, "Error al leer", str(exc))
+
+    def _on_source_document_loaded(self, path: Path, document_data: DocumentData) -> None:
+        self.load_button.setEnabled(True)
         self.clear_form(log_message=False)
         self.source_path = path
         self.source_label.setText(str(path))
@@ -1,26 +1,270 @@
 # app/services/ingest.py
+import asyncio
+import collections
+import contextlib
 import os
 import json
 import glob
 import time
-from typing import Dict, Any, Optional, List
-from app.config import settings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, Any, Iterator, Optional, List, Tuple
+from app.config import Settings, settings
 from app.services.google_auth import get_credentials, build_clients
+from app.services.docx_pool import DocxParsePool, DocxParseTimeout
 from app.services.drive_client import DriveClient
+from app.services.lease_store import LeaseStore
+from app.services.run_budget import RunBudget, drive_time, parse_deadline
+from app.services.sheet_archive import ArchiveIndex, archive_policy
 from app.services.sheets_table import SheetsTable
-from app.services.ai_client import AIClient
+from app.services.snapshot_store import SnapshotStore
+from app.services.sqlite_table import SqliteTable
+from app.services.text_store import TextStore
+from app.services.table_backend import MasterTable
+from app.services.spool import MemoryBudget
+from app.services.ai_client import PROMPT_VERSION, AIClient
+from app.services.audit_log import AuditLog, JsonlAuditLog, SheetAuditLog
+from app.services.cassette import Cassette, RecordedClient, RecordedService
+from app.services.async_clients import (
+    AsyncAIClient,
+    AsyncDriveClient,
+    AsyncGoogleSession,
+    AsyncSheetsTable,
+    TenantSession,
+)
+from app.services.rate_limit import FairRateLimiter
+from app.services.request_classifier import classify_request, variant_for
+from app.services.text_blocks import COALESCE_HEADER
 from app.utils import radicado as rad
 
 
+@dataclass
+class PendingDoc:
+    """Documento descargado y con radicado resuelto, a la espera de IA/Sheets."""
+    file_id: str
+    filename: str
+    text: str
+    radicado: str
+    cache_key: str
+    data: Optional[Dict[str, Any]] = None
+    # Radicado que otro worker tuvo durante esta corrida: la tabla se relee antes de escribir
+    inherited: bool = False
+    # Archivos de Drive que cubre (varios si se unieron por radicado, ver `_prepare_group`)
+    members: List[Dict[str, Any]] = field(default_factory=list)
+    # Editado en Drive: resultado y texto de la extracción anterior (ver `AIClient.summarize_incremental`)
+    previous: Optional[Dict[str, Any]] = None
+    previous_text: Optional[str] = None
+    # ITEMs a escribir en la hoja (None = todos); los equipos sin cambios se omiten
+    changed_items: Optional[List[int]] = None
+
+    @property
+    def files(self) -> List[Dict[str, Any]]:
+        return self.members or [{"id": self.file_id, "name": self.filename}]
+
+
+MB = 1024 * 1024
+RUN_MODES = ("all", "only_new", "only_pending")
+# Orden de `process_folder_scheduled`
+PRIORITIES = ("nuevo", "modificacion", "reproceso")
+
+# Clave del JSON → encabezado de la hoja
+FIELD_MAP: Dict[str, str] = {
+    "ELABORA": "ELABORA",
+    "RADICADO": "RADICADO",
+    "FECHA": "FECHA",
+    "NOMBRE O RAZON SOCIAL": "NOMBRE O RAZÓN SOCIAL",
+    "NIT O CC": "NIT O CC",
+    "SEDE": "SEDE",
+    "DIRECCION": "DIRECCIÓN",
+    "SUBREGION": "SUBREGIÓN",
+    "MUNICIPIO": "MUNICIPIO",
+    "CORREO ELECTRONICO": "CORREO ELECTRÓNICO",
+    "TIPO DE SOLICITUD": "TIPO DE SOLICITUD",
+    "TIPO DE EQUIPO": "TIPO DE EQUIPO",
+    "CATEGORIA": "CATEGORÍA",
+    "FECHA DE FABRICACION": "FECHA DE FABRICACIÓN",
+    "MARCA": "MARCA",
+    "MODELO": "MODELO",
+    "SERIE": "SERIE",
+    "MARCA TUBO RX": "MARCA TUBO RX",
+    "MODELO TUBO RX": "MODELO TUBO RX",
+    "SERIE TUBO RX": "SERIE TUBO RX",
+    "FECHA FABRICACIÓN TUBO RX": "FECHA FABRICACIÓN TUBO RX",
+    "CONTROL CALIDAD": "CONTROL CALIDAD",
+    "FECHA CC": "FECHA CC",
+    "OBSERVACIONES": "OBSERVACIONES",
+    "Ultima Actualizacion": "Ultima Actualizacion",
+    "ITEM": "ITEM",
+    "ARCHIVO": "ARCHIVO",
+}
+
+
 class IngestPipeline:
-    def __init__(self):
-        self.creds = get_credentials(settings.service_account_path)
-        drive_service, sheets_service = build_clients(self.creds)
-        self.drive = DriveClient(drive_service)
-        self.sheets = SheetsTable(
-            sheets_service, settings.spreadsheet_id, settings.worksheet_name
+    def __init__(self, config: Optional[Settings] = None, name: str = ""):
+        # Configuración propia (varias carpetas/hojas en un proceso, ver `MultiTenantRunner`) o la global
+        self.settings = config or settings
+        self.name = name or self.settings.worksheet_name
+        # CASSETTE_MODE: llamadas a Gemini, Drive y Sheets grabadas o reproducidas (ver app/services/cassette.py)
+        self.cassette = (
+            Cassette(
+                self.settings.cassette_path,
+                self.settings.cassette_mode,
+                latency_scale=self.settings.cassette_latency_scale,
+                error_rate=self.settings.cassette_error_rate,
+                seed=self.settings.cassette_seed,
+            )
+            if self.settings.cassette_mode
+            else None
+        )
+        if self.cassette is not None and self.cassette.replaying:
+            # Sin red ni credenciales: todas las respuestas salen del cassette
+            self.creds, self.drive_service, self.sheets_service = None, None, None
+        else:
+            self.creds = get_credentials(self.settings.service_account_path)
+            self.drive_service, self.sheets_service = build_clients(self.creds)
+        self.parse_pool = (
+            DocxParsePool(self.settings.docx_parse_workers, timeout=self.settings.docx_parse_timeout)
+            if self.settings.docx_parse_workers > 0
+            else None
+        )
+        self.download_budget = MemoryBudget(self.settings.download_memory_budget_mb * MB)
+        self.drive = DriveClient(self.drive_service, **self._download_kwargs())
+        if self.cassette is not None:
+            # Drive por archivo (listado y texto); Sheets y la versión del archivo, por petición
+            self.drive = RecordedClient(self.drive, self.cassette, "drive", ("list_docx_in_folder", "download_docx_text"))
+            self.drive_service = RecordedService(self.drive_service, self.cassette, "drive_api")
+            self.sheets_service = RecordedService(self.sheets_service, self.cassette, "sheets")
+        self.audit_log = self._build_audit_log()
+        self.archive_index = ArchiveIndex(self.settings.archive_index_path)
+        self.texts = TextStore(self.settings.text_store_dir or os.path.join(self.settings.out_dir, "textos"))
+        # Con cassette, sin snapshot entre corridas: grabación y reproducción deben partir de la misma lectura
+        self.snapshot_store = (
+            SnapshotStore(self.settings.sheets_snapshot_path)
+            if self.settings.sheets_snapshot_path and self.cassette is None
+            else None
+        )
+        self.sheets = SheetsTable(self.sheets_service, **self._sheet_kwargs())
+        # Donde se ubican y llenan las filas: la hoja misma o su copia SQLite
+        self.table = self._build_table()
+        self.ai = AIClient(
+            self.settings.gemini_api_key,
+            self.settings.gemini_model,
+            fast_model=self.settings.gemini_model_fast,
+            cache_ttl=self.settings.gemini_cache_ttl,
+            stream=self.settings.gemini_stream,
+            split_min_equipos=self.settings.ai_split_min_equipos,
+            split_workers=self.settings.ai_split_workers,
         )
-        self.ai = AIClient(settings.gemini_api_key, settings.gemini_model)
+        if self.cassette is not None:
+            self.ai = RecordedClient(
+                self.ai, self.cassette, "gemini", ("summarize", "summarize_many", "summarize_incremental")
+            )
+        self.parse_timeouts: List[str] = []
+        # Reparto entre workers (LEASE_DB_PATH): archivos diferidos por tener su radicado otro worker
+        self.leases = (
+            LeaseStore(self.settings.lease_db_path, self.settings.worker_id or None, ttl=self.settings.lease_ttl)
+            if self.settings.lease_db_path
+            else None
+        )
+        self._run_started = 0.0
+        self._deferred: List[Dict[str, Any]] = []
+        # Presupuesto de la corrida planificada en curso (ver `process_folder_scheduled`)
+        self._budget: Optional[RunBudget] = None
+        # Documentos terminados en la corrida (rendimiento por tenant)
+        self.docs_finished = 0
+        # file_id → clave del JSON del grupo que lo incluye (ver `_coalesced_files`)
+        self._covered: Optional[Dict[str, str]] = None
+        # Textos leídos en `_coalesce` para ubicar el radicado; `_prepare*` los usa sin volver a descargar
+        self._probed: Dict[str, str] = {}
+        self._writes_at_start = 0
+        # Snapshot de la hoja abierto durante una corrida (ver `_start_run`)
+        self._run_stack = contextlib.ExitStack()
+
+    def _build_audit_log(self) -> AuditLog:
+        if self.settings.audit_log == "sheet":
+            return SheetAuditLog(self.sheets_service, self.settings.spreadsheet_id, self.settings.audit_worksheet)
+        return JsonlAuditLog(self.settings.audit_log_path)
+
+    def _sheet_kwargs(self) -> Dict[str, Any]:
+        return dict(
+            spreadsheet_id=self.settings.spreadsheet_id,
+            sheet_name=self.settings.worksheet_name,
+            audit_log=self.audit_log,
+            archive_index=self.archive_index,
+            drive_service=self.drive_service,
+            snapshot_store=self.snapshot_store,
+        )
+
+    def _build_table(self) -> MasterTable:
+        if self.settings.table_backend != "sqlite":
+            return self.sheets
+        table = SqliteTable(
+            self.settings.sqlite_table_path,
+            self.settings.worksheet_name,
+            audit_log=self.audit_log,
+            archive_index=self.archive_index,
+        )
+        if not table.headers:
+            n = table.import_from(self.sheets)
+            print(f"Tabla local creada desde '{self.settings.worksheet_name}': {n} fila(s) en {self.settings.sqlite_table_path}")
+        return table
+
+    def _download_kwargs(self) -> Dict[str, Any]:
+        return dict(
+            parse_pool=self.parse_pool,
+            spool_threshold=self.settings.download_spool_mb * MB,
+            budget=self.download_budget,
+        )
+
+    def _start_run(self, live_sheet: bool = True) -> None:
+        self.ai.reset_stats()
+        self.download_budget.reset_stats()
+        self.parse_timeouts = []
+        self._run_started = time.time()
+        self.docs_finished = 0
+        self._covered = None
+        self._probed = {}
+        self._deferred = []
+        self._writes_at_start = self.sheets.write_requests
+        self._run_stack.close()
+        self.sheets.conflicts = 0
+        if live_sheet and self.table is self.sheets:
+            # Lecturas desde la hoja en memoria (reutilizada de la corrida anterior si no cambió);
+            # las escrituras salen en lote al terminar cada documento (`_finish`)
+            self._run_stack.enter_context(self.sheets.snapshot())
+
+    def _end_run(self) -> None:
+        if self.settings.table_auto_sync:
+            self.sync_table()
+        # Al cerrarse, el snapshot envía lo pendiente y la traza antes de guardar la versión del archivo
+        self._run_stack.close()
+        self.audit_log.flush()
+        if self.leases is not None:
+            # Con todo escrito: quien tome estos radicados después ya ve las filas
+            self.leases.release_all()
+            if self._deferred:
+                names = ", ".join(f["name"] for f in self._deferred)
+                print(f"Archivos que quedaron en manos de otro worker ({len(self._deferred)}): {names}")
+        if self.sheets.conflicts:
+            print(
+                f"Filas editadas por otros mientras se escribía: {self.sheets.conflicts} "
+                "(se combinaron sin pisar sus cambios; detalle en la traza)"
+            )
+        print(self.ai.routing_report())
+        print(self.download_budget.report())
+        if self.parse_timeouts:
+            print(f"Archivos .docx con parseo excedido ({len(self.parse_timeouts)}): {', '.join(self.parse_timeouts)}")
+        if self.cassette is not None:
+            print(self.cassette.report())
+
+    def _report_error(self, name: Optional[str], e: Exception) -> None:
+        """Los .docx que cuelgan el parser se reportan aparte del resto de errores."""
+        if isinstance(e, DocxParseTimeout):
+            self.parse_timeouts.append(str(name))
+            print(f"[TIMEOUT DOCX] {name}: {e}")
+        else:
+            print(f"[ERROR] {name}: {e}")
 
     # ---------- Cache local (clave compuesta: radicado + prefijo de file_id) ----------
     def _cache_key(self, radicado: str, file_id: Optional[str], filename: Optional[str]) -> str:
@@ -32,8 +276,8 @@ class IngestPipeline:
         return f"{radicado}__{safe or 'local'}"
 
     def _json_path(self, cache_key: str) -> str:
-        os.makedirs(settings.out_dir, exist_ok=True)
-        return os.path.join(settings.out_dir, f"{cache_key}.json")
+        os.makedirs(self.settings.out_dir, exist_ok=True)
+        return os.path.join(self.settings.out_dir, f"{cache_key}.json")
 
     def _load_json_if_exists(self, cache_key: str) -> Optional[Dict[str, Any]]:
         path = self._json_path(cache_key)
@@ -42,87 +286,640 @@ class IngestPipeline:
                 return json.load(f)
         return None
 
-    def _save_json(self, cache_key: str, payload: Dict[str, Any]) -> str:
+    def _save_json(self, cache_key: str, payload: Dict[str, Any], meta: Optional[Dict[str, Any]] = None) -> str:
         path = self._json_path(cache_key)
         with open(path, "w", encoding="utf-8") as f:
             json.dump(payload, f, ensure_ascii=False, indent=2)
+        if meta is not None:
+            # Datos del archivo de origen (p. ej. para `backfill` sin consultar Drive)
+            with open(self._meta_path(cache_key), "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
         return path
 
+    def _meta_path(self, cache_key: str) -> str:
+        return os.path.join(self.settings.out_dir, f"{cache_key}.meta.json")
+
+    def _load_meta(self, cache_key: str) -> Dict[str, Any]:
+        try:
+            with open(self._meta_path(cache_key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _cached_keys(self) -> List[str]:
+        """Claves de todos los resultados guardados en OUT_DIR."""
+        keys = []
+        for path in sorted(glob.glob(os.path.join(self.settings.out_dir, "*__*.json"))):
+            name = os.path.basename(path)[: -len(".json")]
+            if not name.endswith(".meta"):
+                keys.append(name)
+        return keys
+
     def _has_cache_for_file(self, file_id: str) -> bool:
         '''Revisa si existe un JSON local para el file_id dado.'''
-        prefix = file_id[:8]
-        pattern = os.path.join(settings.out_dir, f"*__{prefix}.json")
-        return bool(glob.glob(pattern))
+        return self._cache_path_for_file(file_id) is not None or file_id in self._coalesced_files()
+
+    def _is_stale(self, f: Dict[str, Any]) -> bool:
+        """
+        Editado en Drive después de guardar su JSON (el propio o el del grupo
+        que lo incluye en `files`): el resultado ya no corresponde al texto.
+        """
+        path = self._cache_path_for_file(f["id"])
+        if path is None and f["id"] in self._coalesced_files():
+            path = os.path.join(self.settings.out_dir, f"{self._coalesced_files()[f['id']]}.json")
+        return path is not None and os.path.isfile(path) and drive_time(f.get("modifiedTime") or "") > os.path.getmtime(path)
+
+    def _load_text(self, cache_key: str) -> Optional[str]:
+        """Texto del que salió el JSON (hash en su .meta.json), si está en el almacén local."""
+        return self.texts.get(self._load_meta(cache_key).get("text_sha256"))
+
+    def _coalesced_files(self) -> Dict[str, str]:
+        """
+        file_ids extraídos junto con otro archivo de su radicado (los JSON van
+        a nombre del más reciente), con la clave del JSON del grupo.
+        """
+        if self._covered is None:
+            self._covered = {}
+            for key in self._cached_keys():
+                self._covered.update(dict.fromkeys(self._load_meta(key).get("files", []), key))
+        return self._covered
+
+    def _cache_path_for_file(self, file_id: str) -> Optional[str]:
+        matches = glob.glob(os.path.join(self.settings.out_dir, f"*__{file_id[:8]}.json"))
+        return matches[0] if matches else None
+
+    def _cached_radicado(self, file_id: str) -> Optional[str]:
+        """Radicado guardado en el cache local del file_id, si existe."""
+        matches = glob.glob(os.path.join(self.settings.out_dir, f"*__{file_id[:8]}.json"))
+        if not matches:
+            return None
+        try:
+            with open(matches[0], "r", encoding="utf-8") as fp:
+                cached = json.load(fp)
+            return str(cached.get("RADICADO") or cached.get("radicado") or "").strip() or None
+        except Exception:
+            return None
     # -------------------------------------------------------------------------------
 
     def process_folder(self) -> None:
-        files = self.drive.list_docx_in_folder(settings.drive_folder_id)
+        self._start_run()
+        files = self.drive.list_docx_in_folder(self.settings.drive_folder_id)
         if not files:
             print("No se encontraron .docx en la carpeta.")
+            self._run_stack.close()
             return
         print(f"Se encontraron {len(files)} archivo(s).")
-        for f in files:
-            try:
-                self.process_one(f["id"], f["name"])
-            except Exception as e:
-                print(f"[ERROR] {f.get('name')}: {e}")
+        self._process_files(files)
+        self._end_run()
 
     def process_folder_only_new(self) -> None:
         """Procesa solo los archivos que aún no tengan cache local."""
-        files = self.drive.list_docx_in_folder(settings.drive_folder_id)
+        self._start_run()
+        files = self.drive.list_docx_in_folder(self.settings.drive_folder_id)
         if not files:
             print("No se encontraron .docx en la carpeta.")
+            self._run_stack.close()
             return
         print(f"Se encontraron {len(files)} archivo(s).")
+        selected = []
         for f in files:
-            try:
-                if self._has_cache_for_file(f["id"]):
-                    print(f"→ Cache encontrado, se omite: {f['name']} ({f['id']})")
-                    continue
-                self.process_one(f["id"], f["name"])
-            except Exception as e:
-                print(f"[ERROR] {f.get('name')}: {e}")
+            if self._is_stale(f):
+                print(f"→ Editado en Drive después de extraerlo: {f['name']} ({f['id']})")
+            elif self._has_cache_for_file(f["id"]):
+                print(f"→ Cache encontrado, se omite: {f['name']} ({f['id']})")
+                continue
+            selected.append(f)
+        self._process_files(selected)
+        self._end_run()
 
     def process_folder_only_pending(self) -> None:
         """Procesa únicamente archivos cuyo radicado no tenga aún información en la
         columna de observaciones (ETIQUETA IA) en la hoja."""
-        files = self.drive.list_docx_in_folder(settings.drive_folder_id)
+        self._start_run()
+        files = self.drive.list_docx_in_folder(self.settings.drive_folder_id)
         if not files:
             print("No se encontraron .docx en la carpeta.")
+            self._run_stack.close()
             return
         print(f"Se encontraron {len(files)} archivo(s).")
+        selected = []
         for f in files:
             try:
                 file_id, filename = f["id"], f["name"]
-                radicado: Optional[str] = None
-                # Intentar obtener el radicado desde el cache local
-                prefix = file_id[:8]
-                pattern = os.path.join(settings.out_dir, f"*__{prefix}.json")
-                matches = glob.glob(pattern)
-                if matches:
-                    try:
-                        with open(matches[0], "r", encoding="utf-8") as fp:
-                            cached = json.load(fp)
-                        radicado = str(cached.get("RADICADO") or cached.get("radicado") or "").strip() or None
-                    except Exception:
-                        radicado = None
-                # Fallback: radicado en el nombre del archivo
-                if not radicado:
-                    radicado = rad.extract_from_filename(filename)
+                # Radicado desde el cache local o, si no, desde el nombre del archivo
+                radicado = self._cached_radicado(file_id) or rad.extract_from_filename(filename)
                 # Fallback final: extraer del contenido
                 if not radicado:
                     text = self.drive.download_docx_text(file_id)
                     radicado = rad.extract_from_text(text)
 
-                if radicado and self.sheets.has_value_in_column(
-                    settings.col_radicado, radicado, settings.col_obs
+                if radicado and self.table.has_value_in_column(
+                    self.settings.col_radicado, radicado, self.settings.col_obs
                 ):
                     print(f"→ Ya subido, se omite: {filename} ({radicado})")
                     continue
 
-                self.process_one(file_id, filename)
+                selected.append(f)
+            except Exception as e:
+                self._report_error(f.get("name"), e)
+        self._process_files(selected)
+        self._end_run()
+
+    def process_folder_scheduled(self) -> None:
+        """
+        Procesa la carpeta por prioridad: radicados nuevos, luego
+        modificaciones (archivo nuevo de un radicado que ya está en la hoja, o
+        editado en Drive después de su JSON, que se vuelve a extraer) y al
+        final el reproceso de lo ya extraído que lo necesita (JSON de una
+        versión anterior del prompt o radicado sin ETIQUETA IA en la hoja).
+        Se detiene antes de pasar los presupuestos diarios (BUDGET_*) o la
+        hora SCHEDULE_DEADLINE; lo terminado queda anotado en
+        SCHEDULE_STATE_PATH y no se repite mientras no cambie en Drive.
+        """
+        self._start_run()
+        files = self.drive.list_docx_in_folder(self.settings.drive_folder_id)
+        if not files:
+            print("No se encontraron .docx en la carpeta.")
+            self._run_stack.close()
+            return
+        budget = RunBudget(
+            self.settings.schedule_state_path,
+            ai_calls=self.settings.budget_ai_calls,
+            ai_tokens=self.settings.budget_ai_tokens,
+            sheet_writes=self.settings.budget_sheet_writes,
+            deadline=parse_deadline(self.settings.schedule_deadline),
+        )
+        jobs = self._schedule(files, budget)
+        counts = ", ".join(f"{len(jobs[p])} {p}" for p in PRIORITIES)
+        print(f"Se encontraron {len(files)} archivo(s); por hacer: {counts}.")
+        queue = [f for p in PRIORITIES for f in jobs[p]]
+        self._budget = budget
+        try:
+            self._process_files(queue)
+        finally:
+            self._budget = None
+            budget.save()
+        if budget.stop_reason:
+            left = sum(1 for f in queue if f["id"] not in budget.done)
+            print(f"Corrida detenida por {budget.stop_reason}; quedan {left} archivo(s) para la próxima.")
+        print(budget.report())
+        self._end_run()
+
+    def _schedule(self, files: List[Dict[str, Any]], budget: RunBudget) -> Dict[str, List[Dict[str, Any]]]:
+        """Archivos por hacer, por prioridad (cada una en orden de modificación)."""
+        jobs: Dict[str, List[Dict[str, Any]]] = {p: [] for p in PRIORITIES}
+        for f in sorted(files, key=lambda f: f.get("modifiedTime") or ""):
+            if budget.is_done(f["id"], f.get("modifiedTime") or ""):
+                continue
+            path = self._cache_path_for_file(f["id"])
+            if path is not None:
+                key = os.path.basename(path)[: -len(".json")]
+                if self._is_stale(f):
+                    jobs["modificacion"].append(f)
+                elif self._outdated(key):
+                    # Versión anterior del prompt: se vuelve a extraer (desde el texto guardado)
+                    jobs["reproceso"].append({**f, "reextract": True})
+                elif not self.table.has_value_in_column(
+                    self.settings.col_radicado, key.split("__")[0], self.settings.col_obs
+                ):
+                    # Extraído pero sin escribir en la hoja: se escribe desde el cache
+                    jobs["reproceso"].append(f)
+                continue
+            if f["id"] in self._coalesced_files():
+                # Ya entró en la extracción de su radicado (ver `_coalesce`)
+                continue
+            hint = rad.extract_from_filename(f["name"])
+            if hint and self.table.has_value_in_column(self.settings.col_radicado, hint, self.settings.col_radicado):
+                jobs["modificacion"].append(f)
+            else:
+                jobs["nuevo"].append(f)
+        return jobs
+
+    def _out_of_budget(self) -> bool:
+        """Con una corrida planificada en curso: True si ya no se debe empezar otro documento."""
+        if self._budget is None:
+            return False
+        stats = self.ai.stats.values()
+        self._budget.update(
+            ai_calls=sum(s.calls for s in stats),
+            ai_tokens=sum(s.prompt_tokens + s.output_tokens for s in stats),
+            sheet_writes=self.sheets.write_requests - self._writes_at_start,
+        )
+        return self._budget.exhausted() is not None
+
+    # ---------- Backfill y auditoría desde el cache local ----------
+    def backfill(self) -> None:
+        """
+        Reescribe la hoja a partir de los JSON de OUT_DIR, sin descargar
+        documentos ni llamar a Gemini (p. ej. tras restaurar la hoja o crear una
+        pestaña nueva). Todas las filas se ubican contra una sola lectura de la
+        hoja y se escriben en pocas peticiones en lote.
+        """
+        t0 = time.perf_counter()
+        keys = self._cached_keys()
+        if not keys:
+            print(f"No hay resultados en {self.settings.out_dir}.")
+            return
+        print(f"Backfill de {len(keys)} resultado(s) desde {self.settings.out_dir} …")
+        actions: Dict[str, int] = {}
+        writes_before = self.sheets.write_requests
+        # Con la tabla SQLite las filas se ubican en disco y se envían al final con `sync_table`
+        bulk = self.sheets.snapshot() if self.table is self.sheets else contextlib.nullcontext()
+        with bulk:
+            for key, filename, row_json in self._cached_rows(keys):
+                try:
+                    result = self.table.fill_from_json_only_empty(json_data=row_json, **self._fill_kwargs(filename))
+                    actions[result["action"]] = actions.get(result["action"], 0) + 1
+                except Exception as e:
+                    self._report_error(key, e)
+        self.sync_table()
+        self.audit_log.flush()
+        summary = ", ".join(f"{a}: {n}" for a, n in sorted(actions.items())) or "sin filas"
+        print(
+            f"Backfill terminado en {time.perf_counter() - t0:.1f}s ({summary}; "
+            f"{self.sheets.write_requests - writes_before} petición(es) de escritura)."
+        )
+
+    def reprocess(self, workers: Optional[int] = None) -> Dict[str, int]:
+        """
+        Vuelve a extraer los resultados de OUT_DIR guardados con una versión
+        anterior del prompt (`PROMPT_VERSION`), desde el almacén local de
+        textos y con REPROCESS_WORKERS documentos en paralelo. Solo se
+        descargan los resultados antiguos que no tienen texto guardado. Las
+        filas de los resultados que cambiaron se escriben al final contra una
+        sola lectura de la hoja, en lote como en `backfill`: además de llenar
+        vacíos, un valor que cambió reemplaza al anterior si la celda aún
+        tiene lo extraído antes; si alguien la editó, se reporta y no se toca.
+        """
+        t0 = time.perf_counter()
+        keys = [key for key in self._cached_keys() if self._outdated(key)]
+        if not keys:
+            print(f"Todos los resultados de {self.settings.out_dir} están en la versión {PROMPT_VERSION} del prompt.")
+            return {}
+        workers = max(1, workers or self.settings.reprocess_workers)
+        print(f"Reproceso de {len(keys)} resultado(s) a la versión {PROMPT_VERSION} del prompt ({workers} en paralelo) …")
+        self.ai.reset_stats()
+        counts = {"cambiados": 0, "sin_cambios": 0, "errores": 0, "valores_no_escritos": 0}
+        docs = []
+        for key in keys:
+            try:
+                docs.append(self._stored_doc(key))
             except Exception as e:
-                print(f"[ERROR] {f.get('name')}: {e}")
+                counts["errores"] += 1
+                self._report_error(key, e)
+        changed: List[Tuple[PendingDoc, List[Dict[str, Any]], Optional[Dict[str, Any]]]] = []
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(self.ai.summarize, doc.text): doc for doc in docs}
+            for future in as_completed(futures):
+                doc = futures[future]
+                try:
+                    before = self._load_json_if_exists(doc.cache_key)
+                    rows = self._normalize_and_save(doc, future.result())
+                except Exception as e:
+                    counts["errores"] += 1
+                    self._report_error(doc.cache_key, e)
+                    continue
+                if self._load_json_if_exists(doc.cache_key) == before:
+                    counts["sin_cambios"] += 1
+                else:
+                    counts["cambiados"] += 1
+                    changed.append((doc, rows, before))
+        writes_before = self.sheets.write_requests
+        # Valores nuevos que no se escribieron porque la celda ya no tiene lo extraído antes
+        kept: List[str] = []
+        if changed:
+            bulk = self.sheets.snapshot() if self.table is self.sheets else contextlib.nullcontext()
+            with bulk:
+                for doc, rows, before in changed:
+                    old_rows = {r["ITEM"]: r for r in self._rows_from_data(before, doc.filename)} if before else {}
+                    try:
+                        for row_json in rows:
+                            old = old_rows.get(row_json["ITEM"], {})
+                            previous = {
+                                k: v for k, v in old.items() if k not in ("ITEM", "ARCHIVO") and v != row_json.get(k)
+                            }
+                            res = self.table.fill_from_json_only_empty(
+                                json_data=row_json, previous=previous, **self._fill_kwargs(doc.filename)
+                            )
+                            cols = sorted(
+                                {FIELD_MAP.get(k, k) for k in previous if str(row_json.get(k) or "").strip()}
+                                & set(res.get("skipped") or [])
+                            )
+                            if cols:
+                                counts["valores_no_escritos"] += len(cols)
+                                kept.append(f"{res['radicado']} ITEM {row_json['ITEM']}: {', '.join(cols)}")
+                    except Exception as e:
+                        self._report_error(doc.cache_key, e)
+            self.sync_table()
+            self.audit_log.flush()
+        if kept:
+            print(f"Valores nuevos sin escribir porque la celda fue editada ({len(kept)} fila(s)):")
+            for line in kept:
+                print(f"   {line}")
+        summary = ", ".join(f"{k}: {n}" for k, n in counts.items())
+        print(
+            f"Reproceso terminado en {time.perf_counter() - t0:.1f}s ({summary}; "
+            f"{self.sheets.write_requests - writes_before} petición(es) de escritura)."
+        )
+        print(self.ai.routing_report())
+        return counts
+
+    def _outdated(self, cache_key: str) -> bool:
+        """Resultado extraído con una versión anterior del prompt (o de antes de registrarla)."""
+        return int(self._load_meta(cache_key).get("prompt_version") or 0) < PROMPT_VERSION
+
+    def _stored_doc(self, cache_key: str) -> PendingDoc:
+        """Documento de un resultado guardado, con su texto del almacén local (o de Drive si no está)."""
+        meta = self._load_meta(cache_key)
+        file_id = meta.get("file_id") or ""
+        filename = meta.get("filename") or ""
+        members = [{"id": fid} for fid in meta.get("files", [])]
+        text = self.texts.get(meta.get("text_sha256"))
+        if text is None:
+            if not file_id or len(members) > 1:
+                raise ValueError("sin texto guardado; procesar de nuevo desde Drive con process_folder")
+            print(f"   Sin texto guardado, se descarga: {filename or file_id}")
+            text = self.drive.download_docx_text(file_id)
+        return PendingDoc(file_id, filename, text, cache_key.split("__")[0], cache_key, members=members)
+
+    def audit(self) -> str:
+        """
+        Concilia la hoja con los resultados de OUT_DIR en una sola lectura,
+        con la misma llave compuesta de `fill_from_json_only_empty`. Guarda un
+        reporte JSON (faltantes, divergentes, duplicados, filas sin resultado)
+        y devuelve su ruta.
+        """
+        keys = self._cached_keys()
+        expected = [
+            {"json_data": row_json, "filename": filename, "cache_key": key}
+            for key, filename, row_json in self._cached_rows(keys)
+        ]
+        with self.sheets.snapshot():
+            report = self.sheets.audit(
+                expected,
+                col_radicado=self.settings.col_radicado,
+                col_archivo=self.settings.col_archivo,
+                field_map=FIELD_MAP,
+                ignore_cols=[self.settings.col_obs, self.settings.col_updated],
+            )
+        report = {
+            "generated_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            "sheet": self.settings.worksheet_name,
+            "results": len(keys),
+            **report,
+        }
+        out = os.path.join(self.settings.out_dir, "auditorias")
+        os.makedirs(out, exist_ok=True)
+        path = os.path.join(out, f"auditoria_{datetime.now():%Y%m%d_%H%M%S}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        summary = ", ".join(f"{k}: {v}" for k, v in report["summary"].items())
+        print(f"Auditoría de {len(keys)} resultado(s) ({summary}). Reporte: {path}")
+        return path
+
+    def _cached_rows(self, keys: List[str]) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """(clave, archivo, fila) de cada resultado en cache, expandido con `_rows_from_data`."""
+        names = self._backfill_filenames(keys)
+        for key in keys:
+            try:
+                data = self._load_json_if_exists(key) or {}
+            except ValueError as e:
+                self._report_error(key, e)
+                continue
+            if str(data.get("RADICADO") or "").strip() == "":
+                data["RADICADO"] = key.split("__")[0]
+            self._ensure_equipos_array(data)
+            filename = names.get(key) or ""
+            for row_json in self._rows_from_data(data, filename):
+                yield key, filename, row_json
+
+    def _backfill_filenames(self, keys: List[str]) -> Dict[str, str]:
+        """Nombre de archivo por clave: del .meta.json o, para caches antiguos, del listado de Drive."""
+        names = {key: self._load_meta(key).get("filename") for key in keys}
+        missing = [key for key, name in names.items() if not name]
+        if missing:
+            print(f"   {len(missing)} resultado(s) sin .meta.json; se consultan los nombres en Drive (sin descargar).")
+            by_prefix = {
+                f["id"][:8]: f["name"] for f in self.drive.list_docx_in_folder(self.settings.drive_folder_id)
+            }
+            for key in missing:
+                names[key] = by_prefix.get(key.split("__")[-1], "")
+        return names
+    # ---------------------------------------------------
+
+    # ---------- Archivo histórico ----------
+    def rollover(self, before: Optional[str] = None, closed_file: Optional[str] = None) -> Dict[str, int]:
+        """
+        Mueve a pestañas por año los bloques de radicados cerrados o con todas
+        sus filas anteriores a `before` (aaaa-mm-dd; por defecto ARCHIVE_BEFORE),
+        para que las lecturas de la hoja principal crezcan con el trabajo activo
+        y no con el histórico.
+        """
+        before = before if before is not None else self.settings.archive_before
+        closed_file = closed_file if closed_file is not None else self.settings.archive_closed_file
+        cutoff = datetime.strptime(before, "%Y-%m-%d").date() if before else None
+        closed: List[str] = []
+        if closed_file:
+            with open(closed_file, "r", encoding="utf-8") as f:
+                closed = [line.strip() for line in f if line.strip()]
+        if cutoff is None and not closed:
+            print("Indica ARCHIVE_BEFORE (aaaa-mm-dd) o ARCHIVE_CLOSED_FILE para archivar.")
+            return {}
+        policy = archive_policy(self.settings.worksheet_name, self.settings.archive_date_col, cutoff, closed)
+        self.sync_table()
+        moved = self.sheets.rollover(self.settings.col_radicado, policy)
+        if moved and self.table is not self.sheets:
+            # Los borrados corren las filas de la hoja: la copia local se vuelve a traer
+            self.import_table()
+        if not moved:
+            print("No hay filas para archivar.")
+        for tab, n in sorted(moved.items()):
+            print(f"   {n} fila(s) → {tab}")
+        print(f"Índice de archivo: {len(self.archive_index)} radicado(s) en {self.settings.archive_index_path}")
+        return moved
+    # ---------------------------------------
+
+    # ---------- Tabla local (TABLE_BACKEND=sqlite) ----------
+    def sync_table(self) -> int:
+        """Envía a la hoja las filas pendientes de la tabla SQLite local. Devuelve las filas enviadas."""
+        if not isinstance(self.table, SqliteTable):
+            return 0
+        pending = self.table.pending_rows()
+        if not pending:
+            return 0
+        print(f"Sincronizando {pending} fila(s) de {self.settings.sqlite_table_path} con '{self.settings.worksheet_name}' …")
+        return self.table.sync_to(self.sheets)
+
+    def import_table(self) -> int:
+        """Reemplaza la tabla SQLite local por el contenido actual de la hoja."""
+        if not isinstance(self.table, SqliteTable):
+            return 0
+        pending = self.table.pending_rows()
+        if pending:
+            raise RuntimeError(f"La tabla local tiene {pending} fila(s) sin sincronizar; ejecuta sync_table() primero.")
+        n = self.table.import_from(self.sheets)
+        print(f"Tabla local actualizada desde '{self.settings.worksheet_name}': {n} fila(s).")
+        return n
+    # ---------------------------------------
+
+    # ---------- Reparto entre workers (LEASE_DB_PATH) ----------
+    def _claim(self, doc: PendingDoc) -> bool:
+        """
+        Reclama el radicado de `doc` antes de llamar a la IA. Se omiten los
+        archivos que otro worker ya terminó en esta corrida; los de un radicado
+        con lease ajeno vigente se dejan para el final (`_deferred`). Sin
+        LEASE_DB_PATH siempre es True.
+        """
+        if self.leases is None:
+            return True
+        owner = self.leases.done_by_other(doc.file_id, self._run_started)
+        if owner:
+            print(f"→ Ya procesado por {owner}, se omite: {doc.filename} ({doc.radicado})")
+            return False
+        lease = self.leases.acquire(doc.radicado)
+        if lease is None:
+            print(f"→ Radicado {doc.radicado} en proceso por otro worker, queda para el final: {doc.filename}")
+            self._deferred.extend(doc.files)
+            return False
+        # Latido: los radicados ya tomados siguen siendo de este worker mientras avance
+        self.leases.renew_all()
+        # Lo tuvo otro después de leer la hoja: sus filas no están en la copia en memoria
+        doc.inherited = lease.previous_owner is not None and lease.previous_until >= self._run_started
+        return True
+
+    def _check_lease(self, doc: PendingDoc) -> None:
+        if self.leases is not None and not self.leases.renew(doc.radicado):
+            raise RuntimeError(f"El lease de {doc.radicado} venció y lo tomó otro worker; no se escribe {doc.filename}")
+
+    def _mark_done(self, doc: PendingDoc) -> None:
+        self.docs_finished += 1
+        for f in doc.files:
+            if self.leases is not None:
+                self.leases.mark_done(f["id"], doc.radicado)
+            if self._budget is not None:
+                self._budget.mark_done(f["id"])
+    # ---------------------------------------
+
+    # ---------- Modo asíncrono ----------
+    def run(self, mode: str = "all") -> None:
+        """Envoltorio síncrono de `run_async` (para main.py o la GUI)."""
+        asyncio.run(self.run_async(mode))
+
+    async def run_async(
+        self,
+        mode: str = "all",
+        session: Optional[AsyncGoogleSession] = None,
+        limiters: Optional[Dict[str, FairRateLimiter]] = None,
+    ) -> None:
+        """
+        Equivalente concurrente de `process_folder*` sobre los clientes
+        asíncronos: descarga, IA y escritura de varios documentos se solapan
+        (hasta ASYNC_MAX_IN_FLIGHT a la vez). Modos: all | only_new | only_pending.
+
+        Con `session` (abierta por quien llama) y `limiters` por API ("drive",
+        "sheets", "gemini"), comparte conexiones y cupos con otros pipelines
+        del mismo proceso (ver `MultiTenantRunner`).
+        """
+        if mode not in RUN_MODES:
+            raise ValueError(f"Modo desconocido: {mode!r} (usa {', '.join(RUN_MODES)})")
+        if self.cassette is not None:
+            # Los clientes asíncronos van por aiohttp, fuera de las envolturas del cassette
+            raise RuntimeError("CASSETTE_MODE solo aplica a process_folder*, backfill y reprocess (modo síncrono).")
+        self._start_run(live_sheet=False)
+        limit = self.settings.async_max_in_flight
+        limiters = limiters or {}
+        async with contextlib.AsyncExitStack() as stack:
+            if session is None:
+                session = await stack.enter_async_context(AsyncGoogleSession(self.creds, limit=limit))
+            if limiters:
+                session = TenantSession(session, self.name, limiters)
+            drive = AsyncDriveClient(self.drive_service, session, **self._download_kwargs())
+            if self.table is self.sheets:
+                if isinstance(self.audit_log, SheetAuditLog):
+                    # La tabla asíncrona toma las escrituras de la traza mientras dura la corrida
+                    stack.callback(setattr, self.audit_log, "on_write", self.audit_log.on_write)
+                sheets = await AsyncSheetsTable.create(
+                    self.sheets_service, session, max_rpm=self.settings.sheets_max_rpm, **self._sheet_kwargs()
+                )
+                await stack.enter_async_context(sheets.snapshot())
+                stack.callback(self.audit_log.flush)
+            else:
+                sheets = AsyncSheetsTable(self.table)
+            ai = AsyncAIClient(self.ai, max_in_flight=limit, limiter=limiters.get("gemini"), tenant=self.name)
+            files = await drive.list_docx_in_folder(self.settings.drive_folder_id)
+            if files:
+                print(f"Se encontraron {len(files)} archivo(s).")
+            else:
+                print("No se encontraron .docx en la carpeta.")
+            sem = asyncio.Semaphore(limit)
+
+            async def one(f: Dict[str, Any]) -> None:
+                async with sem:
+                    try:
+                        await self._process_async(f, mode, drive, sheets, ai)
+                    except Exception as e:
+                        self._report_error(f.get("name"), e)
+
+            await asyncio.gather(*(one(f) for f in files))
+            if self._deferred:
+                files, self._deferred = self._deferred, []
+                print(f"Reintentando {len(files)} archivo(s) de radicados que tenía otro worker …")
+                await asyncio.gather(*(one(f) for f in files))
+        # En un hilo: con otros pipelines en el mismo event loop, el cierre no los detiene
+        await asyncio.to_thread(self._end_run)
+
+    async def _process_async(
+        self,
+        f: Dict[str, Any],
+        mode: str,
+        drive: AsyncDriveClient,
+        sheets: AsyncSheetsTable,
+        ai: AsyncAIClient,
+    ) -> None:
+        file_id, filename = f["id"], f["name"]
+        if mode == "only_new" and self._has_cache_for_file(file_id):
+            print(f"→ Cache encontrado, se omite: {filename} ({file_id})")
+            return
+        hint: Optional[str] = None
+        if mode == "only_pending":
+            hint = self._cached_radicado(file_id) or rad.extract_from_filename(filename)
+            if hint and await sheets.has_value_in_column(self.settings.col_radicado, hint, self.settings.col_obs):
+                print(f"→ Ya subido, se omite: {filename} ({hint})")
+                return
+
+        print(f"→ Procesando: {filename} ({file_id})")
+        text = await drive.download_docx_text(file_id)
+        radicado = rad.resolve(text, filename)
+        if not radicado:
+            raise ValueError(f"No se pudo extraer Radicado de {filename}")
+        if mode == "only_pending" and not hint and await sheets.has_value_in_column(
+            self.settings.col_radicado, radicado, self.settings.col_obs
+        ):
+            print(f"→ Ya subido, se omite: {filename} ({radicado})")
+            return
+
+        cache_key = self._cache_key(radicado, file_id, filename)
+        doc = PendingDoc(file_id, filename, text, radicado, cache_key, self._load_json_if_exists(cache_key))
+        if not self._claim(doc):
+            return
+        data = doc.data
+        if data is None:
+            print(f"   Sin cache para {radicado}. Ejecutando IA …")
+            data = await ai.summarize(text)
+        else:
+            print(f"   Cache JSON encontrado para {radicado} ({filename}). Omitiendo IA.")
+
+        rows = self._normalize_and_save(doc, data)
+        self._check_lease(doc)
+        if doc.inherited:
+            await sheets.refresh()
+        results = []
+        for row_json in rows:
+            results.append(await sheets.fill_from_json_only_empty(json_data=row_json, **self._fill_kwargs(filename)))
+        await sheets.flush()
+        self._mark_done(doc)
+        print(f"   [{filename}] Sheets: {results}")
+    # -------------------------------------
 
     def _ensure_equipos_array(self, data: Dict[str, Any]) -> None:
         """
@@ -174,9 +971,19 @@ class IngestPipeline:
             rows.append(row)
         return rows
 
-    def process_one(self, file_id: str, filename: str, skip_sheet_if_cached: bool = False) -> None:
+    def _prepare(
+        self, file_id: str, filename: str, use_cache: bool = True, local_text: bool = False
+    ) -> PendingDoc:
+        """
+        Descarga, resuelve el radicado y consulta el cache local (sin IA).
+        Con `local_text` (archivo sin cambios desde su JSON) el texto sale del
+        almacén local si está, sin descargar.
+        """
         print(f"→ Procesando: {filename} ({file_id})")
-        text = self.drive.download_docx_text(file_id)
+        path = self._cache_path_for_file(file_id) if local_text else None
+        text = self._load_text(os.path.basename(path)[: -len(".json")]) if path else None
+        if text is None:
+            text = self._download_text(file_id)
 
         # 1) Radicado
         radicado = rad.resolve(text, filename)
@@ -187,68 +994,293 @@ class IngestPipeline:
         # Verifica si hay un archivo existente con el número de radicado
         cache_key = self._cache_key(radicado, file_id, filename)
         data = self._load_json_if_exists(cache_key)
-        if data is None:
-            print(f"   Sin cache para {radicado}. Ejecutando IA …")
-            data = self.ai.summarize(text)
-        else:
-            print(f"   Cache JSON encontrado para {radicado} ({filename}). Omitiendo IA.")
+        if use_cache:
+            return PendingDoc(file_id, filename, text, radicado, cache_key, data)
+        doc = PendingDoc(file_id, filename, text, radicado, cache_key)
+        doc.previous, doc.previous_text = data, self._load_text(cache_key)
+        return doc
+
+    def process_one(
+        self, file_id: str, filename: str, skip_sheet_if_cached: bool = False, use_cache: bool = True
+    ) -> None:
+        doc = self._prepare(file_id, filename, use_cache)
+        if self._claim(doc):
+            self._process_prepared(doc, skip_sheet_if_cached)
+
+    def _process_prepared(self, doc: PendingDoc, skip_sheet_if_cached: bool = False) -> None:
+        data = doc.data
+        if data is not None:
+            print(f"   Cache JSON encontrado para {doc.radicado} ({doc.filename}). Omitiendo IA.")
             if skip_sheet_if_cached:
                 print("   Omitiendo subida a Sheets por cache existente.")
                 return
+        elif doc.previous is not None and doc.previous_text and not self._outdated(doc.cache_key):
+            result = self.ai.summarize_incremental(doc.text, doc.previous_text, doc.previous)
+            if result is not None:
+                data, doc.changed_items = result
+                what = "metadatos y todas las filas" if doc.changed_items is None else f"ITEMs {doc.changed_items}"
+                print(f"   Documento editado ({doc.radicado}): re-extracción parcial, se escriben {what}.")
+        if data is None:
+            print(f"   Sin cache para {doc.radicado}. Ejecutando IA …")
+            data = self.ai.summarize(doc.text, on_metadata=lambda meta: self._on_metadata(doc, meta))
+        self._finish(doc, data)
+
+    def _on_metadata(self, doc: PendingDoc, meta: Dict[str, Any]) -> None:
+        """Metadatos anticipados (streaming): se adelanta la lectura del bloque en Sheets."""
+        print(
+            f"   Metadatos IA: {meta.get('NOMBRE O RAZÓN SOCIAL') or '?'} | "
+            f"{meta.get('TIPO DE SOLICITUD') or '?'} | {meta.get('MUNICIPIO') or '?'}"
+        )
+        try:
+            self.table.prefetch_block(self.settings.col_radicado, doc.radicado)
+        except Exception as e:
+            print(f"   [WARN] No se pudo precargar el bloque {doc.radicado}: {e}")
+
+    def _process_files(self, files: List[Dict[str, Any]], retry_deferred: bool = True) -> None:
+        """
+        Procesa una lista de archivos de Drive. Los documentos cortos sin cache
+        se acumulan y se envían a Gemini en lotes (`summarize_many`), agrupados
+        por longitud para llenar cada lote; los largos van en petición individual.
+        Los archivos de un mismo radicado se extraen juntos (`_coalesce`). Los
+        diferidos por `_claim` se reintentan una vez al final. En una corrida
+        planificada, se deja de empezar documentos al agotar el presupuesto
+        (lo que queda sigue en la próxima corrida).
+        """
+        batching = self.settings.ai_batch_max_docs > 1
+        pending: List[PendingDoc] = []
+        queue = collections.deque(self._coalesce(files))
+        while queue:
+            group = queue.popleft()
+            if self._out_of_budget():
+                break
+            f = group[-1]
+            # Editado en Drive después de extraerlo: se vuelve a extraer lo que cambió
+            local = not any(self._is_stale(g) for g in group)
+            use_cache = local and not any(g.get("reextract") for g in group)
+            try:
+                if len(group) > 1:
+                    doc, others = self._prepare_group(group, use_cache)
+                    # Resultaron de otro radicado: van aparte
+                    queue.extend([o] for o in others)
+                else:
+                    doc = self._prepare(f["id"], f["name"], use_cache, local_text=local)
+                if not self._claim(doc):
+                    continue
+                if (
+                    not batching
+                    or doc.data is not None
+                    or doc.previous is not None
+                    or len(doc.text) > self.settings.ai_batch_short_chars
+                ):
+                    self._process_prepared(doc)
+                    continue
+                print(f"   Documento corto ({len(doc.text)} caracteres). En cola para lote IA …")
+                pending.append(doc)
+                # Ventana de 2 lotes para tener margen al agrupar por longitud
+                if len(pending) >= 2 * self.settings.ai_batch_max_docs:
+                    self._flush_batches(pending)
+                    pending = []
+            except Exception as e:
+                self._report_error(f.get("name"), e)
+        if pending:
+            self._flush_batches(pending)
+        if retry_deferred and self._deferred and not self._out_of_budget():
+            files, self._deferred = self._deferred, []
+            print(f"Reintentando {len(files)} archivo(s) de radicados que tenía otro worker …")
+            self._process_files(files, retry_deferred=False)
+
+    # ---------- Varios archivos por radicado (COALESCE_BY_RADICADO) ----------
+    def _coalesce(self, files: List[Dict[str, Any]]) -> List[List[Dict[str, Any]]]:
+        """
+        Agrupa los archivos por radicado (cache local, nombre del archivo o,
+        si no, una lectura previa del contenido) en el orden de su primera
+        aparición; cada grupo queda del más antiguo al más reciente. Con
+        COALESCE_BY_RADICADO=off, un grupo por archivo.
+        """
+        if self.settings.coalesce_by_radicado == "off":
+            return [[f] for f in files]
+        groups: Dict[str, List[Dict[str, Any]]] = {}
+        for f in files:
+            radicado = self._cached_radicado(f["id"]) or rad.extract_from_filename(f["name"])
+            if not radicado:
+                try:
+                    self._probed[f["id"]] = self.drive.download_docx_text(f["id"])
+                    radicado = rad.extract_from_text(self._probed[f["id"]])
+                except Exception:
+                    radicado = None  # Se reporta al procesarlo solo
+            groups.setdefault(radicado or f"#{f['id']}", []).append(f)
+        return [sorted(g, key=lambda f: f.get("modifiedTime") or "") for g in groups.values()]
+
+    def _prepare_group(
+        self, group: List[Dict[str, Any]], use_cache: bool = True
+    ) -> Tuple[PendingDoc, List[Dict[str, Any]]]:
+        """
+        Un solo documento para los archivos de un radicado, a nombre del más
+        reciente: su JSON si ya cubre a todos; si no, el texto de todos unidos
+        (del más antiguo al más reciente) o solo el del más reciente
+        (COALESCE_BY_RADICADO=latest, o si la unión pasa de COALESCE_MAX_CHARS).
+        Devuelve también los archivos cuyo contenido resultó de otro radicado.
+        """
+        latest = group[-1]
+        print(f"→ Procesando {len(group)} archivos del mismo radicado: {', '.join(f['name'] for f in group)}")
+        path = self._cache_path_for_file(latest["id"]) if use_cache else None
+        if path is not None:
+            cache_key = os.path.basename(path)[: -len(".json")]
+            covered = self._load_meta(cache_key).get("files", [latest["id"]])
+            if all(f["id"] in covered for f in group):
+                data = self._load_json_if_exists(cache_key)
+                radicado = cache_key.rsplit("__", 1)[0]
+                return PendingDoc(latest["id"], latest["name"], "", radicado, cache_key, data, members=group), []
+
+        latest_only = self.settings.coalesce_by_radicado == "latest"
+        texts: List[Tuple[Dict[str, Any], str]] = []
+        others: List[Dict[str, Any]] = []
+        radicado = None
+        for f in reversed(group):
+            if latest_only and texts:
+                # Sin leerlos: se confía en el radicado del nombre
+                texts.append((f, ""))
+                continue
+            text = self._download_text(f["id"])
+            found = rad.resolve(text, f["name"])
+            if radicado is None:
+                radicado = found
+                if not radicado:
+                    raise ValueError(f"No se pudo extraer Radicado de {f['name']}")
+            if found == radicado:
+                texts.append((f, text))
+            else:
+                others.append(f)
+        texts.reverse()
+        text = self._merged_text([(f, t) for f, t in texts if t])
+        cache_key = self._cache_key(radicado, latest["id"], latest["name"])
+        doc = PendingDoc(latest["id"], latest["name"], text, radicado, cache_key, members=[f for f, _ in texts])
+        # Extracción anterior del grupo (con menos archivos o editado): base para re-extraer solo lo que cambió
+        doc.previous, doc.previous_text = self._load_json_if_exists(cache_key), self._load_text(cache_key)
+        return doc, others
+
+    def _download_text(self, file_id: str) -> str:
+        """Texto del archivo: el leído en `_coalesce` si lo hay; si no, se descarga."""
+        text = self._probed.pop(file_id, None)
+        return text if text is not None else self.drive.download_docx_text(file_id)
 
+    def _merged_text(self, docs: List[Tuple[Dict[str, Any], str]]) -> str:
+        if len(docs) == 1:
+            return docs[0][1]
+        parts = [f"=== Archivo {i} de {len(docs)}: {f['name']} ===\n{text}" for i, (f, text) in enumerate(docs, start=1)]
+        merged = COALESCE_HEADER + "\n\n".join(parts)
+        if len(merged) > self.settings.coalesce_max_chars:
+            print(f"   Texto unido de {len(merged)} caracteres; se extrae solo el más reciente.")
+            return docs[-1][1]
+        return merged
+    # -------------------------------------------------------------------------
+
+    def _pack_batches(self, docs: List[PendingDoc]) -> List[List[PendingDoc]]:
+        """
+        Agrupa por variante de prompt (para que cada lote use el prefijo más
+        corto) y por longitud (mayor primero) sin pasar el máximo de
+        docs/caracteres por lote.
+        """
+        by_variant: Dict[str, List[PendingDoc]] = {}
+        for doc in docs:
+            by_variant.setdefault(variant_for(classify_request(doc.text)), []).append(doc)
+
+        batches: List[List[PendingDoc]] = []
+        for group in by_variant.values():
+            group_batches: List[List[PendingDoc]] = []
+            sizes: List[int] = []
+            for doc in sorted(group, key=lambda d: len(d.text), reverse=True):
+                n = len(doc.text)
+                for i, batch in enumerate(group_batches):
+                    if len(batch) < self.settings.ai_batch_max_docs and sizes[i] + n <= self.settings.ai_batch_max_chars:
+                        batch.append(doc)
+                        sizes[i] += n
+                        break
+                else:
+                    group_batches.append([doc])
+                    sizes.append(n)
+            batches.extend(group_batches)
+        return batches
+
+    def _flush_batches(self, docs: List[PendingDoc]) -> None:
+        for batch in self._pack_batches(docs):
+            if self._out_of_budget():
+                print(f"   Lote IA omitido por presupuesto: {', '.join(d.filename for d in batch)}")
+                continue
+            names = ", ".join(d.filename for d in batch)
+            print(f"   Lote IA de {len(batch)} documento(s): {names}")
+            try:
+                results = self.ai.summarize_many([d.text for d in batch])
+            except Exception as e:
+                for d in batch:
+                    self._report_error(d.filename, e)
+                continue
+            for doc, data in zip(batch, results):
+                if isinstance(data, Exception):
+                    # solo ese documento falló: los demás del lote siguen
+                    self._report_error(doc.filename, data)
+                    continue
+                try:
+                    self._finish(doc, data)
+                except Exception as e:
+                    self._report_error(doc.filename, e)
+
+    def _finish(self, doc: PendingDoc, data: Dict[str, Any]) -> None:
+        """Normaliza, guarda el JSON y escribe las filas en Sheets."""
+        rows = self._normalize_and_save(doc, data)
+        if doc.changed_items is not None:
+            skipped = len(rows)
+            rows = [r for r in rows if r["ITEM"] in doc.changed_items]
+            print(f"   Equipos sin cambios, no se escriben: {skipped - len(rows)}")
+        self._check_lease(doc)
+        if doc.inherited:
+            self.table.refresh()
+        results = []
+        for row_json in rows:
+            result = self.table.fill_from_json_only_empty(json_data=row_json, **self._fill_kwargs(doc.filename))
+            results.append(result)
+        self.table.flush()
+        self._mark_done(doc)
+        print(f"   Sheets: {results}")
+
+    def _normalize_and_save(self, doc: PendingDoc, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Pasos 3–5 de `_finish`: normaliza, persiste el JSON y lo expande a filas."""
         # 3) Normalizaciones mínimas de licencia
         if "Radicado" in data and "RADICADO" not in data:
             data["RADICADO"] = data.pop("Radicado")
         if str(data.get("RADICADO") or "").strip() == "":
-            data["RADICADO"] = radicado
+            data["RADICADO"] = doc.radicado
 
         # 4) Normalizar a EQUIPOS[]
         self._ensure_equipos_array(data)
 
         # 5) Guardar/actualizar cache local (persistir normalizaciones)
-        path = self._save_json(cache_key, data)
+        previous_meta = self._load_meta(doc.cache_key)
+        meta: Dict[str, Any] = {
+            "file_id": doc.file_id,
+            "filename": doc.filename,
+            # Desde el cache conserva la versión del prompt con que se extrajo (ver `reprocess`)
+            "prompt_version": previous_meta.get("prompt_version", 0) if doc.data is not None else PROMPT_VERSION,
+        }
+        text_sha256 = self.texts.put(doc.text) if doc.text else previous_meta.get("text_sha256")
+        if text_sha256:
+            meta["text_sha256"] = text_sha256
+        if len(doc.files) > 1:
+            # Archivos del radicado que ya entraron en esta extracción
+            meta["files"] = [f["id"] for f in doc.files]
+            self._coalesced_files().update(dict.fromkeys(meta["files"], doc.cache_key))
+        path = self._save_json(doc.cache_key, data, meta)
         print(f"   JSON: {path}")
 
-        # 6) Expandir a filas y escribir en Sheets (solo vacíos)
-        rows = self._rows_from_data(data, filename)
-        results = []
-        for row_json in rows:
-            result = self.sheets.fill_from_json_only_empty(
-                json_data=row_json,
-                col_radicado=settings.col_radicado,   # "RADICADO"
-                col_obs=settings.col_obs,             # "OBSERVACIONES"
-                col_archivo=settings.col_archivo,     # "ARCHIVO" si existe; o None
-                col_updated=settings.col_updated,     # "Última Actualización"
-                filename=filename,
-                field_map={
-                    "ELABORA": "ELABORA",
-                    "RADICADO": "RADICADO",
-                    "FECHA": "FECHA",
-                    "NOMBRE O RAZON SOCIAL": "NOMBRE O RAZÓN SOCIAL",
-                    "NIT O CC": "NIT O CC",
-                    "SEDE": "SEDE",
-                    "DIRECCION": "DIRECCIÓN",
-                    "SUBREGION": "SUBREGIÓN",
-                    "MUNICIPIO": "MUNICIPIO",
-                    "CORREO ELECTRONICO": "CORREO ELECTRÓNICO",
-                    "TIPO DE SOLICITUD": "TIPO DE SOLICITUD",
-                    "TIPO DE EQUIPO": "TIPO DE EQUIPO",
-                    "CATEGORIA": "CATEGORÍA",
-                    "FECHA DE FABRICACION": "FECHA DE FABRICACIÓN",
-                    "MARCA": "MARCA",
-                    "MODELO": "MODELO",
-                    "SERIE": "SERIE",
-                    "MARCA TUBO RX": "MARCA TUBO RX",
-                    "MODELO TUBO RX": "MODELO TUBO RX",
-                    "SERIE TUBO RX": "SERIE TUBO RX",
-                    "FECHA FABRICACIÓN TUBO RX": "FECHA FABRICACIÓN TUBO RX",
-                    "CONTROL CALIDAD": "CONTROL CALIDAD",
-                    "FECHA CC": "FECHA CC",
-                    "OBSERVACIONES": "OBSERVACIONES",
-                    "Ultima Actualizacion": "Ultima Actualizacion",
-                    "ITEM": "ITEM",
-                    "ARCHIVO": "ARCHIVO",
-                },
-            )
-            results.append(result)
-        print(f"   Sheets: {results}")
+        # 6) Expandir a filas (se escriben en Sheets solo en celdas vacías)
+        return self._rows_from_data(data, doc.filename)
+
+    def _fill_kwargs(self, filename: str) -> Dict[str, Any]:
+        return dict(
+            col_radicado=self.settings.col_radicado,   # "RADICADO"
+            col_obs=self.settings.col_obs,             # "OBSERVACIONES"
+            col_archivo=self.settings.col_archivo,     # "ARCHIVO" si existe; o None
+            col_updated=self.settings.col_updated,     # "Última Actualización"
+            filename=filename,
+            field_map=FIELD_MAP,
+        )
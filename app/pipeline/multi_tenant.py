@@ -0,0 +1,86 @@
+# app/pipeline/multi_tenant.py
+"""Varias carpetas/hojas (tenants) en un solo proceso.
+
+Cada tenant es un `IngestPipeline` con su propia configuración (ver
+`load_tenants`) y corre en modo asíncrono en el mismo event loop. Todos
+comparten la sesión HTTP (pool de conexiones) de su cuenta de servicio y
+los cupos por minuto de Drive, Sheets y Gemini, que se reparten por turnos
+entre los tenants que esperan.
+"""
+import asyncio
+import contextlib
+import time
+from typing import Dict, List, Optional, Tuple
+
+from app.config import Settings, load_tenants, settings
+from app.pipeline.ingest import IngestPipeline
+from app.services.async_clients import AsyncGoogleSession
+from app.services.rate_limit import FairRateLimiter
+
+
+class MultiTenantRunner:
+    def __init__(self, tenants: List[Tuple[str, Settings]], config: Settings = settings):
+        if not tenants:
+            raise ValueError("No hay tenants configurados.")
+        self.pipelines = [IngestPipeline(cfg, name=name) for name, cfg in tenants]
+        # Cupos del proceso completo (DRIVE_MAX_RPM, SHEETS_MAX_RPM, GEMINI_MAX_RPM)
+        self.limiters: Dict[str, FairRateLimiter] = {
+            "drive": FairRateLimiter("drive", config.drive_max_rpm),
+            "sheets": FairRateLimiter("sheets", config.sheets_max_rpm),
+            "gemini": FairRateLimiter("gemini", config.gemini_max_rpm),
+        }
+        self.elapsed: Dict[str, float] = {}
+
+    @classmethod
+    def from_file(cls, path: Optional[str] = None) -> "MultiTenantRunner":
+        """Tenants desde TENANTS_FILE (o `path`)."""
+        return cls(load_tenants(path or settings.tenants_file))
+
+    def run(self, mode: str = "all") -> None:
+        """Envoltorio síncrono de `run_async` (para main.py)."""
+        asyncio.run(self.run_async(mode))
+
+    async def run_async(self, mode: str = "all") -> None:
+        """Corre `IngestPipeline.run_async(mode)` de todos los tenants a la vez."""
+        async with contextlib.AsyncExitStack() as stack:
+            # Una sesión por cuenta de servicio: el token del Service Account va en cada petición
+            sessions: Dict[str, AsyncGoogleSession] = {}
+            for p in self.pipelines:
+                key = p.settings.service_account_path
+                if key not in sessions:
+                    limit = sum(q.settings.async_max_in_flight for q in self.pipelines
+                                if q.settings.service_account_path == key)
+                    sessions[key] = await stack.enter_async_context(AsyncGoogleSession(p.creds, limit=limit))
+            results = await asyncio.gather(
+                *(self._run_one(p, mode, sessions[p.settings.service_account_path]) for p in self.pipelines),
+                return_exceptions=True,
+            )
+        for p, result in zip(self.pipelines, results):
+            if isinstance(result, Exception):
+                print(f"[ERROR] Tenant {p.name}: {result}")
+        print(self.report())
+
+    async def _run_one(self, pipeline: IngestPipeline, mode: str, session: AsyncGoogleSession) -> None:
+        t0 = time.monotonic()
+        try:
+            await pipeline.run_async(mode, session=session, limiters=self.limiters)
+        finally:
+            self.elapsed[pipeline.name] = time.monotonic() - t0
+
+    def report(self) -> str:
+        """Documentos por minuto y peticiones (con la espera de turno) por tenant y API."""
+        lines = ["Rendimiento por tenant:"]
+        for p in self.pipelines:
+            seconds = self.elapsed.get(p.name, 0.0)
+            rate = p.docs_finished * 60 / seconds if seconds else 0.0
+            apis = [
+                f"{api} {usage.requests} ({usage.waited:.1f}s en espera)"
+                for api, limiter in self.limiters.items()
+                for usage in [limiter.usage.get(p.name)]
+                if usage is not None
+            ]
+            lines.append(
+                f"  {p.name}: {p.docs_finished} documento(s) en {seconds:.0f}s ({rate:.1f}/min); "
+                f"{', '.join(apis) or 'sin peticiones'}"
+            )
+        return "\n".join(lines)
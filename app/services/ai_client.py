@@ -1,12 +1,20 @@
 # app/services/ai_client.py
 import json
 import re
-from typing import Dict, Any
+from dataclasses import dataclass
+from typing import Callable, Dict, Any, Iterator, List, Optional, Tuple, Union
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from google import genai  # paquete google-genai (pip install google-genai)
 
+from app.services import extraction_rules as rules
+from app.services.request_classifier import classify_request, variant_for
+from app.services.text_blocks import EQUIPO_MARKER_RE, qc_lines, split_equipment_blocks
+from app.services.prompt_cache import GeminiCacheBackend, PromptCacheBackend, PromptPrefixCache
+
 # NOTA: Todas las llaves del JSON del prompt están ESCAPADAS con {{ }}
-PROMPT_TEMPLATE = """\
+_PROMPT_REGLAS = """\
 Extrae la siguiente información del texto de la licencia de rayos X que te doy a continuación.
 Formato de fechas: día/mes/año (dd/mm/aaaa). Respeta mayúsculas/acentos exactamente como se listan.
 
@@ -32,6 +40,9 @@ y sus datos, para que sea más claro que en este caso se debe poner Modificació
 - Abreviar Radioprotección e Ingeniería SAS a REI
 - Siempre has coincidir el municipio con su subregión respectiva, esto es vital.
 
+"""
+
+_PROMPT_UBICACION = """\
 Listas permitidas
 SUBREGIÓN:
 - BAJO CAUCA
@@ -55,6 +66,9 @@ MUNICIPIO:
 - URABÁ: APARTADÓ, ARBOLETES, CAREPA, CHIGORODÓ, MURINDÓ, MUTATA, NECOCLÍ, SAN JUAN DE URABÁ, SAN PEDRO DE URABÁ, TURBO, VIGÍA DEL FUERTE
 - VALLE DE ABURRÁ: BARBOSA, BELLO, CALDAS, COPACABANA, ENVIGADO, GIRARDOTA, ITAGÜÍ, LA ESTRELLA, MEDELLÍN, SABANETA
 
+"""
+
+_PROMPT_SOLICITUD = """\
 TIPO DE SOLICITUD:
 - Primera vez
 - Modificación OPR/EPR
@@ -64,6 +78,9 @@ TIPO DE SOLICITUD:
 - Corrección
 - PSPRYCC (Prestación de Servicio de Protección Radiológica y Control de Calidad)
 
+"""
+
+_PROMPT_EQUIPOS = """\
 MARCAS (preferente; si no, transcribe la del texto):
 - ACCURAY, AJEX MEDITECH, AMERICAN X RAY, AMERICOMP, AMRAD, ARDET, BELMONT,
   BIOMEDICAL INTERNATIONAL, BLUE X IMAGING, CANON, CARESTREAM, DENTAL SAN JUSTO,
@@ -87,9 +104,15 @@ TIPO DE EQUIPO (lista cerrada):
   ANGIÓGRAFO, ACELERADOR LINEAL, PET-CT, SPECT-CT, RADIOCIRUGÍA ROBÓTICA, INDUSTRIAL BAJA COMPLEJIDAD,
   INDUSTRIAL ALTA COMPLEJIDAD, INVESTIGACIÓN, VETERINARIO
 
+"""
+
+_PROMPT_CATEGORIA = """\
 Categoría de licencia (lista cerrada):
 - I ODONTOLÓGICO, II ODONTOLÓGICO, I MÉDICO, II MÉDICO, I INDUSTRIAL, II INDUSTRIAL, II INVESTIGACIÓN, II VETERINARIO
 
+"""
+
+_PROMPT_SALIDA = """\
 Salida obligatoria:
 - Devuelve **exclusivamente** un JSON válido, sin texto adicional.
 - Estructura:
@@ -124,13 +147,199 @@ Salida obligatoria:
     }}
   ]
 }}
+"""
+
+PROMPT_INSTRUCTIONS = (
+    _PROMPT_REGLAS
+    + _PROMPT_UBICACION
+    + _PROMPT_SOLICITUD
+    + _PROMPT_EQUIPOS
+    + _PROMPT_CATEGORIA
+    + _PROMPT_SALIDA
+)
+
+# Variante para modificaciones administrativas (OPR/EPR, razón social): sin equipos
+_PROMPT_REGLAS_SIN_EQUIPOS = """\
+Extrae la siguiente información del texto de la licencia de rayos X que te doy a continuación.
+Formato de fechas: día/mes/año (dd/mm/aaaa). Respeta mayúsculas/acentos exactamente como se listan.
+
+La solicitud es una modificación administrativa (OPR/EPR o razón social/representante legal):
+NO se extraen equipos, tubos ni control de calidad; `EQUIPOS` debe ser null.
+
+Reglas de normalización:
+- Abreviar “EMPRESA SOCIAL DEL ESTADO” → ESE; “Instituciones Prestadoras de Servicios de Salud” → IPS.
+- Para `SUBREGIÓN`, `MUNICIPIO`, `CATEGORÍA`, elegir estrictamente de las listas provistas.
+- `TIPO DE SOLICITUD` se indica junto al texto; cópialo tal cual.
+- No llenar la información del radicado.
+- Siempre has coincidir el municipio con su subregión respectiva, esto es vital.
+
+"""
+
+_PROMPT_SALIDA_SIN_EQUIPOS = """\
+Salida obligatoria:
+- Devuelve **exclusivamente** un JSON válido, sin texto adicional.
+- Estructura:
+
+{{
+  "ELABORA": "VANESSA P.",
+  "RADICADO": "",
+  "FECHA": "",
+  "NOMBRE O RAZÓN SOCIAL": "",
+  "NIT O CC": "",
+  "SEDE": "",
+  "DIRECCIÓN": "",
+  "SUBREGIÓN": "",
+  "MUNICIPIO": "",
+  "CORREO ELECTRÓNICO": "",
+  "TIPO DE SOLICITUD": "",
+  "CATEGORÍA": "",
+  "OBSERVACIONES": "",
+  "EQUIPOS": null
+}}
+"""
+
+# Sub-extracciones en paralelo para documentos con muchos equipos
+_PROMPT_REGLAS_METADATOS = """\
+Extrae SOLO los metadatos de la licencia de rayos X (no los equipos) del texto que te doy a continuación.
+Formato de fechas: día/mes/año (dd/mm/aaaa). Respeta mayúsculas/acentos exactamente como se listan.
+Los equipos se extraen por separado: `EQUIPOS` debe ser null.
+
+Reglas de normalización:
+- Abreviar “EMPRESA SOCIAL DEL ESTADO” → ESE; “Instituciones Prestadoras de Servicios de Salud” → IPS.
+- Para `SUBREGIÓN`, `MUNICIPIO`, `TIPO DE SOLICITUD`, `CATEGORÍA`, elegir estrictamente de las listas provistas.
+- En caso de que exista una sección de DATOS A MODIFICAR, revisar qué elemento se encuentran en esa sección, normalmente se encuentra el tubo de rayos x
+y sus datos, para que sea más claro que en este caso se debe poner Modificación cambio tubo
+- No llenar la información del radicado.
+- Siempre has coincidir el municipio con su subregión respectiva, esto es vital.
 
+"""
+
+_PROMPT_REGLAS_EQUIPO = """\
+Extrae los datos de UN SOLO equipo de rayos X a partir del fragmento de licencia que te doy a continuación.
+Formato de fechas: día/mes/año (dd/mm/aaaa). Respeta mayúsculas/acentos exactamente como se listan.
+
+Reglas de normalización:
+- Si un dato del tubo o de serie no aparece, usar exactamente "NO REGISTRA" (mayúsculas).
+- Si no puedes identificar el ente de control de calidad, usar "REVISAR".
+- Para `TIPO DE EQUIPO`, elegir estrictamente de la lista provista.
+- En control de calidad, prioriza la última fecha explícita si aparecen varias.
+- Fecha CC hace referencia a la fecha en que se llevó a cabo el control de calidad. Normalmente viene dado por:
+El control de calidad fue realizado por: [Nombre del ente] el [Fecha]
+- Abreviar Radioprotección e Ingeniería SAS a REI
+
+"""
+
+_PROMPT_SALIDA_EQUIPO = """\
+Salida obligatoria:
+- Devuelve **exclusivamente** un JSON válido (un solo objeto), sin texto adicional.
+- Estructura:
+
+{{
+  "TIPO DE EQUIPO": "",
+  "FECHA DE FABRICACIÓN": "",
+  "MARCA": "",
+  "MODELO": "",
+  "SERIE": "",
+  "MARCA TUBO RX": "",
+  "MODELO TUBO RX": "",
+  "SERIE TUBO RX": "",
+  "FECHA FABRICACIÓN TUBO RX": "",
+  "CONTROL CALIDAD": "",
+  "FECHA CC": ""
+}}
+"""
+
+PROMPT_QC_CONTEXT = """
+Líneas de control de calidad del documento completo (por si aplican a este equipo):
+{lineas}
+"""
+
+# Instrucciones por variante; el tipo detectado localmente va junto al documento
+PROMPT_VARIANTS: Dict[str, str] = {
+    "completo": PROMPT_INSTRUCTIONS,
+    # tipo conocido con equipos: sobra la lista de TIPO DE SOLICITUD
+    "equipos": (
+        _PROMPT_REGLAS + _PROMPT_UBICACION + _PROMPT_EQUIPOS + _PROMPT_CATEGORIA + _PROMPT_SALIDA
+    ),
+    "sin_equipos": (
+        _PROMPT_REGLAS_SIN_EQUIPOS + _PROMPT_UBICACION + _PROMPT_CATEGORIA + _PROMPT_SALIDA_SIN_EQUIPOS
+    ),
+    # modo dividido: una petición de metadatos + una por bloque de equipo
+    "metadatos": (
+        _PROMPT_REGLAS_METADATOS + _PROMPT_UBICACION + _PROMPT_SOLICITUD + _PROMPT_CATEGORIA
+        + _PROMPT_SALIDA_SIN_EQUIPOS
+    ),
+    "equipo": _PROMPT_REGLAS_EQUIPO + _PROMPT_EQUIPOS + _PROMPT_SALIDA_EQUIPO,
+}
+
+PROMPT_DOCUMENT = """
 Texto de la licencia:
 ---
 {texto}
 ---
 """
 
+PROMPT_TEMPLATE = PROMPT_INSTRUCTIONS + PROMPT_DOCUMENT
+
+# Subirla al cambiar las instrucciones: `IngestPipeline.reprocess` vuelve a extraer
+# (desde los textos guardados) los resultados de versiones anteriores
+PROMPT_VERSION = 1
+
+PROMPT_TIPO_HINT = """
+TIPO DE SOLICITUD (detectado en el documento): {tipo}
+"""
+
+# Prefijos estáticos (sin llaves escapadas) que se pueden cachear en Gemini
+PROMPT_PREFIX = PROMPT_INSTRUCTIONS.format()
+PROMPT_PREFIXES: Dict[str, str] = {name: tpl.format() for name, tpl in PROMPT_VARIANTS.items()}
+
+# Varias licencias cortas en una sola petición: las instrucciones fijas se pagan una vez.
+# Va después de PROMPT_PREFIX.
+BATCH_TEMPLATE = """
+Modo lote: a continuación vienen VARIAS licencias. Cada una va entre
+<<<DOC id>>> y <<<FIN DOC id>>>. Aplica las instrucciones anteriores a cada
+licencia por separado, sin mezclar datos entre documentos.
+Devuelve **exclusivamente** un JSON cuyo objeto raíz tenga como llaves los id
+de documento y como valor el JSON de esa licencia, por ejemplo:
+{{"D1": {{...}}, "D2": {{...}}}}
+
+{documentos}
+"""
+
+# Re-consulta puntual: solo los campos faltantes/inválidos y un fragmento del texto
+REASK_TEMPLATE = """\
+En una extracción previa de una licencia de rayos X quedaron vacíos o inválidos algunos campos.
+Usando únicamente el fragmento de texto dado, completa SOLO estos campos:
+{campos}
+
+Reglas:
+- MUNICIPIO debe elegirse de la lista de municipios de Antioquia en mayúsculas con tildes.
+- FECHA CC es la fecha del control de calidad en formato dd/mm/aaaa.
+- Si el dato no aparece en el fragmento, usar exactamente "NO REGISTRA".
+- Devuelve **exclusivamente** un JSON válido con esta estructura:
+{estructura}
+
+Fragmento:
+---
+{fragmento}
+---
+"""
+
+
+def _once(fn: Callable[[Dict[str, Any]], None]) -> Callable[[Dict[str, Any]], None]:
+    """`fn` que solo se ejecuta en la primera llamada (las demás se ignoran)."""
+    lock = threading.Lock()
+    fired = []
+
+    def call(meta: Dict[str, Any]) -> None:
+        with lock:
+            if fired:
+                return
+            fired.append(True)
+        fn(meta)
+
+    return call
+
 
 def _clean_quotes(s: str) -> str:
     # comillas “inteligentes” → ascii
@@ -186,53 +395,682 @@ def _parse_json_loose(raw: str) -> dict:
     txt2 = _fix_trailing_commas(txt)
     return json.loads(txt2)
 
+class StreamAborted(RuntimeError):
+    """La respuesta en streaming claramente no es JSON; se corta para reintentar."""
+
+
+class IncrementalJSONParser:
+    """
+    Analiza la respuesta a medida que llegan los fragmentos del streaming:
+    - detecta temprano una salida que no es JSON (prosa sin `{`), y
+    - entrega los metadatos de la licencia (llaves raíz antes de "EQUIPOS")
+      en cuanto el modelo empieza a escribir la lista de equipos.
+    """
+
+    def __init__(self, probe_chars: int = 120, split_key: str = "EQUIPOS"):
+        self.probe_chars = probe_chars
+        self.split_key = split_key
+        self.buffer = ""
+        self.metadata: Optional[Dict[str, Any]] = None
+        self._pos = 0
+        self._depth = 0
+        self._in_str = False
+        self._esc = False
+        self._root_start = -1
+        self._key_start = -1
+        self._prev = ""  # último carácter significativo fuera de cadenas
+
+    def feed(self, chunk: str) -> None:
+        self.buffer += _clean_quotes(chunk)
+        self._scan()
+
+    def looks_invalid(self) -> bool:
+        """True si ya hay suficiente texto significativo y ningún `{` a la vista."""
+        if self._root_start != -1:
+            return False
+        head = self.buffer.strip()
+        if head.startswith("```"):
+            head = head.split("\n", 1)[1] if "\n" in head else ""
+        return len(head) >= self.probe_chars
+
+    def _scan(self) -> None:
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+            if self._in_str:
+                if self._esc:
+                    self._esc = False
+                elif c == "\\":
+                    self._esc = True
+                elif c == '"':
+                    self._in_str = False
+                    if self._depth == 1 and self._key_start != -1:
+                        key = buf[self._key_start + 1:i]
+                        if key == self.split_key and self.metadata is None:
+                            self._emit_metadata(self._key_start)
+                        self._key_start = -1
+                continue
+            if c == '"':
+                self._in_str = True
+                # una cadena en profundidad 1 tras `{` o `,` es una llave
+                self._key_start = i if (self._depth == 1 and self._prev in ("{", ",")) else -1
+            elif c in "{[":
+                if self._depth == 0 and c == "{" and self._root_start == -1:
+                    self._root_start = i
+                self._depth += 1
+            elif c in "}]":
+                self._depth -= 1
+            if not c.isspace():
+                self._prev = c
+        self._pos = len(buf)
+
+    def _emit_metadata(self, key_start: int) -> None:
+        partial = self.buffer[self._root_start:key_start].rstrip().rstrip(",") + "}"
+        try:
+            self.metadata = json.loads(_fix_trailing_commas(partial))
+        except Exception:
+            self.metadata = None
+
+
+@dataclass
+class ModelStats:
+    """Contadores por modelo para el reporte de ruteo de cada corrida."""
+    documents: int = 0   # documentos que llegaron a este modelo
+    accepted: int = 0    # documentos cuyo resultado final salió de este modelo
+    escalated: int = 0   # documentos que fallaron validación y subieron de nivel
+    calls: int = 0       # llamadas al API (incluye reintentos y re-consultas)
+    seconds: float = 0.0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+
+@dataclass
+class VariantStats:
+    """Consumo por variante de prompt (completo, equipos, sin_equipos, lote, reconsulta)."""
+    documents: int = 0
+    calls: int = 0
+    seconds: float = 0.0
+    prompt_tokens: int = 0
+    output_tokens: int = 0
+
+
+class _Routing:
+    """
+    Decisiones del ruteo por niveles, sin I/O (compartidas por `AIClient` y
+    `AsyncAIClient`): recorre `models` contando documentos, escala si el
+    resultado no valida o el modelo no entregó JSON, y al final devuelve el
+    mejor resultado previo. Quien la usa solo hace la consulta a cada modelo.
+    """
+
+    def __init__(self, ai: "AIClient", models: List[str], fallback: Optional[Dict[str, Any]] = None):
+        self.ai = ai
+        self.models = models
+        self.fallback = fallback
+        self.fallback_model = ai.models[0]
+        self.last_err: Optional[Exception] = None
+        self._model = ""
+        self._is_last = False
+
+    def __iter__(self) -> Iterator[str]:
+        for level, model in enumerate(self.models):
+            self.ai._count(model, "documents")
+            self._model, self._is_last = model, level == len(self.models) - 1
+            yield model
+
+    def failed(self, err: Exception) -> None:
+        """El modelo actual no entregó un JSON parseable."""
+        self.last_err = err
+        if not self._is_last:
+            self.ai._count(self._model, "escalated")
+
+    def accept(self, payload: Dict[str, Any]) -> bool:
+        """True si `payload` es el resultado final; si no, queda de respaldo y se escala."""
+        if self._is_last or not rules.validate(payload):
+            self.ai._count(self._model, "accepted")
+            return True
+        self.ai._count(self._model, "escalated")
+        self.fallback, self.fallback_model = payload, self._model
+        return False
+
+    def result(self) -> Dict[str, Any]:
+        """Sin resultado aceptado: el respaldo o el último error."""
+        if self.fallback is not None:
+            # el modelo fuerte no pudo parsear; se conserva el resultado del rápido
+            self.ai._count(self.fallback_model, "accepted")
+            return self.fallback
+        raise RuntimeError(f"No se pudo parsear JSON del modelo: {self.last_err}")
+
+
 class AIClient:
-    def __init__(self, api_key: str, model_name: str = "models/gemini-2.0-flash-lite"):
-        if not api_key:
+    def __init__(
+        self,
+        api_key: str,
+        model_name: str = "models/gemini-2.0-flash-lite",
+        fast_model: Optional[str] = None,
+        cache_ttl: int = 0,
+        cache_backend: Optional[PromptCacheBackend] = None,
+        client: Any = None,
+        stream: bool = False,
+        split_min_equipos: int = 0,
+        split_workers: int = 4,
+    ):
+        if not api_key and client is None:
             raise RuntimeError("Falta GEMINI_API_KEY")
-        self.client = genai.Client(api_key=api_key)
+        self.client = client if client is not None else genai.Client(api_key=api_key)
+        # Prefijo estático cacheado en el servidor (cache_ttl=0 lo desactiva)
+        self.prompt_cache: Optional[PromptPrefixCache] = None
+        if cache_ttl > 0:
+            self.prompt_cache = PromptPrefixCache(
+                cache_backend or GeminiCacheBackend(self.client), ttl_seconds=cache_ttl
+            )
         self.model_name = model_name
+        # Streaming: parseo incremental, corte temprano y metadatos anticipados
+        self.stream = stream
+        # Modo dividido: con ≥ split_min_equipos bloques de equipo (0 = desactivado)
+        self.split_min_equipos = split_min_equipos
+        self.split_workers = split_workers
+        # Ruteo por niveles: primero el modelo rápido/barato, luego el principal
+        self.models: List[str] = [model_name]
+        if fast_model and fast_model != model_name:
+            self.models.insert(0, fast_model)
+        self.stats: Dict[str, ModelStats] = {}
+        self.variant_stats: Dict[str, VariantStats] = {}
+        self._stats_lock = threading.Lock()
 
-    def summarize(self, text: str) -> Dict[str, Any]:
-        prompt = PROMPT_TEMPLATE.format(texto=text[:25000])  # usa tu PROMPT_TEMPLATE con {{ }} escapadas
-        last_err = None
-        for attempt in range(3):  # hasta 3 intentos con pequeñas variaciones
-            if attempt == 1:
-                # 2º intento: reforzar instrucción de salida única
-                prompt_try = prompt + "\n\nDevuelve únicamente un bloque JSON válido, sin comentarios, sin Markdown."
-            elif attempt == 2:
-                # 3º intento: recortar un poco más el texto por si hay límite de tokens
-                prompt_try = PROMPT_TEMPLATE.format(texto=text[:18000])
+    def reset_stats(self) -> None:
+        self.stats = {}
+        self.variant_stats = {}
+        if self.prompt_cache:
+            self.prompt_cache.reset_stats()
+
+    def _stats_for(self, model: str) -> ModelStats:
+        with self._stats_lock:
+            return self.stats.setdefault(model, ModelStats())
+
+    def _variant_stats_for(self, variant: str) -> VariantStats:
+        with self._stats_lock:
+            return self.variant_stats.setdefault(variant, VariantStats())
+
+    def _count(self, model: str, field: str, n: int = 1) -> None:
+        """Suma `n` a un contador de `ModelStats` (documents, accepted, escalated) bajo el candado."""
+        st = self._stats_for(model)
+        with self._stats_lock:
+            setattr(st, field, getattr(st, field) + n)
+
+    def _count_variant(self, variant: str, n: int = 1) -> None:
+        """Suma `n` documentos a la variante de prompt bajo el candado."""
+        st = self._variant_stats_for(variant)
+        with self._stats_lock:
+            st.documents += n
+
+    def _record_call(self, model: str, variant: Optional[str], seconds: float, usage: Any) -> None:
+        prompt_tokens = int(getattr(usage, "prompt_token_count", 0) or 0)
+        output_tokens = int(getattr(usage, "candidates_token_count", 0) or 0)
+        targets: List[Any] = [self._stats_for(model)]
+        if variant:
+            targets.append(self._variant_stats_for(variant))
+        with self._stats_lock:
+            for st in targets:
+                st.calls += 1
+                st.seconds += seconds
+                st.prompt_tokens += prompt_tokens
+                st.output_tokens += output_tokens
+
+    def routing_report(self) -> str:
+        """Participación y latencia por modelo desde el último `reset_stats`."""
+        total = sum(s.accepted for s in self.stats.values())
+        if not self.stats:
+            return "IA: sin llamadas."
+        lines = ["IA por modelo:"]
+        for model, s in self.stats.items():
+            share = (100.0 * s.accepted / total) if total else 0.0
+            avg = (s.seconds / s.calls) if s.calls else 0.0
+            lines.append(
+                f"   {model}: {s.accepted}/{total} docs ({share:.0f}%), escalados {s.escalated}, "
+                f"{s.calls} llamadas, {s.seconds:.1f}s total, {avg:.2f}s/llamada"
+            )
+        if self.variant_stats:
+            lines.append("IA por variante de prompt:")
+        for variant, v in self.variant_stats.items():
+            avg = (v.seconds / v.calls) if v.calls else 0.0
+            lines.append(
+                f"   {variant}: {v.documents} docs, {v.calls} llamadas, "
+                f"{v.prompt_tokens} tokens entrada / {v.output_tokens} salida, {avg:.2f}s/llamada"
+            )
+        if self.prompt_cache:
+            lines.append(f"   {self.prompt_cache.report()}")
+        return "\n".join(lines)
+
+    def _request_args(self, prompt: str, model: str, prefix: Optional[str]) -> Tuple[Dict[str, Any], bool]:
+        """
+        Arma los argumentos de `generate_content`. Con `prefix` y cache activo se
+        envía solo `prompt` referenciando el contenido cacheado; si no, prefijo + prompt.
+        """
+        handle = self.prompt_cache.handle_for(model, prefix) if (prefix and self.prompt_cache) else None
+        if handle:
+            return {"model": model, "contents": [prompt], "config": {"cached_content": handle}}, True
+        return {"model": model, "contents": [(prefix or "") + prompt]}, False
+
+    def _generate(
+        self,
+        prompt: str,
+        model: Optional[str] = None,
+        prefix: Optional[str] = None,
+        variant: Optional[str] = None,
+    ) -> str:
+        """Una llamada a Gemini; devuelve el texto crudo de la respuesta."""
+        model = model or self.model_name
+        kwargs, cached = self._request_args(prompt, model, prefix)
+        resp = None
+        t0 = time.perf_counter()
+        try:
+            resp = self.client.models.generate_content(**kwargs)
+        finally:
+            self._record_call(
+                model, variant, time.perf_counter() - t0, getattr(resp, "usage_metadata", None)
+            )
+        return self._response_text(resp, model, prefix if cached else None)
+
+    def _response_text(self, resp: Any, model: str, cached_prefix: Optional[str] = None) -> str:
+        """Texto crudo de una respuesta; registra el ahorro si se usó el prefijo cacheado."""
+        if cached_prefix:
+            usage = getattr(resp, "usage_metadata", None)
+            self.prompt_cache.record_hit(
+                model, cached_prefix, int(getattr(usage, "cached_content_token_count", 0) or 0)
+            )
+        raw = getattr(resp, "text", None)
+        if not raw and getattr(resp, "candidates", None):
+            try:
+                raw = "".join(
+                    getattr(p, "text", "") for p in resp.candidates[0].content.parts
+                )
+            except Exception:
+                raw = ""
+        return (raw or "").strip()
+
+    def _generate_stream(
+        self,
+        prompt: str,
+        model: str,
+        prefix: Optional[str] = None,
+        on_metadata: Optional[Callable[[Dict[str, Any]], None]] = None,
+        variant: Optional[str] = None,
+    ) -> str:
+        """
+        Igual que `_generate` pero en streaming. Si los primeros fragmentos no
+        parecen JSON se corta la respuesta (StreamAborted); los metadatos se
+        entregan a `on_metadata` antes de que termine la lista de equipos.
+        """
+        kwargs, cached = self._request_args(prompt, model, prefix)
+        parser = IncrementalJSONParser()
+        usage = None
+        t0 = time.perf_counter()
+        stream = self.client.models.generate_content_stream(**kwargs)
+        try:
+            for chunk in stream:
+                parser.feed(getattr(chunk, "text", None) or "")
+                usage = getattr(chunk, "usage_metadata", None) or usage
+                if parser.looks_invalid():
+                    raise StreamAborted(f"Respuesta sin JSON: {parser.buffer[:80]!r}")
+                if on_metadata and parser.metadata is not None:
+                    on_metadata(dict(parser.metadata))
+                    on_metadata = None
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+            self._record_call(model, variant, time.perf_counter() - t0, usage)
+        if cached:
+            self.prompt_cache.record_hit(
+                model, prefix, int(getattr(usage, "cached_content_token_count", 0) or 0)
+            )
+        return parser.buffer.strip()
+
+    def _refill_missing(self, text: str, payload: Dict[str, Any], model: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Valida el resultado y, si faltan MUNICIPIO / SERIE / FECHA CC, hace UNA
+        re-consulta pequeña con el fragmento relevante del texto. No repite la
+        extracción completa; si la re-consulta falla se conserva lo que había.
+        """
+        reask = self._reask_prompt(text, payload)
+        if reask is None:
+            return payload
+        prompt, issues = reask
+        try:
+            answer = _parse_json_loose(self._generate(prompt, model, variant="reconsulta"))
+        except Exception:
+            return payload
+        self._merge_refill(payload, answer, issues)
+        return payload
+
+    @staticmethod
+    def _reask_prompt(text: str, payload: Dict[str, Any]) -> Optional[Tuple[str, List[str]]]:
+        """(prompt, campos) de la re-consulta puntual, o None si no falta nada."""
+        issues = rules.find_issues(payload)
+        if not issues:
+            return None
+
+        estructura: Dict[str, Any] = {}
+        for issue in issues:
+            if issue.startswith("EQUIPOS["):
+                idx = issue[len("EQUIPOS["):issue.index("]")]
+                estructura.setdefault("EQUIPOS", {}).setdefault(str(int(idx) + 1), {})[rules.field_name(issue)] = ""
             else:
-                prompt_try = prompt
+                estructura[issue] = ""
+        campos = "\n".join(f"- {i}" for i in issues)
+        fields = sorted({rules.field_name(i) for i in issues})
+        prompt = REASK_TEMPLATE.format(
+            campos=campos,
+            estructura=json.dumps(estructura, ensure_ascii=False, indent=2),
+            fragmento=rules.snippet_for(text, fields),
+        )
+        return prompt, issues
+
+    @staticmethod
+    def _merge_refill(payload: Dict[str, Any], answer: Dict[str, Any], issues: List[str]) -> None:
+        """Aplica solo los campos pedidos en la re-consulta."""
+        for issue in issues:
+            field = rules.field_name(issue)
+            if issue.startswith("EQUIPOS["):
+                idx = int(issue[len("EQUIPOS["):issue.index("]")])
+                eq_answer = (answer.get("EQUIPOS") or {}).get(str(idx + 1)) or {}
+                value = str(eq_answer.get(field) or "").strip()
+                if value:
+                    payload["EQUIPOS"][idx][field] = value
+                continue
+            value = str(answer.get(field) or "").strip()
+            if field == "MUNICIPIO":
+                municipio = rules.canonical_municipio(value)
+                if municipio:
+                    payload["MUNICIPIO"] = municipio
+                    # La subregión se deriva localmente de la lista cerrada
+                    payload["SUBREGIÓN"] = rules.subregion_for(municipio)
+            elif value:
+                payload[field] = value
+
+    def summarize(
+        self, text: str, on_metadata: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Ruteo por niveles: intenta con el modelo rápido y valida contra listas
+        cerradas y llaves obligatorias; solo si la validación falla escala al
+        siguiente modelo. El último modelo devuelve su mejor resultado.
+        En modo streaming, `on_metadata` recibe los metadatos de la licencia
+        en cuanto están completos (una sola vez, aunque haya reintentos o
+        escalado).
+        El tipo de solicitud se pre-clasifica localmente para elegir la
+        variante de prompt más corta que aplique.
+        """
+        tipo = classify_request(text)
+        if on_metadata is not None:
+            on_metadata = _once(on_metadata)
+        if self.split_min_equipos and variant_for(tipo) != "sin_equipos":
+            head, blocks = split_equipment_blocks(text)
+            if len(blocks) >= self.split_min_equipos:
+                return self._summarize_split(text, head, blocks, on_metadata, tipo)
+        self._count_variant(variant_for(tipo))
+        return self._route(text, self.models, on_metadata=on_metadata, tipo=tipo)
+
+    def _summarize_split(
+        self,
+        text: str,
+        head: str,
+        blocks: List[str],
+        on_metadata: Optional[Callable[[Dict[str, Any]], None]],
+        tipo: Optional[str],
+    ) -> Dict[str, Any]:
+        """
+        Documentos con muchos equipos: una petición pequeña de metadatos (solo
+        el encabezado, sin los bloques de equipo) y una por bloque de equipo, todas en paralelo, ensambladas con la misma forma
+        que la extracción monolítica. La latencia queda dominada por el bloque
+        más largo y no por la suma. Si alguna parte falla, o el resultado no
+        valida, se vuelve al ruteo normal.
+        """
+        model = self.models[0]
+        self._count(model, "documents")
+        self._count_variant("metadatos")
+        self._count_variant("equipo", len(blocks))
+        hint = PROMPT_TIPO_HINT.format(tipo=tipo) if tipo else ""
+        qc = "\n".join(qc_lines(text))
+        ask = self._ask_part
+
+        with ThreadPoolExecutor(max_workers=max(1, self.split_workers)) as pool:
+            meta_future = pool.submit(ask, model, "metadatos", hint + PROMPT_DOCUMENT.format(texto=head[:25000]))
+            eq_futures = [pool.submit(ask, model, "equipo", self._equipo_body(b, qc)) for b in blocks]
+            try:
+                payload = meta_future.result()
+                if on_metadata and isinstance(payload, dict):
+                    on_metadata(dict(payload))
+                equipos = [f.result() for f in eq_futures]
+            except Exception:
+                payload, equipos = None, []
+
+        if not isinstance(payload, dict) or not all(isinstance(e, dict) for e in equipos):
+            self._count(model, "escalated")
+            return self._route(text, self.models, on_metadata=None, tipo=tipo)
+        payload["EQUIPOS"] = equipos
+        self._normalize_payload(payload, tipo)
+        payload = self._refill_missing(text, payload, model)
+        if not rules.validate(payload) or len(self.models) == 1:
+            self._count(model, "accepted")
+            return payload
+        self._count(model, "escalated")
+        return self._route(text, self.models[1:], fallback=payload, tipo=tipo)
+
+    def _ask_part(self, model: str, variant: str, body: str) -> Dict[str, Any]:
+        """Una parte del modo dividido (metadatos o un equipo) con el prefijo de su variante."""
+        raw = self._generate(body, model, prefix=PROMPT_PREFIXES[variant], variant=variant)
+        return _parse_json_loose(raw)
 
-            resp = self.client.models.generate_content(
-                model=self.model_name,
-                contents=[prompt_try],
+    @staticmethod
+    def _equipo_body(block: str, qc: str) -> str:
+        extra = PROMPT_QC_CONTEXT.format(lineas=qc) if qc and qc not in block else ""
+        return PROMPT_DOCUMENT.format(texto=block[:12000]) + extra
+
+    def summarize_incremental(
+        self, text: str, previous_text: str, previous: Dict[str, Any]
+    ) -> Optional[Tuple[Dict[str, Any], Optional[List[int]]]]:
+        """
+        Documento editado con un resultado anterior: compara encabezado y
+        bloques de equipo con el texto ya extraído y solo consulta al modelo
+        por lo que cambió (metadatos si cambió el encabezado, un prompt por
+        equipo nuevo o modificado); los equipos iguales se copian del
+        resultado anterior. Devuelve (payload, ITEMs que cambiaron; None si
+        cambiaron los metadatos), o None si la estructura no permite comparar
+        por bloques (o el resultado no valida) y corresponde extraer completo.
+        """
+        head, blocks = split_equipment_blocks(text, min_blocks=1)
+        old_head, old_blocks = split_equipment_blocks(previous_text, min_blocks=1)
+        old_equipos = previous.get("EQUIPOS") or []
+        if not blocks or not old_blocks or len(old_blocks) != len(old_equipos):
+            return None
+
+        def key(part: str) -> str:
+            # Sin el rótulo "EQUIPO_n": un equipo que solo cambió de número sigue siendo el mismo
+            lines = part.splitlines()
+            if lines and EQUIPO_MARKER_RE.match(rules.normalize(lines[0])):
+                lines = lines[1:]
+            return " ".join(" ".join(lines).split())
+
+        # Bloque sin cambios → su equipo anterior (aunque haya cambiado de posición)
+        old_index = {key(b): i for i, b in enumerate(old_blocks)}
+        head_changed = key(head) != key(old_head)
+        todo = [i for i, b in enumerate(blocks) if key(b) not in old_index]
+        tipo = classify_request(text)
+        model = self.models[0]
+        self._count_variant("incremental")
+        hint = PROMPT_TIPO_HINT.format(tipo=tipo) if tipo else ""
+        qc = "\n".join(qc_lines(text))
+        with ThreadPoolExecutor(max_workers=max(1, self.split_workers)) as pool:
+            meta_future = (
+                pool.submit(self._ask_part, model, "metadatos", hint + PROMPT_DOCUMENT.format(texto=head[:25000]))
+                if head_changed
+                else None
             )
+            eq_futures = {i: pool.submit(self._ask_part, model, "equipo", self._equipo_body(blocks[i], qc)) for i in todo}
+            try:
+                payload = meta_future.result() if meta_future else {k: v for k, v in previous.items() if k != "EQUIPOS"}
+                fresh = {i: f.result() for i, f in eq_futures.items()}
+            except Exception:
+                return None
+        equipos = [fresh[i] if i in fresh else dict(old_equipos[old_index[key(b)]]) for i, b in enumerate(blocks)]
+        if not isinstance(payload, dict) or not all(isinstance(e, dict) for e in equipos):
+            return None
+        payload["EQUIPOS"] = equipos
+        self._normalize_payload(payload, tipo)
+        if not rules.validate(payload):
+            return None
+        if head_changed:
+            return payload, None
+        changed = [i + 1 for i, b in enumerate(blocks) if i in fresh or old_index[key(b)] != i]
+        return payload, changed
 
-            raw = getattr(resp, "text", None)
-            if not raw and getattr(resp, "candidates", None):
-                try:
-                    raw = "".join(
-                        getattr(p, "text", "") for p in resp.candidates[0].content.parts
-                    )
-                except Exception as e:
-                    last_err = e
-                    raw = ""
-
-            raw = (raw or "").strip()
+    def _route(
+        self,
+        text: str,
+        models: List[str],
+        fallback: Optional[Dict[str, Any]] = None,
+        on_metadata: Optional[Callable[[Dict[str, Any]], None]] = None,
+        tipo: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        routing = _Routing(self, models, fallback)
+        for model in routing:
             try:
-                payload = _parse_json_loose(raw)
-                # normalizaciones ligeras
-                if isinstance(payload.get("CORREO ELECTRONICO"), str):
-                    payload["CORREO ELECTRONICO"] = payload["CORREO ELECTRONICO"].strip().lower()
+                payload = self._summarize_with(model, text, on_metadata, tipo)
+            except RuntimeError as e:
+                routing.failed(e)
+                continue
+            if routing.accept(payload):
                 return payload
+        return routing.result()
+
+    def summarize_many(self, texts: List[str]) -> List[Union[Dict[str, Any], Exception]]:
+        """
+        Empaqueta varios documentos cortos en una sola petición con id
+        delimitados y devuelve los resultados en el mismo orden de `texts`.
+        Todo documento ausente en la respuesta, que no parsee o que no pase la
+        validación se resuelve con una petición individual (`summarize`).
+        Si eso falla, en su posición va la excepción y los demás documentos
+        del lote conservan su resultado.
+        """
+        if len(texts) <= 1:
+            return [self._guarded(self.summarize, t) for t in texts]
+
+        model = self.models[0]
+        ids = [f"D{i}" for i in range(1, len(texts) + 1)]
+        tipos = [classify_request(t) for t in texts]
+        variants = {variant_for(t) for t in tipos}
+        # un solo prefijo por lote: la variante común o, si se mezclan, la completa
+        variant = variants.pop() if len(variants) == 1 else "completo"
+        blocks = []
+        for doc_id, text, tipo in zip(ids, texts, tipos):
+            hint = PROMPT_TIPO_HINT.format(tipo=tipo).strip() + "\n" if tipo else ""
+            blocks.append(f"<<<DOC {doc_id}>>>\n{hint}{text}\n<<<FIN DOC {doc_id}>>>")
+        prompt = BATCH_TEMPLATE.format(documentos="\n\n".join(blocks))
+        self._count_variant("lote", len(texts))
+        try:
+            raw = self._generate(prompt, model, prefix=PROMPT_PREFIXES[variant], variant="lote")
+            keyed = _parse_json_loose(raw)
+        except Exception:
+            keyed = {}
+        if not isinstance(keyed, dict):
+            keyed = {}
+
+        results: List[Union[Dict[str, Any], Exception]] = []
+        for doc_id, text, tipo in zip(ids, texts, tipos):
+            payload = keyed.get(doc_id)
+            if not isinstance(payload, dict):
+                # ausente o no parseable: petición individual con ruteo normal
+                results.append(self._guarded(self.summarize, text))
+                continue
+            self._count(model, "documents")
+            self._normalize_payload(payload, tipo)
+            results.append(self._guarded(self._finish_batched, text, payload, tipo, model))
+        return results
+
+    def _finish_batched(self, text: str, payload: Dict[str, Any], tipo: Optional[str], model: str) -> Dict[str, Any]:
+        """Re-consulta de campos y, si no valida, escalado de un documento del lote."""
+        payload = self._refill_missing(text, payload, model)
+        if not rules.validate(payload) or len(self.models) == 1:
+            self._count(model, "accepted")
+            return payload
+        # no pasó validación: escalar directamente al siguiente nivel
+        self._count(model, "escalated")
+        return self._route(text, self.models[1:], fallback=payload, tipo=tipo)
+
+    @staticmethod
+    def _guarded(fn: Callable[..., Dict[str, Any]], *args: Any) -> Union[Dict[str, Any], Exception]:
+        """Resultado de un documento del lote, o su excepción (no corta a los demás)."""
+        try:
+            return fn(*args)
+        except Exception as e:
+            return e
+
+    @staticmethod
+    def _attempts(text: str, tipo: Optional[str]) -> List[Tuple[str, str, str]]:
+        """(prompt, prefijo, variante) de cada intento, con pequeñas variaciones."""
+        variant = variant_for(tipo)
+        prefix = PROMPT_PREFIXES[variant]
+        hint = PROMPT_TIPO_HINT.format(tipo=tipo) if tipo else ""
+        # El prefijo estático (instrucciones) puede ir cacheado; aquí solo el documento
+        prompt = hint + PROMPT_DOCUMENT.format(texto=text[:25000])
+        return [
+            (prompt, prefix, variant),
+            # 2º intento: reforzar instrucción de salida única
+            (prompt + "\n\nDevuelve únicamente un bloque JSON válido, sin comentarios, sin Markdown.", prefix, variant),
+            # 3º intento: recortar un poco más el texto por si hay límite de tokens
+            (hint + PROMPT_DOCUMENT.format(texto=text[:18000]), prefix, variant),
+        ]
+
+    def _parse_payload(self, raw: str, tipo: Optional[str]) -> Dict[str, Any]:
+        payload = _parse_json_loose(raw)
+        self._normalize_payload(payload, tipo)
+        return payload
+
+    def _normalize_payload(self, payload: Dict[str, Any], tipo: Optional[str]) -> None:
+        # normalizaciones ligeras
+        if isinstance(payload.get("CORREO ELECTRONICO"), str):
+            payload["CORREO ELECTRONICO"] = payload["CORREO ELECTRONICO"].strip().lower()
+        municipio = rules.canonical_municipio(payload.get("MUNICIPIO"))
+        if municipio:
+            payload["MUNICIPIO"] = municipio  # misma grafía que la lista cerrada
+        self._apply_tipo(payload, tipo)
+
+    @staticmethod
+    def _apply_tipo(payload: Dict[str, Any], tipo: Optional[str]) -> None:
+        """Si el modelo no devolvió un tipo válido, se usa el detectado localmente."""
+        if not tipo:
+            return
+        validos = {rules.normalize(t) for t in rules.TIPOS_SOLICITUD}
+        if rules.normalize(payload.get("TIPO DE SOLICITUD")) not in validos:
+            payload["TIPO DE SOLICITUD"] = tipo
+
+    def _summarize_with(
+        self,
+        model: str,
+        text: str,
+        on_metadata: Optional[Callable[[Dict[str, Any]], None]] = None,
+        tipo: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        last_err = None
+        for prompt_try, prefix, variant in self._attempts(text, tipo):
+            try:
+                if self.stream:
+                    raw = self._generate_stream(prompt_try, model, prefix, on_metadata, variant)
+                else:
+                    raw = self._generate(prompt_try, model, prefix=prefix, variant=variant)
+                payload = self._parse_payload(raw, tipo)
+            except StreamAborted as e:
+                # prosa en vez de JSON: se pasa al siguiente intento sin esperar
+                last_err = e
+                continue
             except Exception as e:
                 last_err = e
                 # pequeño backoff por si el servicio respondió incompleto
                 time.sleep(0.6)
+                continue
+            # validación por campo: re-consulta puntual en vez de repetir todo
+            return self._refill_missing(text, payload, model)
 
         # si llegamos aquí, fallaron los 3 intentos → exponemos parte de la salida para depuración
-        raise RuntimeError(f"No se pudo parsear JSON del modelo: {last_err}")
-
+        raise RuntimeError(f"No se pudo parsear JSON del modelo {model}: {last_err}")
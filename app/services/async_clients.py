@@ -0,0 +1,384 @@
+# app/services/async_clients.py
+"""Variantes asyncio de DriveClient, SheetsTable y AIClient.
+
+Drive y Sheets comparten una sola sesión HTTP asíncrona con pool de conexiones
+(aiohttp); las peticiones se arman con los mismos servicios de
+googleapiclient (sin red) y se ejecutan en la sesión con el token del Service
+Account. Gemini usa el cliente asíncrono de google-genai (`client.aio`).
+
+Solo cambia el transporte: las peticiones, el parseo, la política de la
+tabla y los prompts/ruteo son los de las clases síncronas, que siguen con
+googleapiclient (aiohttp es opcional y el cassette graba ese transporte).
+`IngestPipeline.run` es el envoltorio síncrono de la corrida asíncrona.
+"""
+import asyncio
+import contextlib
+import random
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import aiohttp  # type: ignore[import-not-found]
+except ModuleNotFoundError as exc:  # pragma: no cover - entorno sin dependencia
+    aiohttp = None  # type: ignore[assignment]
+    _AIOHTTP_ERROR = exc
+else:  # pragma: no cover - import correcto
+    _AIOHTTP_ERROR = None
+
+from app.services.ai_client import AIClient, _Routing, _parse_json_loose
+from app.services.docx_pool import DocxParsePool
+from app.services.drive_client import SPOOL_THRESHOLD_BYTES, list_docx_request, parse_spooled
+from app.services.rate_limit import FairRateLimiter
+from app.services.request_classifier import classify_request, variant_for
+from app.services.sheets_table import SheetsTable
+from app.services.spool import MemoryBudget, SpooledBuffer
+from app.services.table_backend import MasterTable
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _ensure_aiohttp() -> None:
+    if aiohttp is None:
+        hint = "Instala la dependencia 'aiohttp' con `pip install aiohttp` o `pip install -r requirements.txt`."
+        raise RuntimeError(f"El modo asíncrono requiere aiohttp. {hint}") from _AIOHTTP_ERROR
+
+
+class AsyncHttpError(RuntimeError):
+    def __init__(self, status: int, body: str, uri: str):
+        super().__init__(f"HTTP {status} en {uri}: {body[:300]}")
+        self.status = status
+        self.body = body
+        self.uri = uri
+
+
+class AsyncGoogleSession:
+    """Sesión aiohttp compartida (pool de conexiones) para las APIs de Google."""
+
+    # Sin límite propio por API: la tabla de Sheets aplica su cupo (ver `_BridgedSheetsTable`)
+    paced = False
+
+    def __init__(self, creds, limit: int = 100, retries: int = 5):
+        _ensure_aiohttp()
+        self.creds = creds
+        self.limit = limit
+        self.retries = retries
+        self._session = None
+        self._token_lock: Optional[asyncio.Lock] = None
+
+    async def __aenter__(self) -> "AsyncGoogleSession":
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.limit),
+            timeout=aiohttp.ClientTimeout(total=300),
+        )
+        self._token_lock = asyncio.Lock()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def _token(self, force: bool = False) -> str:
+        from google.auth.transport.requests import Request as GoogleAuthRequest
+
+        async with self._token_lock:
+            if force or not self.creds.valid:
+                await asyncio.to_thread(self.creds.refresh, GoogleAuthRequest())
+            return self.creds.token
+
+    async def execute(self, request, raw: bool = False, sink: Optional[SpooledBuffer] = None) -> Any:
+        """
+        Ejecuta un `HttpRequest` de googleapiclient en la sesión asíncrona.
+        Devuelve el JSON (o los bytes si `raw`, o `sink` con el cuerpo escrito
+        por partes). Reintenta 429/5xx con backoff.
+        """
+        delay = 1.0
+        force_token = False
+        for attempt in range(self.retries):
+            last = attempt == self.retries - 1
+            headers = {
+                k: v for k, v in (request.headers or {}).items() if k.lower() != "content-length"
+            }
+            headers["authorization"] = f"Bearer {await self._token(force_token)}"
+            try:
+                async with self._session.request(
+                    request.method, request.uri, data=request.body, headers=headers
+                ) as resp:
+                    if resp.status < 300 and sink is not None:
+                        sink.reset()
+                        async for chunk in resp.content.iter_chunked(STREAM_CHUNK_BYTES):
+                            sink.write(chunk)
+                        return sink
+                    if resp.status < 300:
+                        return await resp.read() if raw else await resp.json(content_type=None)
+                    body = await resp.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if last:
+                    raise
+                await asyncio.sleep(delay + random.uniform(0, delay))
+                delay *= 2
+                continue
+            if resp.status == 401 and not force_token and not last:
+                force_token = True
+                continue
+            if resp.status in RETRY_STATUS and not last:
+                await asyncio.sleep(delay + random.uniform(0, delay))
+                delay *= 2
+                continue
+            raise AsyncHttpError(resp.status, body, request.uri)
+
+
+class TenantSession:
+    """
+    Vista de una AsyncGoogleSession compartida por varios pipelines: cada
+    petición espera antes su turno en el límite de su API (Drive o Sheets).
+    """
+
+    paced = True
+
+    def __init__(self, session: AsyncGoogleSession, tenant: str, limiters: Dict[str, FairRateLimiter]):
+        self.session = session
+        self.tenant = tenant
+        self.limiters = limiters
+
+    async def execute(self, request, raw: bool = False, sink: Optional[SpooledBuffer] = None) -> Any:
+        api = "sheets" if "sheets.googleapis.com" in request.uri else "drive"
+        limiter = self.limiters.get(api)
+        if limiter is not None:
+            await limiter.acquire(self.tenant)
+        return await self.session.execute(request, raw=raw, sink=sink)
+
+
+class AsyncDriveClient:
+    def __init__(
+        self,
+        drive_service,
+        session: AsyncGoogleSession,
+        parse_pool: Optional[DocxParsePool] = None,
+        spool_threshold: int = SPOOL_THRESHOLD_BYTES,
+        budget: Optional[MemoryBudget] = None,
+    ):
+        self.drive = drive_service
+        self.session = session
+        self.parse_pool = parse_pool
+        self.spool_threshold = spool_threshold
+        self.budget = budget
+
+    async def list_docx_in_folder(self, folder_id: str) -> List[Dict[str, Any]]:
+        files: List[Dict[str, Any]] = []
+        token = None
+        while True:
+            resp = await self.session.execute(list_docx_request(self.drive, folder_id, token))
+            files.extend(resp.get("files", []))
+            token = resp.get("nextPageToken")
+            if not token:
+                break
+        return files
+
+    async def download_docx_text(self, file_id: str) -> str:
+        with SpooledBuffer(self.spool_threshold, self.budget) as buf:
+            await self.session.execute(self.drive.files().get_media(fileId=file_id), sink=buf)
+            # python-docx es CPU: fuera del event loop (y en otro proceso si hay pool)
+            return await asyncio.to_thread(parse_spooled, buf, file_id, self.parse_pool)
+
+
+class _BridgedSheetsTable(SheetsTable):
+    """
+    SheetsTable cuya lógica de ubicación corre en un hilo de trabajo y cuyo
+    I/O se ejecuta en la sesión asíncrona del event loop.
+    """
+
+    def __init__(
+        self,
+        session: AsyncGoogleSession,
+        loop: asyncio.AbstractEventLoop,
+        *args,
+        max_rpm: float = 60.0,
+        **kwargs,
+    ):
+        self._session = session
+        self._loop = loop
+        # Cupo de Sheets sin pausa fija por petición: solo se espera si se agotó (la sesión puede traer el suyo)
+        self._limiter = None if session.paced else FairRateLimiter("sheets", max_rpm)
+        super().__init__(*args, **kwargs)
+
+    def _execute_with_backoff(self, request, retries: int = 5, initial_delay: float = 1.0, throttle: float = 1.0):
+        # Reintentos en la sesión
+        return asyncio.run_coroutine_threadsafe(self._execute(request), self._loop).result()
+
+    async def _execute(self, request) -> Any:
+        if self._limiter is not None:
+            await self._limiter.acquire(self.sheet_name)
+        return await self._session.execute(request)
+
+
+class AsyncSheetsTable:
+    """
+    Misma API pública que SheetsTable (o cualquier MasterTable, p. ej. la
+    tabla SQLite local), en corrutinas. Las llamadas a la tabla se
+    serializan con un candado: la política "solo vacíos" lee y escribe la
+    misma zona del bloque y no admite carreras. Dentro de `snapshot()` la
+    ubicación es en memoria (sin red) y los `flush` de varios documentos a la
+    vez se juntan en un solo envío.
+    """
+
+    def __init__(self, table: MasterTable):
+        self._table = table
+        self._lock = asyncio.Lock()
+        # Envíos de `flush`: iniciados, terminados y el que está en curso
+        self._flush_started = 0
+        self._flush_done = 0
+        self._flushing: Optional[asyncio.Future] = None
+
+    @classmethod
+    async def create(
+        cls,
+        sheets_service,
+        session: AsyncGoogleSession,
+        spreadsheet_id: str,
+        sheet_name: str,
+        max_rpm: float = 60.0,
+        **kwargs,
+    ) -> "AsyncSheetsTable":
+        loop = asyncio.get_running_loop()
+        table = await asyncio.to_thread(
+            _BridgedSheetsTable, session, loop, sheets_service, spreadsheet_id, sheet_name, max_rpm=max_rpm, **kwargs
+        )
+        return cls(table)
+
+    @property
+    def headers(self) -> List[str]:
+        return self._table.headers
+
+    @contextlib.asynccontextmanager
+    async def snapshot(self, **kwargs):
+        """`SheetsTable.snapshot` abierto y cerrado en el hilo de trabajo."""
+        cm = self._table.snapshot(**kwargs)
+        await self._call(cm.__enter__)
+        try:
+            yield self
+        except BaseException as e:
+            await self._call(cm.__exit__, type(e), e, e.__traceback__)
+            raise
+        else:
+            await self._call(cm.__exit__, None, None, None)
+
+    async def _call(self, fn, *args, **kwargs):
+        async with self._lock:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def fill_from_json_only_empty(self, json_data: Dict[str, Any], **kwargs) -> Dict[str, Any]:
+        return await self._call(self._table.fill_from_json_only_empty, json_data, **kwargs)
+
+    async def has_value_in_column(self, key_col: str, key_value: str, target_col: str) -> bool:
+        return await self._call(self._table.has_value_in_column, key_col, key_value, target_col)
+
+    async def prefetch_block(self, key_col: str, key_value: str) -> List[int]:
+        return await self._call(self._table.prefetch_block, key_col, key_value)
+
+    async def flush(self) -> int:
+        """
+        Envía lo pendiente, incluido lo de quien llama. Un envío que ya estaba
+        en curso puede no traer esas filas: se espera al siguiente, que sale
+        una sola vez para todos los que llegaron mientras tanto.
+        """
+        target = self._flush_started + 1
+        written = 0
+        while self._flush_done < target:
+            if self._flushing is None:
+                self._flush_started += 1
+                self._flushing = asyncio.ensure_future(self._flush_once(self._flush_started))
+            written = await asyncio.shield(self._flushing)
+        return written
+
+    async def _flush_once(self, n: int) -> int:
+        try:
+            return await self._call(self._table.flush)
+        finally:
+            self._flush_done = n
+            self._flushing = None
+
+    async def refresh(self) -> None:
+        await self._call(self._table.refresh)
+
+
+class AsyncAIClient:
+    """
+    `summarize` asíncrono sobre un AIClient existente: reutiliza sus prompts,
+    variantes, cache de prefijo, validación, re-consulta, ruteo por niveles y
+    estadísticas; solo cambia el transporte a `client.aio`. Los modos lote,
+    streaming y dividido siguen disponibles en la API síncrona.
+    """
+
+    def __init__(
+        self,
+        ai: AIClient,
+        max_in_flight: int = 32,
+        limiter: Optional[FairRateLimiter] = None,
+        tenant: str = "",
+    ):
+        self.ai = ai
+        self._sem = asyncio.Semaphore(max_in_flight)
+        # Cupo de Gemini compartido con otros pipelines (ver `MultiTenantRunner`)
+        self.limiter = limiter
+        self.tenant = tenant
+
+    async def _generate(
+        self, prompt: str, model: str, prefix: Optional[str] = None, variant: Optional[str] = None
+    ) -> str:
+        kwargs, cached = await asyncio.to_thread(self.ai._request_args, prompt, model, prefix)
+        resp = None
+        t0 = time.perf_counter()
+        try:
+            async with self._sem:
+                if self.limiter is not None:
+                    await self.limiter.acquire(self.tenant)
+                resp = await self.ai.client.aio.models.generate_content(**kwargs)
+        finally:
+            self.ai._record_call(model, variant, time.perf_counter() - t0, getattr(resp, "usage_metadata", None))
+        return self.ai._response_text(resp, model, prefix if cached else None)
+
+    async def summarize(self, text: str) -> Dict[str, Any]:
+        tipo = classify_request(text)
+        self.ai._count_variant(variant_for(tipo))
+        return await self._route(text, self.ai.models, tipo)
+
+    async def _route(
+        self, text: str, models: List[str], tipo: Optional[str], fallback: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        # Mismas decisiones que `AIClient._route`; aquí solo cambia la consulta
+        routing = _Routing(self.ai, models, fallback)
+        for model in routing:
+            try:
+                payload = await self._summarize_with(model, text, tipo)
+            except RuntimeError as e:
+                routing.failed(e)
+                continue
+            if routing.accept(payload):
+                return payload
+        return routing.result()
+
+    async def _summarize_with(self, model: str, text: str, tipo: Optional[str]) -> Dict[str, Any]:
+        last_err = None
+        for prompt_try, prefix, variant in self.ai._attempts(text, tipo):
+            try:
+                raw = await self._generate(prompt_try, model, prefix, variant)
+                payload = self.ai._parse_payload(raw, tipo)
+            except Exception as e:
+                last_err = e
+                await asyncio.sleep(0.6)
+                continue
+            reask = self.ai._reask_prompt(text, payload)
+            if reask is not None:
+                prompt, issues = reask
+                try:
+                    answer = _parse_json_loose(await self._generate(prompt, model, variant="reconsulta"))
+                    self.ai._merge_refill(payload, answer, issues)
+                except Exception:
+                    pass
+            return payload
+        raise RuntimeError(f"No se pudo parsear JSON del modelo {model}: {last_err}")
@@ -0,0 +1,147 @@
+# app/services/audit_log.py
+"""Traza detallada de escrituras en Sheets (append-only, fuera de la hoja principal).
+
+`SheetsTable` deja en la celda de observaciones solo el último estado; el
+detalle de cada toque (columnas llenadas, saltadas y sin columna) va a uno
+de estos destinos.
+"""
+import json
+import os
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional
+
+from googleapiclient.errors import HttpError
+
+AUDIT_HEADERS = [
+    "FECHA", "RADICADO", "FILA", "ACCIÓN", "ARCHIVO", "LLENADAS", "SALTADAS", "SIN COLUMNA", "OBSERVACIÓN ANTERIOR",
+]
+
+
+class AuditLog(ABC):
+    """Interfaz: `record` acumula una entrada, `flush` la persiste."""
+
+    @abstractmethod
+    def record(self, entry: Dict[str, Any]) -> None:
+        """Anota una entrada (ver `MasterTable._record_trail`)."""
+
+    def flush(self) -> None:
+        pass
+
+
+class JsonlAuditLog(AuditLog):
+    """Una línea JSON por entrada en un archivo local."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False)
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+class SheetAuditLog(AuditLog):
+    """
+    Pestaña de trazabilidad en el mismo spreadsheet. Las entradas se envían
+    con `values.append` en lotes de `batch_size`; la pestaña se crea (con
+    encabezados) la primera vez si no existe. `on_write` se llama tras cada
+    petición de escritura: la tabla del mismo archivo la cuenta como propia
+    al validar la versión en Drive (ver `SheetsTable.note_own_write`).
+    """
+
+    def __init__(self, sheets_service, spreadsheet_id: str, sheet_name: str, batch_size: int = 50):
+        self.service = sheets_service
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.batch_size = batch_size
+        self._pending: List[List[Any]] = []
+        self._lock = threading.Lock()
+        self._ready = False
+        self.on_write: Optional[Callable[[], None]] = None
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        row = [
+            entry.get("ts", ""),
+            entry.get("radicado", ""),
+            entry.get("row") or "",
+            entry.get("action", ""),
+            entry.get("filename") or "",
+            ", ".join(entry.get("filled") or []),
+            ", ".join(entry.get("skipped") or []),
+            ", ".join(entry.get("missing") or []),
+            entry.get("previous_obs") or "",
+        ]
+        with self._lock:
+            self._pending.append(row)
+            full = len(self._pending) >= self.batch_size
+        if full:
+            try:
+                self.flush()
+            except Exception as e:
+                # La escritura en la hoja principal ya se hizo: la traza queda pendiente para el próximo flush
+                print(f"⚠️  No se pudo enviar la traza a '{self.sheet_name}' ({len(self._pending)} pendiente(s)): {e}")
+
+    def _execute_with_backoff(self, request, retries: int = 5, initial_delay: float = 1.0):
+        """Ejecuta una petición al API con backoff exponencial ante 429 (como `SheetsTable`)."""
+        delay = initial_delay
+        for attempt in range(retries):
+            try:
+                return request.execute()
+            except HttpError as e:
+                if e.resp.status == 429 and attempt < retries - 1:
+                    time.sleep(delay + random.uniform(0, delay))
+                    delay *= 2
+                else:
+                    raise
+
+    def _write(self, request) -> None:
+        self._execute_with_backoff(request)
+        if self.on_write is not None:
+            self.on_write()
+
+    def _ensure_sheet(self) -> None:
+        if self._ready:
+            return
+        meta = self._execute_with_backoff(self.service.spreadsheets().get(
+            spreadsheetId=self.spreadsheet_id, fields="sheets.properties.title"
+        ))
+        titles = {s["properties"]["title"] for s in meta.get("sheets", [])}
+        if self.sheet_name not in titles:
+            self._write(self.service.spreadsheets().batchUpdate(
+                spreadsheetId=self.spreadsheet_id,
+                body={"requests": [{"addSheet": {"properties": {"title": self.sheet_name}}}]},
+            ))
+            self._write(self.service.spreadsheets().values().update(
+                spreadsheetId=self.spreadsheet_id,
+                range=f"{self.sheet_name}!A1",
+                valueInputOption="RAW",
+                body={"values": [AUDIT_HEADERS]},
+            ))
+        self._ready = True
+
+    def flush(self) -> None:
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return
+        try:
+            self._ensure_sheet()
+            self._write(self.service.spreadsheets().values().append(
+                spreadsheetId=self.spreadsheet_id,
+                range=f"{self.sheet_name}!A1",
+                valueInputOption="RAW",
+                insertDataOption="INSERT_ROWS",
+                body={"values": rows},
+            ))
+        except Exception:
+            # Se conservan para el próximo intento
+            with self._lock:
+                self._pending = rows + self._pending
+            raise
@@ -0,0 +1,245 @@
+# app/services/cassette.py
+"""Grabación y reproducción de las llamadas a Gemini, Drive y Sheets.
+
+Con CASSETTE_MODE=record cada llamada a los servicios externos se ejecuta y
+su respuesta (o error) queda en un archivo JSON Lines (el cassette). Con
+CASSETTE_MODE=replay las respuestas salen del cassette sin red ni
+credenciales, en el mismo orden en que se grabaron, para correr
+`IngestPipeline` offline y de forma determinista (pruebas de regresión y
+benchmarks sin gastar cupo). En la reproducción se puede agregar latencia
+(proporcional a la grabada) y errores al azar con semilla fija.
+
+Dos envolturas:
+- `RecordedClient`: métodos de alto nivel de un cliente (AIClient.summarize*,
+  DriveClient.list_docx_in_folder/download_docx_text).
+- `RecordedService`: un servicio de googleapiclient (Sheets, y Drive para la
+  versión del archivo); se graba cada `execute()` con la cadena de llamadas.
+"""
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+CASSETTE_MODES = ("record", "replay")
+
+
+class CassetteMiss(LookupError):
+    """La llamada no está en el cassette (el pipeline hizo algo distinto a lo grabado)."""
+
+
+class InjectedError(RuntimeError):
+    """Error agregado en la reproducción (CASSETTE_ERROR_RATE)."""
+
+
+class ReplayedError(RuntimeError):
+    """Error grabado (que no era HttpError) devuelto en la reproducción."""
+
+
+class Cassette:
+    """
+    Llamadas grabadas por clave (servicio + llamada + argumentos). Una clave
+    puede repetirse (p. ej. leer el mismo rango dos veces): la reproducción
+    entrega las respuestas en orden y, agotadas, repite la última.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mode: str,
+        latency_scale: float = 0.0,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"CASSETTE_MODE debe ser uno de {CASSETTE_MODES}: {mode!r}")
+        self.path = path
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tapes: Dict[str, List[Dict[str, Any]]] = {}
+        self._cursor: Dict[str, int] = {}
+        self._file = None
+        self.calls = 0
+        self.injected = 0
+        if mode == "replay":
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._tapes.setdefault(entry["key"], []).append(entry)
+        else:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            self._file = open(path, "w", encoding="utf-8")
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def _key(service: str, call: str, args: Any) -> str:
+        raw = json.dumps([service, call, args], sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def play(self, service: str, call: str, args: Any, fn: Callable[[], Any], http: bool = False) -> Any:
+        """Ejecuta y graba `fn` (record) o devuelve su respuesta grabada (replay)."""
+        key = self._key(service, call, args)
+        with self._lock:
+            self.calls += 1
+        if self.mode == "record":
+            return self._record(key, service, call, fn)
+        with self._lock:
+            tape = self._tapes.get(key)
+            if not tape:
+                raise CassetteMiss(f"{service}.{call} no está en {self.path}")
+            i = self._cursor.get(key, 0)
+            self._cursor[key] = i + 1
+            entry = tape[min(i, len(tape) - 1)]
+            inject = self.error_rate > 0 and self._random.random() < self.error_rate
+            if inject:
+                self.injected += 1
+        delay = entry.get("seconds", 0.0) * self.latency_scale
+        if delay > 0:
+            time.sleep(delay)
+        if inject:
+            if http:
+                raise _http_error(429, f"Error inyectado en {service}.{call}")
+            raise InjectedError(f"Error inyectado en {service}.{call}")
+        if "error" in entry:
+            if entry.get("status"):
+                raise _http_error(entry["status"], entry["error"])
+            raise ReplayedError(entry["error"])
+        return _decode(entry["result"])
+
+    def _record(self, key: str, service: str, call: str, fn: Callable[[], Any]) -> Any:
+        entry: Dict[str, Any] = {"key": key, "service": service, "call": call}
+        t0 = time.perf_counter()
+        try:
+            result = fn()
+        except HttpError as e:
+            entry.update(seconds=time.perf_counter() - t0, error=str(e), status=e.resp.status)
+            self._write(entry)
+            raise
+        except Exception as e:
+            entry.update(seconds=time.perf_counter() - t0, error=f"{type(e).__name__}: {e}")
+            self._write(entry)
+            raise
+        entry.update(seconds=time.perf_counter() - t0, result=_encode(result))
+        self._write(entry)
+        return result
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        line = json.dumps(entry, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def report(self) -> str:
+        if self.mode == "record":
+            return f"Cassette grabado: {self.calls} llamada(s) en {self.path}"
+        return f"Cassette reproducido: {self.calls} llamada(s), {self.injected} error(es) inyectado(s)"
+
+
+def _http_error(status: int, message: str) -> HttpError:
+    return HttpError(httplib2.Response({"status": status}), message.encode("utf-8"))
+
+
+def _encode(result: Any) -> Any:
+    """
+    Los errores por elemento de una lista (p. ej. `AIClient.summarize_many`)
+    se graban como {"__error__": ...}: con `default=str` quedarían como texto
+    y la reproducción los entregaría como un resultado más.
+    """
+    if not isinstance(result, list):
+        return result
+    out = []
+    for item in result:
+        if isinstance(item, HttpError):
+            out.append({"__error__": str(item), "__status__": item.resp.status})
+        elif isinstance(item, Exception):
+            out.append({"__error__": f"{type(item).__name__}: {item}"})
+        else:
+            out.append(item)
+    return out
+
+
+def _decode(result: Any) -> Any:
+    """Inverso de `_encode`: cada error grabado vuelve como excepción en su posición."""
+    if not isinstance(result, list):
+        return result
+    out = []
+    for item in result:
+        if isinstance(item, dict) and "__error__" in item:
+            status = item.get("__status__")
+            out.append(_http_error(status, item["__error__"]) if status else ReplayedError(item["__error__"]))
+        else:
+            out.append(item)
+    return out
+
+
+class RecordedClient:
+    """Graba/reproduce los métodos `methods` de `target`; el resto de atributos pasa directo."""
+
+    def __init__(self, target: Any, cassette: Cassette, service: str, methods: Iterable[str]):
+        self._target = target
+        self._cassette = cassette
+        self._service = service
+        self._methods = frozenset(methods)
+
+    def __getattr__(self, name: str) -> Any:
+        attr = getattr(self._target, name)
+        if name not in self._methods:
+            return attr
+
+        def call(*args: Any, **kwargs: Any) -> Any:
+            # Los callbacks (p. ej. on_metadata) no forman parte de la clave ni se llaman al reproducir
+            key_kwargs = {k: v for k, v in kwargs.items() if not callable(v)}
+            return self._cassette.play(self._service, name, [list(args), key_kwargs], lambda: attr(*args, **kwargs))
+
+        return call
+
+
+class RecordedService:
+    """
+    Servicio de googleapiclient grabado: `service.spreadsheets().values().get(...)`
+    arma la cadena y `execute()` la graba o reproduce. El `body` de las
+    escrituras no entra en la clave (lleva la hora de la actualización);
+    las llamadas repetidas se distinguen por su orden.
+    """
+
+    def __init__(self, service: Any, cassette: Cassette, name: str, path: Tuple[Tuple[str, Dict[str, Any]], ...] = ()):
+        self._service = service
+        self._cassette = cassette
+        self._name = name
+        self._path = path
+        # Sin red no hay cupo que cuidar: `SheetsTable` omite su pausa entre peticiones
+        self.paced = cassette.replaying
+
+    def __getattr__(self, attr: str) -> Callable[..., "RecordedService"]:
+        def step(*args: Any, **kwargs: Any) -> "RecordedService":
+            real = None if self._service is None else getattr(self._service, attr)(*args, **kwargs)
+            key_kwargs = {k: v for k, v in kwargs.items() if k != "body"}
+            return RecordedService(real, self._cassette, self._name, self._path + ((attr, key_kwargs),))
+
+        return step
+
+    def execute(self, **kwargs: Any) -> Any:
+        call = ".".join(attr for attr, _ in self._path)
+        args = [kw for _, kw in self._path]
+        return self._cassette.play(self._name, call, args, lambda: self._service.execute(**kwargs), http=True)
+
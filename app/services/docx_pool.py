@@ -0,0 +1,174 @@
+# app/services/docx_pool.py
+"""Parseo de .docx en procesos aparte, con tiempo límite por archivo.
+
+python-docx es CPU puro y con algunos documentos malformados o enormes se
+queda colgado; en un proceso aparte no retiene el GIL de los hilos de red y,
+si se pasa del tiempo límite, el proceso se mata y se reemplaza.
+"""
+import atexit
+import io
+import multiprocessing as mp
+import queue
+import threading
+from pathlib import Path
+from typing import Any, List
+
+
+class DocxParseError(RuntimeError):
+    """El .docx no se pudo leer (archivo dañado o el proceso de parseo murió)."""
+
+
+class DocxParseTimeout(DocxParseError):
+    """El parseo del .docx excedió el tiempo límite; el proceso se reinició."""
+
+    def __init__(self, name: str, seconds: float):
+        super().__init__(f"Parseo de {name} excedió {seconds:.0f}s; proceso reiniciado")
+        self.name = name
+        self.seconds = seconds
+
+
+def _parse_text(data: bytes) -> str:
+    from app.services.drive_client import docx_to_text
+
+    return docx_to_text(io.BytesIO(data))
+
+
+def _parse_text_file(path: str) -> str:
+    from app.services.drive_client import docx_to_text
+
+    return docx_to_text(path)
+
+
+def _parse_fields(path: str) -> Any:
+    from app.gui.doc_processing import extract_from_docx
+
+    return extract_from_docx(Path(path))
+
+
+_PARSERS = {"text": _parse_text, "text_file": _parse_text_file, "fields": _parse_fields}
+
+
+def _worker_main(conn) -> None:  # pragma: no cover - corre en el proceso hijo
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        kind, arg = job
+        try:
+            conn.send((True, _PARSERS[kind](arg)))
+        except Exception as e:  # noqa: BLE001
+            conn.send((False, f"{type(e).__name__}: {e}"))
+
+
+class _Worker:
+    def __init__(self, ctx):
+        self.conn, child = ctx.Pipe()
+        self.proc = ctx.Process(target=_worker_main, args=(child,), daemon=True)
+        self.proc.start()
+        child.close()
+        self.jobs = 0
+
+    def stop(self) -> None:
+        try:
+            self.conn.send(None)
+        except (OSError, ValueError):
+            pass
+        self.proc.join(timeout=1)
+        self.kill()
+
+    def kill(self) -> None:
+        if self.proc.is_alive():
+            self.proc.kill()
+        self.proc.join()
+        self.conn.close()
+
+
+class DocxParsePool:
+    """
+    Pool de procesos para python-docx. Cada llamada toma un proceso libre,
+    espera a lo sumo `timeout` segundos y, si no hay respuesta, mata ese
+    proceso y arranca otro (los demás siguen trabajando). Los procesos se
+    reciclan cada `recycle_after` documentos para acotar la memoria.
+    Seguro para usar desde varios hilos.
+    """
+
+    def __init__(self, workers: int = 2, timeout: float = 60.0, recycle_after: int = 200):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.recycle_after = recycle_after
+        self._ctx = mp.get_context()
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._all: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._started = False
+        self.timeouts = 0
+        atexit.register(self.close)
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.workers):
+                self._spawn()
+            self._started = True
+
+    def _spawn(self) -> None:
+        worker = _Worker(self._ctx)
+        self._all.append(worker)
+        self._idle.put(worker)
+
+    def _replace(self, worker: _Worker, kill: bool) -> None:
+        worker.kill() if kill else worker.stop()
+        with self._lock:
+            if worker in self._all:
+                self._all.remove(worker)
+            if self._started:
+                self._spawn()
+
+    def _run(self, kind: str, arg: Any, name: str) -> Any:
+        self._start()
+        worker = self._idle.get()
+        try:
+            worker.conn.send((kind, arg))
+            ready = worker.conn.poll(self.timeout)
+            if ready:
+                ok, result = worker.conn.recv()
+        except (EOFError, OSError) as e:
+            self._replace(worker, kill=True)
+            raise DocxParseError(f"El proceso de parseo de {name} terminó inesperadamente: {e}") from e
+        if not ready:
+            self.timeouts += 1
+            self._replace(worker, kill=True)
+            raise DocxParseTimeout(name, self.timeout)
+
+        worker.jobs += 1
+        if worker.jobs >= self.recycle_after:
+            self._replace(worker, kill=False)
+        else:
+            self._idle.put(worker)
+        if not ok:
+            raise DocxParseError(f"No se pudo leer {name}: {result}")
+        return result
+
+    def docx_text(self, data: bytes, name: str = "docx") -> str:
+        """Texto de los párrafos (equivalente a `drive_client.docx_to_text`)."""
+        return self._run("text", data, name)
+
+    def docx_text_file(self, path: str | Path, name: str = "docx") -> str:
+        """Como `docx_text`, leyendo el .docx desde disco en el proceso hijo."""
+        return self._run("text_file", str(path), name)
+
+    def docx_fields(self, path: str | Path) -> Any:
+        """`extract_from_docx` de la GUI ejecutado en el pool."""
+        return self._run("fields", str(path), Path(path).name)
+
+    def close(self) -> None:
+        with self._lock:
+            workers, self._all = self._all, []
+            self._started = False
+        for worker in workers:
+            worker.stop()
+        self._idle = queue.Queue()
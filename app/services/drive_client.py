@@ -1,28 +1,66 @@
-import io
 import os
 import time
-from typing import Any as any, Dict, List
+from typing import Any as any, Dict, List, Optional
 
 from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from docx import Document
 
+from app.services.docx_pool import DocxParsePool
+from app.services.spool import MemoryBudget, SpooledBuffer
+
 DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+# Tamaño de cada petición parcial de descarga (MediaIoBaseDownload usa 100 MB por defecto)
+DOWNLOAD_CHUNK_BYTES = 4 * 1024 * 1024
+SPOOL_THRESHOLD_BYTES = 8 * 1024 * 1024
+
+
+def docx_to_text(fh) -> str:
+    """Texto de los párrafos de un .docx (ruta o archivo binario abierto)."""
+    doc = Document(fh)
+    return "\n".join(p.text for p in doc.paragraphs)
+
+
+def parse_spooled(buf: SpooledBuffer, name: str, parse_pool: Optional[DocxParsePool] = None) -> str:
+    """Texto de un .docx descargado en un SpooledBuffer (en RAM o en disco)."""
+    if parse_pool is None:
+        return docx_to_text(buf.reader())
+    # El proceso hijo lee el archivo: lo escrito debe estar en disco, no en el buffer del archivo
+    path = buf.sync()
+    if path is not None:
+        return parse_pool.docx_text_file(path, name)
+    return parse_pool.docx_text(buf.getvalue(), name)
+
+
+def list_docx_request(drive_service, folder_id: str, token: Optional[str] = None):
+    """Petición de una página del listado de .docx de la carpeta (la ejecuta el cliente síncrono o el asíncrono)."""
+    return drive_service.files().list(
+        q=f"'{folder_id}' in parents and mimeType='{DOCX_MIME}' and trashed=false",
+        spaces="drive",
+        fields="nextPageToken, files(id, name, modifiedTime)",
+        pageToken=token,
+    )
+
 
 class DriveClient:
-    def __init__(self, drive_service):
+    def __init__(
+        self,
+        drive_service,
+        parse_pool: Optional[DocxParsePool] = None,
+        spool_threshold: int = SPOOL_THRESHOLD_BYTES,
+        budget: Optional[MemoryBudget] = None,
+    ):
         self.drive = drive_service
+        # Con pool, el parseo del .docx corre en otro proceso con tiempo límite
+        self.parse_pool = parse_pool
+        # Descargas en RAM hasta `spool_threshold` (y dentro del presupuesto global); si no, a disco
+        self.spool_threshold = spool_threshold
+        self.budget = budget
 
     def list_docx_in_folder(self, folder_id: str) -> List[Dict[str, any]]:
-        q = f"'{folder_id}' in parents and mimeType='{DOCX_MIME}' and trashed=false"
         files = []
         token = None
         while True:
-            resp = self.drive.files().list(
-                q=q,
-                spaces="drive",
-                fields="nextPageToken, files(id, name, modifiedTime)",
-                pageToken=token,
-            ).execute()
+            resp = list_docx_request(self.drive, folder_id, token).execute()
             files.extend(resp.get("files", []))
             token = resp.get("nextPageToken")
             if not token:
@@ -35,18 +73,21 @@ class DriveClient:
         Realiza reintentos exponenciales ante errores de conexión para
         manejar cierres abruptos de la conexión como WinError 10054.
         """
+        with self._download(file_id, retries, backoff) as buf:
+            return parse_spooled(buf, file_id, self.parse_pool)
+
+    def _download(self, file_id: str, retries: int, backoff: int) -> SpooledBuffer:
         for attempt in range(retries):
+            buf = SpooledBuffer(self.spool_threshold, self.budget)
             try:
                 request = self.drive.files().get_media(fileId=file_id)
-                fh = io.BytesIO()
-                downloader = MediaIoBaseDownload(fh, request)
+                downloader = MediaIoBaseDownload(buf, request, chunksize=DOWNLOAD_CHUNK_BYTES)
                 done = False
                 while not done:
                     _, done = downloader.next_chunk()
-                fh.seek(0)
-                doc = Document(fh)
-                return "\n".join(p.text for p in doc.paragraphs)
+                return buf
             except Exception as e:  # noqa: BLE001
+                buf.close()
                 if attempt == retries - 1:
                     raise
                 wait = backoff ** attempt
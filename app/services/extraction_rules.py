@@ -0,0 +1,203 @@
+# app/services/extraction_rules.py
+"""Listas cerradas del prompt y validación del JSON devuelto por Gemini."""
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+SUBREGIONES: Dict[str, List[str]] = {
+    "BAJO CAUCA": ["CÁCERES", "CAUCASIA", "EL BAGRE", "NECHÍ", "TARAZÁ", "ZARAGOZA"],
+    "MAGDALENA MEDIO": ["CARACOLÍ", "MACEO", "PUERTO BERRÍO", "PUERTO NARE", "PUERTO TRIUNFO", "YONDÓ"],
+    "NORDESTE": [
+        "AMALFI", "ANORÍ", "CISNEROS", "REMEDIOS", "SAN ROQUE", "SANTO DOMINGO", "SEGOVIA",
+        "VEGACHÍ", "YALÍ", "YOLOMBÓ",
+    ],
+    "NORTE": [
+        "ANGOSTURA", "BELMIRA", "BRICEÑO", "CAMPAMENTO", "CAROLINA", "DON MATÍAS", "ENTRERRÍOS",
+        "GÓMEZ PLATA", "GUADALUPE", "ITUANGO", "SAN ANDRÉS", "SAN JOSÉ DE LA MONTAÑA", "SAN PEDRO",
+        "SANTA ROSA DE OSOS", "TOLEDO", "VALDIVIA", "YARUMAL",
+    ],
+    "OCCIDENTE": [
+        "ABRIAQUÍ", "ANZÁ", "ARMENIA", "BURITICÁ", "CAÑASGORDAS", "DABEIBA", "EBÉJICO", "FRONTINO",
+        "GIRALDO", "HELICONIA", "LIBORINA", "OLAYA", "PEQUE", "SABANALARGA", "SAN JERÓNIMO",
+        "SANTAFÉ DE ANTIOQUIA", "SOPETRÁN", "URAMITA",
+    ],
+    "ORIENTE": [
+        "ABEJORRAL", "ALEJANDRÍA", "ARGELIA", "EL CARMEN DE VÍBORAL", "COCORNÁ", "CONCEPCIÓN",
+        "GRANADA", "GUARNE", "LA CEJA", "LA UNIÓN", "MARINILLA", "EL PEÑOL", "EL RETIRO", "RIONEGRO",
+        "SAN CARLOS", "SAN FRANCISCO", "SAN LUIS", "SAN RAFAEL", "SAN VICENTE", "EL SANTUARIO", "SONSÓN",
+    ],
+    "SUROESTE": [
+        "AMAGÁ", "ANDES", "ANGELÓPOLIS", "BETANIA", "BETULIA", "CAICEDO", "CARAMANTA",
+        "CIUDAD BOLÍVAR", "CONCORDIA", "FREDONIA", "HISPANIA", "JARDÍN", "JERICÓ", "LA PINTADA",
+        "MONTEBELLO", "PUEBLORRICO", "SALGAR", "SANTA BÁRBARA", "TÁMESIS", "TARSO", "TITIRIBÍ",
+        "URRAO", "VALPARAISO", "VENECIA",
+    ],
+    "URABÁ": [
+        "APARTADÓ", "ARBOLETES", "CAREPA", "CHIGORODÓ", "MURINDÓ", "MUTATA", "NECOCLÍ",
+        "SAN JUAN DE URABÁ", "SAN PEDRO DE URABÁ", "TURBO", "VIGÍA DEL FUERTE",
+    ],
+    "VALLE DE ABURRÁ": [
+        "BARBOSA", "BELLO", "CALDAS", "COPACABANA", "ENVIGADO", "GIRARDOTA", "ITAGÜÍ",
+        "LA ESTRELLA", "MEDELLÍN", "SABANETA",
+    ],
+}
+
+TIPOS_SOLICITUD = [
+    "Primera vez",
+    "Modificación OPR/EPR",
+    "Modificación cambio tubo",
+    "Modificación Razón Social o Representante legal",
+    "Renovación",
+    "Corrección",
+    "PSPRYCC (Prestación de Servicio de Protección Radiológica y Control de Calidad)",
+]
+
+TIPOS_EQUIPO = [
+    "PERIAPICAL", "PERIAPICAL PORTÁTIL", "PANORÁMICO", "TOMÓGRAFO ODONTOLÓGICO", "DENSITÓMETRO",
+    "CONVENCIONAL", "RX PORTÁTIL", "ARCO EN C", "MAMÓGRAFO", "TOMÓGRAFO", "MULTIPROPÓSITO",
+    "FLUOROSCOPIO", "ANGIÓGRAFO", "ACELERADOR LINEAL", "PET-CT", "SPECT-CT",
+    "RADIOCIRUGÍA ROBÓTICA", "INDUSTRIAL BAJA COMPLEJIDAD", "INDUSTRIAL ALTA COMPLEJIDAD",
+    "INVESTIGACIÓN", "VETERINARIO",
+]
+
+CATEGORIAS = [
+    "I ODONTOLÓGICO", "II ODONTOLÓGICO", "I MÉDICO", "II MÉDICO", "I INDUSTRIAL",
+    "II INDUSTRIAL", "II INVESTIGACIÓN", "II VETERINARIO",
+]
+
+# Llaves que el prompt exige en la salida
+REQUIRED_KEYS = [
+    "NOMBRE O RAZÓN SOCIAL", "NIT O CC", "SUBREGIÓN", "MUNICIPIO", "TIPO DE SOLICITUD",
+    "CATEGORÍA", "EQUIPOS",
+]
+
+# Solicitudes en las que el prompt pide dejar en null los datos de equipos
+SOLICITUDES_SIN_EQUIPOS = {
+    "Modificación OPR/EPR",
+    "Modificación Razón Social o Representante legal",
+}
+
+NO_REGISTRA = "NO REGISTRA"
+FECHA_RE = re.compile(r"^\d{1,2}/\d{1,2}/\d{4}$")
+
+# Palabras clave para recortar el fragmento de texto que se reenvía en la re-consulta
+SNIPPET_KEYWORDS: Dict[str, List[str]] = {
+    "MUNICIPIO": ["MUNICIPIO", "CIUDAD", "DIRECCION", "SEDE", "SUBREGION"],
+    "SERIE": ["SERIE", "EQUIPO", "MODELO", "MARCA"],
+    "FECHA CC": ["CONTROL DE CALIDAD", "CONTROL CALIDAD", "REALIZADO POR", "FECHA"],
+}
+
+
+def normalize(value: Any) -> str:
+    """Normaliza para comparar sin acentos ni mayúsculas/minúsculas."""
+    s = unicodedata.normalize("NFD", str(value or ""))
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    return " ".join(s.upper().split())
+
+
+_MUNICIPIO_A_SUBREGION: Dict[str, str] = {
+    normalize(m): sub for sub, municipios in SUBREGIONES.items() for m in municipios
+}
+_MUNICIPIO_CANONICO: Dict[str, str] = {
+    normalize(m): m for municipios in SUBREGIONES.values() for m in municipios
+}
+
+
+def canonical_municipio(value: Any) -> Optional[str]:
+    """Devuelve el municipio tal como aparece en la lista cerrada, o None."""
+    return _MUNICIPIO_CANONICO.get(normalize(value))
+
+
+def subregion_for(municipio: Any) -> Optional[str]:
+    return _MUNICIPIO_A_SUBREGION.get(normalize(municipio))
+
+
+def _is_blank(value: Any) -> bool:
+    return value is None or str(value).strip() == ""
+
+
+def equipos_expected(payload: Dict[str, Any]) -> bool:
+    """False cuando el tipo de solicitud deja los equipos en null."""
+    tipo = normalize(payload.get("TIPO DE SOLICITUD"))
+    return tipo not in {normalize(t) for t in SOLICITUDES_SIN_EQUIPOS}
+
+
+def find_issues(payload: Dict[str, Any]) -> List[str]:
+    """
+    Lista los campos faltantes o inválidos del resultado de `summarize`.
+    Los campos de equipo se reportan como "EQUIPOS[i].CAMPO" (i base 0).
+    """
+    issues: List[str] = []
+    if canonical_municipio(payload.get("MUNICIPIO")) is None:
+        issues.append("MUNICIPIO")
+
+    if not equipos_expected(payload):
+        return issues
+    equipos = payload.get("EQUIPOS")
+    if not isinstance(equipos, list):
+        return issues
+    for i, eq in enumerate(equipos):
+        if not isinstance(eq, dict):
+            continue
+        if _is_blank(eq.get("SERIE")):
+            issues.append(f"EQUIPOS[{i}].SERIE")
+        fecha_cc = str(eq.get("FECHA CC") or "").strip()
+        if fecha_cc.upper() != NO_REGISTRA and not FECHA_RE.match(fecha_cc):
+            issues.append(f"EQUIPOS[{i}].FECHA CC")
+    return issues
+
+
+def validate(payload: Dict[str, Any]) -> List[str]:
+    """
+    Validación completa usada por el ruteo de modelos: llaves obligatorias,
+    listas cerradas y coherencia municipio/subregión, además de `find_issues`.
+    """
+    if not isinstance(payload, dict):
+        return ["<no es un objeto JSON>"]
+    errors = [f"falta {k}" for k in REQUIRED_KEYS if k not in payload]
+    if normalize(payload.get("TIPO DE SOLICITUD")) not in {normalize(t) for t in TIPOS_SOLICITUD}:
+        errors.append("TIPO DE SOLICITUD")
+    if normalize(payload.get("CATEGORÍA")) not in {normalize(c) for c in CATEGORIAS}:
+        errors.append("CATEGORÍA")
+    if normalize(payload.get("SUBREGIÓN")) not in {normalize(s) for s in SUBREGIONES}:
+        errors.append("SUBREGIÓN")
+    else:
+        sub = subregion_for(payload.get("MUNICIPIO"))
+        if sub and normalize(sub) != normalize(payload.get("SUBREGIÓN")):
+            errors.append("SUBREGIÓN/MUNICIPIO")
+    if equipos_expected(payload):
+        equipos = payload.get("EQUIPOS")
+        if not isinstance(equipos, list) or not equipos:
+            errors.append("EQUIPOS")
+        else:
+            tipos = {normalize(t) for t in TIPOS_EQUIPO}
+            for i, eq in enumerate(equipos):
+                if not isinstance(eq, dict) or normalize(eq.get("TIPO DE EQUIPO")) not in tipos:
+                    errors.append(f"EQUIPOS[{i}].TIPO DE EQUIPO")
+    return errors + find_issues(payload)
+
+
+def field_name(issue: str) -> str:
+    """'EQUIPOS[1].SERIE' → 'SERIE'."""
+    return issue.split(".", 1)[1] if "." in issue else issue
+
+
+def snippet_for(text: str, fields: List[str], context: int = 2, limit: int = 4000) -> str:
+    """Recorta las líneas del documento relevantes para los campos a re-consultar."""
+    lines = text.splitlines()
+    keywords = {kw for f in fields for kw in SNIPPET_KEYWORDS.get(f, [f])}
+    keep: List[int] = []
+    for i, line in enumerate(lines):
+        norm = normalize(line)
+        if norm and any(kw in norm for kw in keywords):
+            keep.extend(range(max(0, i - context), min(len(lines), i + context + 1)))
+    if not keep:
+        return text[:limit]
+    out: List[str] = []
+    last = -2
+    for i in sorted(set(keep)):
+        if i != last + 1 and out:
+            out.append("[...]")
+        out.append(lines[i])
+        last = i
+    return "\n".join(out)[:limit]
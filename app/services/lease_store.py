@@ -0,0 +1,131 @@
+# app/services/lease_store.py
+"""Reparto del trabajo entre varios procesos del pipeline sobre la misma carpeta.
+
+Cada proceso (worker) reclama los radicados que va a procesar con un lease
+con vencimiento en un archivo SQLite compartido: mientras el lease siga
+vigente, ningún otro worker llama a la IA ni escribe el bloque de ese
+radicado. Un worker que se cae deja de renovar sus leases y, al vencer, otro
+los toma sin intervención. Los archivos terminados se anotan para que quien
+herede un radicado no repita los que ya procesó otro en la misma corrida.
+"""
+import os
+import socket
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+
+def default_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+@dataclass
+class Lease:
+    key: str
+    owner: str
+    expires_at: float
+    # Worker que tenía el radicado antes (None si era propio o nuevo) y hasta cuándo
+    previous_owner: Optional[str] = None
+    previous_until: float = 0.0
+
+
+class LeaseStore:
+    """
+    Leases por clave (el radicado) con vencimiento en `ttl` segundos. Las
+    marcas de tiempo son de reloj de pared (time.time) porque se comparan
+    entre procesos; en varias máquinas, los relojes deben estar sincronizados.
+    """
+
+    def __init__(self, path: str, owner: Optional[str] = None, ttl: float = 900.0):
+        self.path = path
+        self.owner = owner or default_worker_id()
+        self.ttl = ttl
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.Lock()
+        # Transacciones explícitas (BEGIN IMMEDIATE); `timeout` espera a los otros procesos
+        self._conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+        # Journal de rollback (no WAL): WAL necesita memoria compartida entre procesos y no
+        # funciona en carpetas de red; DELETE también convierte una base creada antes en WAL
+        self._conn.execute("PRAGMA journal_mode=DELETE")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS done "
+            "(file_id TEXT PRIMARY KEY, key TEXT NOT NULL, owner TEXT NOT NULL, done_at REAL NOT NULL)"
+        )
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def acquire(self, key: str) -> Optional[Lease]:
+        """Toma (o renueva) el lease de `key`; None si otro worker lo tiene vigente."""
+        now = time.time()
+        expires_at = now + self.ttl
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT owner, expires_at FROM leases WHERE key = ?", (key,)).fetchone()
+                if row is not None and row[0] != self.owner and row[1] > now:
+                    self._conn.execute("ROLLBACK")
+                    return None
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO leases (key, owner, expires_at) VALUES (?, ?, ?)",
+                    (key, self.owner, expires_at),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None or row[0] == self.owner:
+            return Lease(key, self.owner, expires_at)
+        return Lease(key, self.owner, expires_at, row[0], row[1])
+
+    def renew(self, key: str) -> bool:
+        """Extiende el lease propio de `key`; False si venció y otro worker lo tomó."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE key = ? AND owner = ?",
+                (time.time() + self.ttl, key, self.owner),
+            )
+            return cur.rowcount == 1
+
+    def renew_all(self) -> int:
+        """Extiende todos los leases propios aún vigentes (latido del worker)."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE owner = ? AND expires_at > ?",
+                (now + self.ttl, self.owner, now),
+            )
+            return cur.rowcount
+
+    def release_all(self) -> int:
+        """Vence los leases propios. El dueño queda anotado (ver `Lease.previous_owner`)."""
+        now = time.time()
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE leases SET expires_at = ? WHERE owner = ? AND expires_at > ?", (now, self.owner, now)
+            )
+            return cur.rowcount
+
+    def mark_done(self, file_id: str, key: str) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO done (file_id, key, owner, done_at) VALUES (?, ?, ?, ?)",
+                (file_id, key, self.owner, time.time()),
+            )
+
+    def done_by_other(self, file_id: str, since: float) -> Optional[str]:
+        """Worker que terminó `file_id` después de `since` (inicio de la corrida), si no fue este."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT owner FROM done WHERE file_id = ? AND done_at >= ? AND owner != ?",
+                (file_id, since, self.owner),
+            ).fetchone()
+        return row[0] if row else None
@@ -0,0 +1,191 @@
+# app/services/prompt_cache.py
+"""Cache del prefijo estático del prompt (instrucciones + listas) en Gemini.
+
+Las instrucciones de `PROMPT_TEMPLATE` son idénticas para todos los documentos;
+se suben una vez como *cached content* y cada llamada envía solo el texto del
+documento referenciando el handle. El backend es intercambiable para poder
+probar contra un sustituto local.
+"""
+import hashlib
+import threading
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class PromptCacheBackend(ABC):
+    """Interfaz mínima: crear, refrescar y borrar un handle de contenido cacheado."""
+
+    @abstractmethod
+    def create(self, model: str, prefix: str, ttl_seconds: int) -> Tuple[str, int]:
+        """Devuelve (handle, tokens del prefijo)."""
+
+    @abstractmethod
+    def refresh(self, handle: str, ttl_seconds: int) -> bool:
+        """Extiende el TTL; False si el handle ya no existe."""
+
+    @abstractmethod
+    def delete(self, handle: str) -> None:
+        """Borra el handle (sin error si ya no existe)."""
+
+
+class GeminiCacheBackend(PromptCacheBackend):
+    """Backend real sobre `client.caches` de google-genai."""
+
+    def __init__(self, client: Any):
+        self.client = client
+
+    def create(self, model: str, prefix: str, ttl_seconds: int) -> Tuple[str, int]:
+        cache = self.client.caches.create(
+            model=model,
+            config={
+                "contents": [prefix],
+                "ttl": f"{int(ttl_seconds)}s",
+                "display_name": "gobant-rx-prompt",
+            },
+        )
+        usage = getattr(cache, "usage_metadata", None)
+        tokens = int(getattr(usage, "total_token_count", 0) or 0)
+        return cache.name, tokens
+
+    def refresh(self, handle: str, ttl_seconds: int) -> bool:
+        try:
+            self.client.caches.update(name=handle, config={"ttl": f"{int(ttl_seconds)}s"})
+            return True
+        except Exception:
+            return False
+
+    def delete(self, handle: str) -> None:
+        try:
+            self.client.caches.delete(name=handle)
+        except Exception:
+            pass
+
+
+class LocalCacheBackend(PromptCacheBackend):
+    """Sustituto en memoria para pruebas: guarda el prefijo y estima tokens (~4 caracteres/token)."""
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.entries: Dict[str, Tuple[str, float]] = {}
+        self.created = 0
+
+    def create(self, model: str, prefix: str, ttl_seconds: int) -> Tuple[str, int]:
+        self.created += 1
+        handle = f"cachedContents/local-{self.created}"
+        self.entries[handle] = (prefix, self.clock() + ttl_seconds)
+        return handle, max(1, len(prefix) // 4)
+
+    def refresh(self, handle: str, ttl_seconds: int) -> bool:
+        if handle not in self.entries or self.entries[handle][1] <= self.clock():
+            return False
+        prefix, _ = self.entries[handle]
+        self.entries[handle] = (prefix, self.clock() + ttl_seconds)
+        return True
+
+    def delete(self, handle: str) -> None:
+        self.entries.pop(handle, None)
+
+    def resolve(self, handle: str) -> Optional[str]:
+        """Prefijo asociado a un handle vigente (para clientes falsos)."""
+        entry = self.entries.get(handle)
+        if not entry or entry[1] <= self.clock():
+            return None
+        return entry[0]
+
+
+@dataclass
+class _Entry:
+    handle: str
+    tokens: int
+    expires_at: float
+
+
+class PromptPrefixCache:
+    """
+    Mantiene un handle por (modelo, prefijo) y lo renueva antes de que venza el TTL.
+    Si el backend rechaza el prefijo (p. ej. por tamaño mínimo) se desactiva
+    para esa combinación y las llamadas envían el prompt completo.
+    """
+
+    def __init__(
+        self,
+        backend: PromptCacheBackend,
+        ttl_seconds: int = 3600,
+        refresh_margin: int = 300,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = min(refresh_margin, ttl_seconds // 2)
+        self.clock = clock
+        self._entries: Dict[Tuple[str, str], _Entry] = {}
+        self._disabled: set = set()
+        self._lock = threading.Lock()
+        # Uno por (modelo, prefijo): crear/refrescar es una llamada de red y no debe frenar a las demás claves
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self.hits = 0
+        self.tokens_saved = 0
+
+    @staticmethod
+    def _digest(prefix: str) -> str:
+        return hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    def handle_for(self, model: str, prefix: str) -> Optional[str]:
+        key = (model, self._digest(prefix))
+        with self._lock:
+            if key in self._disabled:
+                return None
+            entry = self._entries.get(key)
+            if entry and self.clock() < entry.expires_at - self.refresh_margin:
+                return entry.handle
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        # Crear o refrescar es una llamada de red: fuera del candado general
+        if entry and self.clock() < entry.expires_at:
+            if not key_lock.acquire(blocking=False):
+                return entry.handle  # otro hilo lo está renovando y aún está vigente
+        else:
+            key_lock.acquire()
+        try:
+            return self._renew(key, model, prefix)
+        finally:
+            key_lock.release()
+
+    def _renew(self, key: Tuple[str, str], model: str, prefix: str) -> Optional[str]:
+        with self._lock:
+            # Otro hilo pudo renovarlo (o desactivarlo) mientras se esperaba
+            if key in self._disabled:
+                return None
+            entry = self._entries.get(key)
+            now = self.clock()
+            if entry and now < entry.expires_at - self.refresh_margin:
+                return entry.handle
+        if entry and now < entry.expires_at and self.backend.refresh(entry.handle, self.ttl_seconds):
+            with self._lock:
+                entry.expires_at = now + self.ttl_seconds
+            return entry.handle
+        try:
+            handle, tokens = self.backend.create(model, prefix, self.ttl_seconds)
+        except Exception:
+            with self._lock:
+                self._disabled.add(key)
+            return None
+        with self._lock:
+            self._entries[key] = _Entry(handle, tokens, now + self.ttl_seconds)
+        return handle
+
+    def record_hit(self, model: str, prefix: str, cached_tokens: int = 0) -> None:
+        """Registra una llamada servida con el prefijo cacheado."""
+        with self._lock:
+            entry = self._entries.get((model, self._digest(prefix)))
+            self.hits += 1
+            self.tokens_saved += cached_tokens or (entry.tokens if entry else 0)
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.hits = 0
+            self.tokens_saved = 0
+
+    def report(self) -> str:
+        return f"Prefijo cacheado: {self.hits} llamadas, ~{self.tokens_saved} tokens de entrada ahorrados"
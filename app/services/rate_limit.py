@@ -0,0 +1,71 @@
+# app/services/rate_limit.py
+"""Límite de peticiones por API compartido entre varios pipelines (tenants).
+
+Cada API (Drive, Sheets, Gemini) tiene un cupo por minuto para todo el
+proceso. Cuando varios tenants esperan, el cupo se entrega por turnos (una
+petición de cada uno), así un tenant con la carpeta grande no deja sin
+capacidad a los demás.
+"""
+import asyncio
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Optional
+
+
+@dataclass
+class TenantUsage:
+    requests: int = 0
+    waited: float = 0.0  # segundos esperando turno
+
+
+class FairRateLimiter:
+    """`per_minute` peticiones por minuto (0 = sin límite), repartidas por turnos entre tenants."""
+
+    def __init__(self, name: str, per_minute: float, burst: int = 1):
+        self.name = name
+        self.interval = 60.0 / per_minute if per_minute > 0 else 0.0
+        self.burst = max(1, burst)
+        self.usage: Dict[str, TenantUsage] = {}
+        self._waiters: Dict[str, Deque[asyncio.Future]] = {}
+        self._turns: Deque[str] = deque()
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._pump: Optional[asyncio.Task] = None
+
+    async def acquire(self, tenant: str) -> None:
+        usage = self.usage.setdefault(tenant, TenantUsage())
+        usage.requests += 1
+        if not self.interval:
+            return
+        t0 = time.monotonic()
+        fut = asyncio.get_running_loop().create_future()
+        queue = self._waiters.setdefault(tenant, deque())
+        if not queue:
+            self._turns.append(tenant)
+        queue.append(fut)
+        if self._pump is None or self._pump.done():
+            self._pump = asyncio.ensure_future(self._dispatch())
+        try:
+            await fut
+        finally:
+            usage.waited += time.monotonic() - t0
+
+    async def _dispatch(self) -> None:
+        while self._turns:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._last) / self.interval)
+            self._last = now
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) * self.interval)
+                continue
+            tenant = self._turns.popleft()
+            queue = self._waiters[tenant]
+            fut = queue.popleft()
+            if queue:
+                # Al final de la fila: el siguiente turno es de otro tenant
+                self._turns.append(tenant)
+            if fut.cancelled():
+                continue
+            self._tokens -= 1
+            fut.set_result(None)
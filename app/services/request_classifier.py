@@ -0,0 +1,73 @@
+# app/services/request_classifier.py
+"""Pre-clasificador local del TIPO DE SOLICITUD (sin llamar a Gemini).
+
+Solo responde cuando la evidencia es inequívoca; ante la duda devuelve None y
+el documento se envía con el prompt completo.
+"""
+import re
+from typing import List, Optional, Tuple
+
+from app.services.extraction_rules import SOLICITUDES_SIN_EQUIPOS, normalize
+
+CAMBIO_TUBO = "Modificación cambio tubo"
+MOD_OPR = "Modificación OPR/EPR"
+MOD_RAZON_SOCIAL = "Modificación Razón Social o Representante legal"
+
+# Qué se modifica, según el contenido de la sección "DATOS A MODIFICAR"
+_MODIFICACIONES: List[Tuple[str, List[str]]] = [
+    (CAMBIO_TUBO, ["TUBO", "TUBO DE RAYOS X", "TUBO RX"]),
+    (MOD_OPR, ["OPR", "EPR", "OFICIAL DE PROTECCION RADIOLOGICA", "ENCARGADO DE PROTECCION RADIOLOGICA"]),
+    (MOD_RAZON_SOCIAL, ["RAZON SOCIAL", "REPRESENTANTE LEGAL"]),
+]
+
+# Tipos que suelen aparecer escritos junto al rótulo "TIPO DE SOLICITUD"
+_TIPOS_DIRECTOS: List[Tuple[str, List[str]]] = [
+    ("Primera vez", ["PRIMERA VEZ", "LICENCIA NUEVA"]),
+    ("Renovación", ["RENOVACION"]),
+    ("Corrección", ["CORRECCION"]),
+    (
+        "PSPRYCC (Prestación de Servicio de Protección Radiológica y Control de Calidad)",
+        ["PSPRYCC", "PRESTACION DE SERVICIO DE PROTECCION RADIOLOGICA"],
+    ),
+]
+
+_SECCION_MODIFICAR = "DATOS A MODIFICAR"
+_ROTULOS_TIPO = ("TIPO DE SOLICITUD", "TIPO DE TRAMITE")
+
+
+def _has_word(haystack: str, needle: str) -> bool:
+    return re.search(rf"\b{re.escape(needle)}\b", haystack) is not None
+
+
+def _unique_hit(window: str, table: List[Tuple[str, List[str]]]) -> Optional[str]:
+    hits = {tipo for tipo, words in table if any(_has_word(window, w) for w in words)}
+    return hits.pop() if len(hits) == 1 else None
+
+
+def classify_request(text: str, section_lines: int = 8) -> Optional[str]:
+    """Detecta el TIPO DE SOLICITUD con palabras clave; None si no es inequívoco."""
+    lines = [normalize(line) for line in text.splitlines()]
+
+    # 1) Una sección DATOS A MODIFICAR indica una modificación: ¿de qué?
+    for i, line in enumerate(lines):
+        if _SECCION_MODIFICAR in line:
+            window = " ".join(lines[i + 1:i + 1 + section_lines]) or line
+            return _unique_hit(window, _MODIFICACIONES)
+
+    # 2) El rótulo TIPO DE SOLICITUD con una sola opción escrita a su lado
+    for i, line in enumerate(lines):
+        if any(r in line for r in _ROTULOS_TIPO):
+            window = " ".join(lines[i:i + 2])
+            tipo = _unique_hit(window, _TIPOS_DIRECTOS + _MODIFICACIONES)
+            if tipo:
+                return tipo
+    return None
+
+
+def variant_for(tipo: Optional[str]) -> str:
+    """Variante de prompt para un tipo de solicitud (ver `ai_client.PROMPT_VARIANTS`)."""
+    if tipo is None:
+        return "completo"
+    if tipo in SOLICITUDES_SIN_EQUIPOS:
+        return "sin_equipos"
+    return "equipos"
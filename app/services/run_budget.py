@@ -0,0 +1,124 @@
+# app/services/run_budget.py
+"""Presupuesto diario y punto de control de las corridas planificadas.
+
+Guarda en un JSON el consumo del día (llamadas y tokens de Gemini,
+escrituras en Sheets) y los archivos ya terminados, para que una corrida
+cortada por presupuesto u hora límite deje a la siguiente continuar donde
+quedó y no se repita lo que no cambió (ver
+`IngestPipeline.process_folder_scheduled`).
+"""
+import json
+import os
+import threading
+import time
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, Optional
+
+
+def parse_deadline(value: str, now: Optional[datetime] = None) -> Optional[datetime]:
+    """"HH:MM" → próxima ocurrencia de esa hora local (hoy o mañana); "" → sin límite."""
+    if not value.strip():
+        return None
+    now = now or datetime.now()
+    hour, minute = (int(x) for x in value.strip().split(":"))
+    deadline = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    return deadline if deadline > now else deadline + timedelta(days=1)
+
+
+def drive_time(value: str) -> float:
+    """`modifiedTime` de Drive (RFC 3339) → timestamp; 0 si falta."""
+    if not value:
+        return 0.0
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+
+
+class RunBudget:
+    """
+    Límites en 0 = sin límite. El consumo se informa con `update` (totales de
+    la corrida) y se suma a lo ya gastado hoy por corridas anteriores.
+    `exhausted` corta antes de empezar un documento que, por el promedio de
+    los anteriores, ya no alcanza.
+    """
+
+    LIMITS = ("ai_calls", "ai_tokens", "sheet_writes")
+
+    def __init__(
+        self,
+        path: str,
+        ai_calls: int = 0,
+        ai_tokens: int = 0,
+        sheet_writes: int = 0,
+        deadline: Optional[datetime] = None,
+    ):
+        self.path = path
+        self.limits = {"ai_calls": ai_calls, "ai_tokens": ai_tokens, "sheet_writes": sheet_writes}
+        self.deadline = deadline
+        self._lock = threading.Lock()
+        state = self._load()
+        today = date.today().isoformat()
+        used = state.get("used", {}) if state.get("day") == today else {}
+        self.day = today
+        # Consumo de corridas anteriores de hoy y de esta corrida
+        self.base = {k: int(used.get(k, 0)) for k in self.LIMITS}
+        self.run = {k: 0 for k in self.LIMITS}
+        # file_id → momento en que se terminó (vale mientras el archivo no cambie en Drive)
+        self.done: Dict[str, float] = dict(state.get("done", {}))
+        self.started = time.time()
+        self.docs = 0
+        self.stop_reason: Optional[str] = None
+
+    def _load(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save(self) -> None:
+        with self._lock:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            used = {k: self.base[k] + self.run[k] for k in self.LIMITS}
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"day": self.day, "used": used, "done": self.done}, f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+
+    def update(self, ai_calls: int, ai_tokens: int, sheet_writes: int) -> None:
+        self.run = {"ai_calls": ai_calls, "ai_tokens": ai_tokens, "sheet_writes": sheet_writes}
+
+    def used(self, key: str) -> int:
+        return self.base[key] + self.run[key]
+
+    def exhausted(self) -> Optional[str]:
+        """Motivo para no empezar otro documento (y queda en `stop_reason`), o None."""
+        if self.stop_reason:
+            return self.stop_reason
+        docs = max(self.docs, 1)
+        for key, limit in self.limits.items():
+            # Margen: lo que costó en promedio cada documento de esta corrida
+            if limit and self.used(key) + self.run[key] / docs >= limit:
+                self.stop_reason = f"presupuesto diario de {key} ({self.used(key)}/{limit})"
+                return self.stop_reason
+        if self.deadline is not None:
+            per_doc = (time.time() - self.started) / docs
+            if datetime.now() + timedelta(seconds=per_doc) >= self.deadline:
+                self.stop_reason = f"hora límite {self.deadline:%H:%M}"
+                return self.stop_reason
+        return None
+
+    def is_done(self, file_id: str, modified_time: str) -> bool:
+        """Terminado y sin cambios en Drive desde entonces."""
+        finished = self.done.get(file_id)
+        return finished is not None and finished >= drive_time(modified_time)
+
+    def mark_done(self, file_id: str) -> None:
+        with self._lock:
+            self.done[file_id] = time.time()
+            self.docs += 1
+        self.save()
+
+    def report(self) -> str:
+        parts = [f"{key} {self.used(key)}/{limit or '∞'}" for key, limit in self.limits.items()]
+        return f"Presupuesto de hoy: {', '.join(parts)}"
@@ -0,0 +1,98 @@
+# app/services/sheet_archive.py
+"""Archivo histórico de la hoja principal: pestañas por año + índice local.
+
+`SheetsTable.rollover` mueve bloques de RADICADO completos a pestañas
+`<hoja>_<año>`; el índice local recuerda dónde quedó cada radicado para
+poder encontrarlo sin volver a leer las pestañas de archivo.
+"""
+import json
+import os
+import re
+import threading
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+_DATE_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%Y/%m/%d", "%d/%m/%y")
+
+
+def parse_date(value: Any) -> Optional[date]:
+    """Fecha de una celda ('dd/mm/aaaa', 'aaaa-mm-dd' o marca ISO); None si no se reconoce."""
+    s = str(value or "").strip()
+    if not s:
+        return None
+    m = re.match(r"^(\d{4}-\d{2}-\d{2})[T ]", s)
+    if m:
+        s = m.group(1)
+    for fmt in _DATE_FORMATS:
+        try:
+            return datetime.strptime(s, fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def archive_tab(sheet_name: str, year: Optional[int]) -> str:
+    return f"{sheet_name}_{year}" if year else f"{sheet_name}_sin_fecha"
+
+
+def archive_policy(
+    sheet_name: str,
+    date_col: str,
+    before: Optional[date] = None,
+    closed: Iterable[str] = (),
+) -> Callable[[str, List[Dict[str, Any]]], Optional[str]]:
+    """
+    Decide a qué pestaña va un bloque (o None si se queda en la hoja):
+    se archiva si el radicado está cerrado o si TODAS sus filas tienen fecha
+    anterior a `before`. El año de la pestaña es el de la fecha más reciente.
+    """
+    closed_set = {str(c).strip() for c in closed if str(c).strip()}
+
+    def tab_for(radicado: str, rows: List[Dict[str, Any]]) -> Optional[str]:
+        dates = [parse_date(r.get(date_col)) for r in rows]
+        known = [d for d in dates if d is not None]
+        year = max(known).year if known else None
+        if radicado in closed_set:
+            return archive_tab(sheet_name, year)
+        if before is not None and known and len(known) == len(dates) and max(known) < before:
+            return archive_tab(sheet_name, year)
+        return None
+
+    return tab_for
+
+
+class ArchiveIndex:
+    """Índice local radicado → pestaña de archivo (JSON)."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Dict[str, Dict[str, Any]] = {}
+        if os.path.isfile(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def lookup(self, radicado: str) -> Optional[str]:
+        entry = self._data.get(str(radicado).strip())
+        return entry["sheet"] if entry else None
+
+    def add(self, radicado: str, sheet: str, rows: int) -> None:
+        with self._lock:
+            self._data[str(radicado).strip()] = {
+                "sheet": sheet,
+                "rows": rows,
+                "archived_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+            }
+
+    def save(self) -> None:
+        with self._lock:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.path)
@@ -1,19 +1,61 @@
 # app/services/sheets_table.py
-from typing import Dict, Any, List, Optional
+from contextlib import contextmanager
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
 from datetime import datetime
+import hashlib
 import time
 import random
 from googleapiclient.errors import HttpError
 
-class SheetsTable:
-    def __init__(self, sheets_service, spreadsheet_id: str, sheet_name: str):
+from app.services.audit_log import AuditLog, SheetAuditLog
+from app.services.sheet_archive import ArchiveIndex
+from app.services.snapshot_store import SnapshotStore
+from app.services.table_backend import MasterTable
+
+class SheetsTable(MasterTable):
+    def __init__(
+        self,
+        sheets_service,
+        spreadsheet_id: str,
+        sheet_name: str,
+        audit_log: Optional[AuditLog] = None,
+        archive_index: Optional[ArchiveIndex] = None,
+        drive_service=None,
+        snapshot_store: Optional[SnapshotStore] = None,
+    ):
+        super().__init__(audit_log=audit_log, archive_index=archive_index)
         self.service = sheets_service
         self.spreadsheet_id = spreadsheet_id
         self.sheet_name = sheet_name
-        self.headers: List[str] = []
+        # Snapshot persistido entre corridas; Drive da la versión del archivo para validarlo
+        self.drive_service = drive_service
+        self.snapshot_store = snapshot_store
+        self._persisted: Optional[Dict[str, Any]] = None
+        self._persisted_at = 0.0
         # Cache simple para evitar lecturas repetidas del mismo rango
         self._cache: Dict[str, Any] = {}
-        self._load_headers()
+        # Modo snapshot (ver `snapshot()`): toda la hoja en memoria y escrituras diferidas
+        self._snap: Optional[List[List[str]]] = None
+        self._snap_end = 1
+        self._snap_dirty: set = set()
+        self._snap_index: Dict[str, Dict[str, List[int]]] = {}
+        # Por fila pendiente: cómo la vio quien escribe (huella) y cómo estaba en el snapshot
+        self._snap_seen: Dict[int, List[Any]] = {}
+        self._snap_orig: Dict[int, List[Any]] = {}
+        self._snap_version: Optional[str] = None
+        # Peticiones de escritura propias desde `_snap_version` (ver `_is_own_version`)
+        self._own_writes = 0
+        self.write_requests = 0
+        # Filas combinadas o reubicadas porque otro las editó entre la lectura y la escritura
+        self.conflicts = 0
+        if isinstance(audit_log, SheetAuditLog) and audit_log.spreadsheet_id == spreadsheet_id:
+            # La traza va a otra pestaña del mismo archivo: sus escrituras también mueven la versión
+            audit_log.on_write = self.note_own_write
+        self._persisted = self._load_persisted()
+        if self._persisted is not None:
+            self.headers = list(self._persisted["headers"])
+        else:
+            self._load_headers()
 
     @staticmethod
     def _num_to_col(n: int) -> str:
@@ -33,8 +75,9 @@ class SheetsTable:
         delay = initial_delay
         for attempt in range(retries):
             try:
-                # Pausa para no saturar el límite de 60 req/min
-                time.sleep(throttle + random.uniform(0, throttle))
+                # Pausa para no saturar el límite de 60 req/min, salvo que el servicio ya lleve su ritmo
+                if not getattr(self.service, "paced", False):
+                    time.sleep(throttle + random.uniform(0, throttle))
                 return request.execute()
             except HttpError as e:
                 if e.resp.status == 429 and attempt < retries - 1:
@@ -62,30 +105,11 @@ class SheetsTable:
         row = resp.get("values", [[]])
         self.headers = [h.strip() for h in row[0]] if row and row[0] else []
 
-    def ensure_columns(self, cols: List[str]):
-        missing = [c for c in cols if c not in self.headers]
-        if missing:
-            raise ValueError(
-                f"Faltan columnas en '{self.sheet_name}': {missing}. Encabezados: {self.headers}"
-            )
-
-    # ------- Búsquedas y utilidades de bloque por RADICADO -------
-    def has_value_in_column(self, key_col: str, key_value: str, target_col: str) -> bool:
-        """Verifica si alguna fila del bloque identificado por `key_col`/`key_value`
-        tiene contenido no vacío en `target_col`."""
-        if target_col not in self.headers:
-            return False
-        rows = self._find_rows_by_key(key_col, key_value)
-        rows_data = self._get_rows_as_dicts(rows)
-        for row_num in rows:
-            row = rows_data.get(row_num, {})
-            if str(row.get(target_col, "")).strip() != "":
-                return True
-        return False
-
     def _find_rows_by_key(self, key_col: str, key_value: str, start_row: int = 2) -> List[int]:
         if key_col not in self.headers:
             raise ValueError(f"Columna clave '{key_col}' no existe")
+        if self._snap is not None:
+            return [r for r in self._snap_key_index(key_col).get(str(key_value), []) if r >= start_row]
         col_idx = self.headers.index(key_col) + 1
         col_letter = self._num_to_col(col_idx)
         rng = f"{self.sheet_name}!{col_letter}{start_row}:{col_letter}"
@@ -100,6 +124,8 @@ class SheetsTable:
 
 
     def _get_row_as_dict(self, row_num: int) -> Dict[str, Any]:
+        if self._snap is not None:
+            return self._snap_row(row_num)
         last_col = self._num_to_col(len(self.headers))
         rng = f"{self.sheet_name}!A{row_num}:{last_col}{row_num}"
         resp = self._get_range(rng)
@@ -108,10 +134,28 @@ class SheetsTable:
         vals += [""] * (len(self.headers) - len(vals))
         return {h: vals[i] for i, h in enumerate(self.headers)}
 
-    def _get_rows_as_dicts(self, row_nums: List[int]) -> Dict[int, Dict[str, Any]]:
-        """Obtiene varias filas en una sola llamada usando batchGet."""
+    def _col_runs(self, cols: List[str]) -> List[Tuple[int, int]]:
+        """Índices (0-based) de `cols` agrupados en tramos de columnas contiguas."""
+        runs: List[List[int]] = []
+        for i in sorted({self.headers.index(c) for c in cols if c in self.headers}):
+            if runs and i == runs[-1][1] + 1:
+                runs[-1][1] = i
+            else:
+                runs.append([i, i])
+        return [(a, b) for a, b in runs]
+
+    def _get_rows_as_dicts(self, row_nums: List[int], cols: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        """
+        Obtiene varias filas en una sola llamada usando batchGet. Con `cols`
+        solo se leen esas columnas (un rango por tramo contiguo y por fila) y
+        cada dict trae solo esas claves.
+        """
         if not row_nums:
             return {}
+        if self._snap is not None:
+            return {r: self._snap_row(r) for r in row_nums}
+        if cols is not None:
+            return self._get_projected_rows(row_nums, cols)
         last_col = self._num_to_col(len(self.headers))
         ranges = [f"{self.sheet_name}!A{r}:{last_col}{r}" for r in row_nums]
         resp = self._execute_with_backoff(
@@ -131,98 +175,38 @@ class SheetsTable:
                 self._cache[rng] = {"values": [vals]}
         return rows_dict
 
-    def _is_row_empty(self, row_num: int) -> bool:
-        row = self._get_row_as_dict(row_num)
-        return all(str((row.get(h) or "")).strip() == "" for h in self.headers)
-
-    def _find_row_by_compound_key(
-        self,
-        primary_col: str,
-        primary_value: str,
-        extra_keys: Dict[str, str],
-        start_row: int = 2
-    ) -> Optional[int]:
-        """
-        Coincidencia exacta: RADICADO + (SERIE si informativa) + (ITEM si existe) + (ARCHIVO si existe).
-        """
-        candidates = self._find_rows_by_key(primary_col, primary_value, start_row)
-        if not candidates:
-            return None
-        rows_data = self._get_rows_as_dicts(candidates)
-        if not extra_keys:
-            return candidates[0]
-        for row_num in candidates:
-            row = rows_data.get(row_num, {})
-            ok = True
-            for col, val in extra_keys.items():
-                if col not in self.headers:
-                    continue
-                if str(row.get(col, "")).strip() != str(val).strip():
-                    ok = False
-                    break
-            if ok:
-                return row_num
-        return None
-
-    def _find_incomplete_row_in_block(
-        self,
-        rad_col: str,
-        rad_value: str,
-        to_apply: Dict[str, Any],
-        start_row: int = 2
-    ) -> Optional[int]:
-        """
-        Reutiliza una fila 'incompleta' del mismo RADICADO si existe.
-        Criterios:
-          1) SERIE o SERIE TUBO RX vacías/'NO REGISTRA', o
-          2) ≥3 columnas destino vacías entre las que vamos a llenar.
-        """
-        candidates = self._find_rows_by_key(rad_col, rad_value, start_row)
-        if not candidates:
-            return None
-        rows_data = self._get_rows_as_dicts(candidates)
-
-        prefer_missing_cols = {"SERIE", "SERIE TUBO RX"}
-
-        def is_empty(v: Any) -> bool:
-            s = str(v or "").strip()
-            return s == "" or s.upper() in {"NO REGISTRA", "NO REGISTRADA", "NO APLICA"}
-
-        # Prioriza filas con series vacías
-        for row_num in candidates:
-            row = rows_data.get(row_num, {})
-            if any((c in self.headers) and is_empty(row.get(c, "")) for c in prefer_missing_cols):
-                return row_num
-
-        # Si no, usa heurística de vacíos general
-        for row_num in candidates:
-            row = rows_data.get(row_num, {})
-            empties = 0
-            total = 0
-            for col in to_apply.keys():
-                if col not in self.headers:
-                    continue
-                total += 1
-                if is_empty(row.get(col, "")):
-                    empties += 1
-            if total >= 4 and empties >= 3:
-                return row_num
-
-        return None
-
-    def _first_free_row_after_block(self, rad_col: str, rad_value: str, start_row: int = 2) -> Optional[int]:
-        """
-        Retorna la primera fila completamente vacía justo debajo del bloque del RADICADO (si existe).
-        """
-        candidates = self._find_rows_by_key(rad_col, rad_value, start_row)
-        if not candidates:
-            return None
-        probe = max(candidates) + 1
-        return probe if self._is_row_empty(probe) else None
+    def _get_projected_rows(self, row_nums: List[int], cols: List[str]) -> Dict[int, Dict[str, Any]]:
+        runs = self._col_runs(cols)
+        if not runs:
+            return {r: {} for r in row_nums}
+        ranges = [
+            f"{self.sheet_name}!{self._num_to_col(a + 1)}{r}:{self._num_to_col(b + 1)}{r}"
+            for r in row_nums
+            for a, b in runs
+        ]
+        resp = self._execute_with_backoff(
+            self.service.spreadsheets().values().batchGet(
+                spreadsheetId=self.spreadsheet_id, ranges=ranges
+            )
+        )
+        value_ranges = iter(resp.get("valueRanges", []))
+        rows_dict: Dict[int, Dict[str, Any]] = {}
+        for r in row_nums:
+            row: Dict[str, Any] = {}
+            for a, b in runs:
+                arr = next(value_ranges, {}).get("values", [[]])
+                vals = arr[0] if arr and arr[0] else []
+                for k in range(a, b + 1):
+                    row[self.headers[k]] = vals[k - a] if k - a < len(vals) else ""
+            rows_dict[r] = row
+        return rows_dict
 
     # ------- Escritura -------
 
     def _update_row_from_dict(self, row_num: int, row_dict: Dict[str, Any]):
+        if self._snap is not None:
+            self.stage(row_num, row_dict)
+            return
         last_col = self._num_to_col(len(self.headers))
         rng = f"{self.sheet_name}!A{row_num}:{last_col}{row_num}"
         values = [[row_dict.get(h, "") for h in self.headers]]
@@ -234,10 +218,15 @@ class SheetsTable:
                 body={"values": values},
             )
         )
+        self.write_requests += 1
         # Invalidar cache para reflejar los nuevos datos
         self._cache.clear()
+        self._persisted = None
 
     def _append_row_from_dict(self, row_dict: Dict[str, Any]):
+        if self._snap is not None:
+            self.stage(len(self._snap) + 2, row_dict)
+            return
         rng = f"{self.sheet_name}!A1:{self._num_to_col(len(self.headers))}1"
         values = [[row_dict.get(h, "") for h in self.headers]]
         self._execute_with_backoff(
@@ -249,199 +238,534 @@ class SheetsTable:
                 body={"values": values},
             )
         )
+        self.write_requests += 1
         # Invalidar cache después de insertar nuevas filas
         self._cache.clear()
+        self._persisted = None
+
+    # ------- Modo snapshot (lectura única + escrituras en lote) -------
 
-    # ------- API principal -------
-
-    def fill_from_json_only_empty(self,
-                                  json_data: Dict[str, Any],
-                                  *,
-                                  col_radicado: str,
-                                  col_obs: str,
-                                  col_archivo: Optional[str] = None,
-                                  col_updated: Optional[str] = None,
-                                  filename: Optional[str] = None,
-                                  field_map: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    @contextmanager
+    def snapshot(self) -> Iterator["SheetsTable"]:
         """
-        Rellena SOLO celdas vacías. Evita duplicados y coloca equipos en el bloque correcto:
-        1) Coincidencia exacta por clave compuesta: RADICADO + (SERIE) + (ITEM) + (ARCHIVO) + respaldo (TIPO DE EQUIPO/MARCA/MODELO).
-        2) Reutiliza una fila INCOMPLETA dentro del bloque del RADICADO.
-        3) Usa la PRIMERA fila VACÍA disponible entre las vacías consecutivas bajo el bloque del RADICADO.
-        4) Si nada de lo anterior, APPEND al final.
+        Lee la hoja completa una vez y atiende desde memoria todas las
+        búsquedas de `fill_from_json_only_empty`; las escrituras se acumulan y
+        se envían en pocas peticiones con `flush` (al salir o cuando se llame,
+        p. ej. tras cada documento). No ve cambios hechos por otros mientras
+        dura, pero tampoco los pisa: ver `flush`.
+
+        Con `snapshot_store`, la lectura inicial se reemplaza por la copia
+        guardada al cerrar el snapshot anterior si la versión del archivo en
+        Drive no cambió desde entonces.
+        """
+        if self._snap is not None:
+            raise RuntimeError("Ya hay un snapshot abierto para esta hoja.")
+        persisted = self._valid_persisted()
+        if persisted is not None:
+            self._adopt_version(persisted.get("version"))
+            self._snap = [self._pad(r) for r in persisted["values"]]
+        else:
+            # Versión tomada antes de leer: una edición ajena en medio se detecta en `flush`
+            self._adopt_version(self._file_version())
+            self._snap = self.read_all()
+        self._snap_end = len(self._snap) + 1
+        self._snap_dirty = set()
+        self._snap_index = {}
+        self._snap_seen = {}
+        self._snap_orig = {}
+        writes_before = self.write_requests
+        saved = False
+        try:
+            yield self
+            self.flush()
+            self._flush_audit()
+            # Sin escrituras (ni de la traza), la copia reutilizada sigue vigente tal cual
+            current = True
+            if persisted is None or self.write_requests != writes_before or self._own_writes:
+                current = self._save_persisted()
+            if self.snapshot_store is not None and current:
+                # Un snapshot posterior en este mismo proceso parte de esta copia (dentro del TTL)
+                self._persisted = {"version": self._snap_version, "headers": list(self.headers), "values": self._snap}
+                self._persisted_at = time.monotonic()
+            saved = True
+        finally:
+            try:
+                if not saved:
+                    self.flush()
+            finally:
+                self._snap = None
+                self._snap_index = {}
+                self._snap_seen = {}
+                self._snap_orig = {}
+                self._cache.clear()
+
+    # ------- Snapshot persistido entre corridas -------
+
+    # Segundos durante los que la validación hecha al construir la tabla (vigente o no) sigue valiendo
+    PERSISTED_TTL = 60.0
+
+    def _file_version(self) -> Optional[str]:
+        """Versión del spreadsheet en Drive (cambia con cualquier edición); una consulta de metadatos."""
+        if self.drive_service is None:
+            return None
+        meta = self._execute_with_backoff(
+            self.drive_service.files().get(
+                fileId=self.spreadsheet_id, fields="version,modifiedTime", supportsAllDrives=True
+            ),
+            throttle=0.0,
+        )
+        return f"{meta.get('version')}@{meta.get('modifiedTime')}"
+
+    def _adopt_version(self, version: Optional[str]) -> None:
+        """`version` es la del snapshot en memoria (sin escrituras propias posteriores)."""
+        self._snap_version = version
+        self._own_writes = 0
+
+    def _is_own_version(self, version: Optional[str]) -> bool:
         """
+        La hoja sigue como el snapshot más nuestras escrituras: la versión de
+        Drive avanzó exactamente una vez por petición propia desde
+        `_snap_version`. Si avanzó distinto no se puede atribuir (alguien más
+        pudo editar en medio) y se trata como edición ajena.
+        """
+        if version is None or self._snap_version is None:
+            return False
+        if not self._own_writes:
+            return version == self._snap_version
+        try:
+            before = int(self._snap_version.split("@", 1)[0])
+            now = int(version.split("@", 1)[0])
+        except ValueError:
+            return False
+        return now - before == self._own_writes
+
+    def note_own_write(self) -> None:
+        """Otra escritura propia en el spreadsheet (p. ej. la traza en su pestaña): no es una edición ajena."""
+        self._own_writes += 1
+
+    def _load_persisted(self) -> Optional[Dict[str, Any]]:
+        if self.snapshot_store is None or self.drive_service is None:
+            return None
+        data = self.snapshot_store.load(self.spreadsheet_id, self.sheet_name)
+        if data is None:
+            return None
+        version = self._file_version()
+        self._persisted_at = time.monotonic()
+        return data if data.get("version") == version else None
+
+    def _valid_persisted(self) -> Optional[Dict[str, Any]]:
+        """Snapshot guardado y vigente; se usa una sola vez (luego manda la hoja en memoria)."""
+        data, self._persisted = self._persisted, None
+        if not self._persisted_at or time.monotonic() - self._persisted_at > self.PERSISTED_TTL:
+            data = self._load_persisted()
+        if data is not None and data.get("headers") != self.headers:
+            return None
+        return data
+
+    def _flush_audit(self) -> None:
+        """Envía la traza antes de fijar la versión a guardar (con `AUDIT_LOG=sheet` también la mueve)."""
+        if self.audit_log is None:
+            return
+        try:
+            self.audit_log.flush()
+        except Exception as e:
+            print(f"[WARN] No se pudo enviar la traza antes de guardar el snapshot de '{self.sheet_name}': {e}")
+
+    def _save_persisted(self) -> bool:
+        """
+        Guarda la hoja en memoria con la versión actual del archivo. Con
+        escrituras propias desde `_snap_version` se consulta esa versión: si
+        no se explica solo por ellas, no se guarda (la próxima corrida lee la
+        hoja). Devuelve False solo en ese caso: la copia en memoria ya no
+        corresponde a la hoja.
+        """
+        if self.snapshot_store is None or self._snap_version is None or self._snap is None:
+            return True
+        if self._own_writes:
+            version = self._file_version()
+            if not self._is_own_version(version):
+                return False
+            self._adopt_version(version)
+        try:
+            self.snapshot_store.save(
+                self.spreadsheet_id, self.sheet_name, self._snap_version, self.headers, self._snap
+            )
+        except Exception as e:
+            print(f"[WARN] No se pudo guardar el snapshot de '{self.sheet_name}': {e}")
+        return True
+
+    def read_all(self) -> List[List[Any]]:
+        """Todas las filas de datos (desde la fila 2) en una sola lectura, completadas a lo ancho de los encabezados."""
+        last_col = self._num_to_col(len(self.headers))
+        resp = self._execute_with_backoff(
+            self.service.spreadsheets().values().get(
+                spreadsheetId=self.spreadsheet_id, range=f"{self.sheet_name}!A2:{last_col}"
+            )
+        )
+        return [self._pad(r) for r in resp.get("values", [])]
+
+    def _pad(self, vals: List[Any]) -> List[Any]:
+        vals = list(vals[:len(self.headers)])
+        return vals + [""] * (len(self.headers) - len(vals))
+
+    def _snap_row(self, row_num: int) -> Dict[str, Any]:
+        i = row_num - 2
+        vals = self._snap[i] if 0 <= i < len(self._snap) else [""] * len(self.headers)
+        return {h: vals[j] for j, h in enumerate(self.headers)}
+
+    def _snap_key_index(self, key_col: str) -> Dict[str, List[int]]:
+        index = self._snap_index.get(key_col)
+        if index is None:
+            j = self.headers.index(key_col)
+            index = {}
+            for i, vals in enumerate(self._snap):
+                index.setdefault(str(vals[j]), []).append(i + 2)
+            self._snap_index[key_col] = index
+        return index
+
+    def _key_index(self, key_col: str) -> Dict[str, List[int]]:
+        if self._snap is None:
+            raise RuntimeError("La auditoría de Sheets debe llamarse dentro de snapshot().")
+        return self._snap_key_index(key_col)
+
+    def stage(self, row_num: int, row_dict: Dict[str, Any], seen: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Escritura diferida dentro de `snapshot()`; las columnas ausentes de
+        `row_dict` conservan su valor. `seen` es la fila tal como la vio quien
+        escribe (por defecto, la del snapshot; columnas ausentes, también):
+        es la huella contra la que `flush` compara la hoja antes de escribir.
+        """
+        if self._snap is None:
+            raise RuntimeError("stage() debe llamarse dentro de snapshot().")
+        if row_num <= self._snap_end and row_num not in self._snap_seen:
+            orig = self._snap_row(row_num)
+            base = {**orig, **seen} if seen is not None else orig
+            self._snap_orig[row_num] = [orig[h] for h in self.headers]
+            self._snap_seen[row_num] = [base[h] for h in self.headers]
+        self._snap_write(row_num, row_dict)
+
+    @staticmethod
+    def _fingerprint(vals: List[Any]) -> str:
+        norm = "\x1f".join(str("" if v is None else v).strip() for v in vals)
+        return hashlib.sha1(norm.encode("utf-8")).hexdigest()
+
+    def _snap_write(self, row_num: int, row_dict: Dict[str, Any]) -> None:
+        i = row_num - 2
+        while len(self._snap) <= i:
+            self._snap.append([""] * len(self.headers))
+        old = self._snap[i]
+        new = [row_dict[h] if h in row_dict else old[j] for j, h in enumerate(self.headers)]
+        for key_col, index in self._snap_index.items():
+            j = self.headers.index(key_col)
+            if str(old[j]) != str(new[j]):
+                stale = index.get(str(old[j]), [])
+                if row_num in stale:
+                    stale.remove(row_num)
+                rows = index.setdefault(str(new[j]), [])
+                rows.append(row_num)
+                rows.sort()
+        self._snap[i] = new
+        self._snap_dirty.add(row_num)
+
+    def flush(self, batch_rows: int = 500) -> int:
+        """
+        Envía las escrituras pendientes del snapshot: las filas existentes con
+        `values.batchUpdate` y las nuevas (debajo del final de la hoja) con un
+        `values.append`, en grupos de `batch_rows`. Devuelve las filas escritas.
+
+        Control optimista sin releer fila por fila: si la versión del archivo
+        en Drive solo avanzó por nuestras escrituras desde la lectura (ver
+        `_is_own_version`), la huella de cada fila ya coincide con la hoja. Si
+        no (o no se puede consultar), las filas a escribir se releen en un
+        solo `batchGet` y las que no coinciden con su huella se combinan celda
+        a celda (ver `_merge_row`). Después de un cambio ajeno, la copia en
+        memoria se vuelve a leer. De cada fila existente se escriben solo las
+        celdas que cambiaron.
+        """
+        if self._snap is None or not self._snap_dirty:
+            return 0
+        last_col = self._num_to_col(len(self.headers))
+        version = self._file_version()
+        external = not self._is_own_version(version)
+        staged = [r for r in sorted(self._snap_dirty) if r in self._snap_seen]
+        if external:
+            sheet_rows = self._fetch_rows(staged, batch_rows)
+            self._reconcile(staged, sheet_rows)
+        else:
+            self._adopt_version(version)
+            # La hoja sigue como en el snapshot: solo las filas vistas en otra versión (p. ej. la copia SQLite)
+            sheet_rows = self._snap_orig
+            suspects = [r for r in staged if self._fingerprint(self._snap_seen[r]) != self._fingerprint(self._snap_orig[r])]
+            self._reconcile(suspects, {r: self._snap_orig[r] for r in suspects})
+        dirty = sorted(self._snap_dirty)
+        updates = [r for r in dirty if r <= self._snap_end]
+        for k in range(0, len(updates), batch_rows):
+            data = [d for r in updates[k:k + batch_rows] for d in self._changed_ranges(r, sheet_rows.get(r))]
+            if not data:
+                continue
+            self._execute_with_backoff(
+                self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={"valueInputOption": "USER_ENTERED", "data": data},
+                )
+            )
+            self.write_requests += 1
+            self._own_writes += 1
+        # Filas nuevas: contiguas a partir del final original de la hoja
+        appended = self._snap[self._snap_end - 1:]
+        for k in range(0, len(appended), batch_rows):
+            self._execute_with_backoff(
+                self.service.spreadsheets().values().append(
+                    spreadsheetId=self.spreadsheet_id,
+                    range=f"{self.sheet_name}!A1:{last_col}1",
+                    valueInputOption="USER_ENTERED",
+                    insertDataOption="INSERT_ROWS",
+                    body={"values": appended[k:k + batch_rows]},
+                )
+            )
+            self.write_requests += 1
+            self._own_writes += 1
+        self._snap_end = len(self._snap) + 1
+        self._snap_dirty = set()
+        self._snap_seen = {}
+        self._snap_orig = {}
+        self._cache.clear()
+        if external and self.drive_service is not None:
+            # Otros editaron la hoja: la copia en memoria se reemplaza por la actual
+            self._adopt_version(self._file_version())
+            self._snap = self.read_all()
+            self._snap_end = len(self._snap) + 1
+            self._snap_index = {}
+        # Si no, `_snap_version` + las escrituras contadas: el próximo flush relee solo si no cuadran
+        return len(dirty)
+
+    def _changed_ranges(self, row_num: int, sheet_row: Optional[List[Any]]) -> List[Dict[str, Any]]:
+        """
+        Rangos de `values.batchUpdate` con solo las celdas de la fila que
+        difieren de la hoja (`sheet_row`): una celda que no tocamos nunca se
+        reescribe con un valor de la copia en memoria.
+        """
+        vals = self._snap[row_num - 2]
+        if sheet_row is None:
+            last_col = self._num_to_col(len(self.headers))
+            return [{"range": f"{self.sheet_name}!A{row_num}:{last_col}{row_num}", "values": [vals]}]
+
+        def _n(v: Any) -> str:
+            return str("" if v is None else v).strip()
+
+        changed = [h for h, mine, theirs in zip(self.headers, vals, sheet_row) if _n(mine) != _n(theirs)]
+        return [
+            {
+                "range": f"{self.sheet_name}!{self._num_to_col(a + 1)}{row_num}:{self._num_to_col(b + 1)}{row_num}",
+                "values": [vals[a:b + 1]],
+            }
+            for a, b in self._col_runs(changed)
+        ]
+
+    def refresh(self) -> None:
+        """
+        Envía lo pendiente y, si el archivo cambió desde la última lectura o
+        escritura propia, vuelve a leer la hoja en memoria (una consulta de
+        metadatos si no cambió). Fuera de un snapshot solo limpia el cache.
+        """
+        self._cache.clear()
+        if self._snap is None:
+            return
+        self.flush()
+        version = self._file_version()
+        if self._is_own_version(version):
+            return
+        self._adopt_version(version)
+        self._snap = self.read_all()
+        self._snap_end = len(self._snap) + 1
+        self._snap_index = {}
+
+    def _fetch_rows(self, row_nums: List[int], batch_rows: int = 500) -> Dict[int, List[Any]]:
+        """Filas completas actuales de la hoja (sin pasar por el snapshot), en lotes de `batchGet`."""
+        last_col = self._num_to_col(len(self.headers))
+        rows: Dict[int, List[Any]] = {}
+        for k in range(0, len(row_nums), batch_rows):
+            part = row_nums[k:k + batch_rows]
+            resp = self._execute_with_backoff(
+                self.service.spreadsheets().values().batchGet(
+                    spreadsheetId=self.spreadsheet_id,
+                    ranges=[f"{self.sheet_name}!A{r}:{last_col}{r}" for r in part],
+                )
+            )
+            for r, v in zip(part, resp.get("valueRanges", [])):
+                arr = v.get("values", [[]])
+                rows[r] = self._pad(arr[0] if arr and arr[0] else [])
+        return rows
+
+    def _reconcile(self, row_nums: List[int], current: Dict[int, List[Any]]) -> None:
+        """Combina con la hoja actual (`current`) las filas pendientes cuya huella ya no coincide."""
+        if not row_nums:
+            return
+        blank = self._fingerprint([""] * len(self.headers))
         now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
-        field_map = field_map or {}
-
-        # 1) Radicado
-        rad = str(json_data.get("RADICADO") or json_data.get("radicado") or "").strip()
-        if not rad:
-            raise ValueError("JSON sin 'RADICADO'/'radicado' para ubicar la fila.")
-
-        # 2) Mapeo JSON → encabezados
-        to_apply: Dict[str, Any] = {}
-        for k, v in json_data.items():
-            col = field_map.get(k, k)
-            to_apply[col] = v
-
-        # 3) Llave compuesta (acumulativa)
-        def _norm(s: Any) -> str:
-            return str(s or "").strip()
-
-        extra_keys: Dict[str, str] = {}
-        serie_val = _norm(to_apply.get("SERIE"))
-        serie_info = bool(serie_val) and serie_val.upper() not in {"NO REGISTRA", "NO REGISTRADA", "NO APLICA"}
-        if "SERIE" in self.headers and serie_info:
-            extra_keys["SERIE"] = serie_val
-        if "ITEM" in self.headers and _norm(to_apply.get("ITEM")):
-            extra_keys["ITEM"] = _norm(to_apply["ITEM"])
-        if (col_archivo in self.headers if col_archivo else False) and filename:
-            extra_keys[col_archivo] = filename
-        # Respaldo cuando no hay serie/ítem: ayuda a no duplicar equipos típicos
-        for bcol in ("TIPO DE EQUIPO", "MARCA", "MODELO"):
-            if bcol in self.headers and _norm(to_apply.get(bcol)):
-                extra_keys.setdefault(bcol, _norm(to_apply[bcol]))
-
-        # 4) Coincidencia exacta dentro del bloque
-        row_num = self._find_row_by_compound_key(col_radicado, rad, extra_keys)
-
-        # 5) Si no hay, intenta reutilizar una fila INCOMPLETA del bloque
-        if row_num is None:
-            candidates = self._find_rows_by_key(col_radicado, rad, start_row=2)
-
-            def is_empty_value(x: Any) -> bool:
-                s = _norm(x)
-                return s == "" or s.upper() in {"NO REGISTRA", "NO REGISTRADA", "NO APLICA"}
-
-            rows_data = self._get_rows_as_dicts(candidates)
-            reuse_candidate: Optional[int] = None
-            for r in candidates:
-                row = rows_data.get(r, {})
-                # Preferencia: serie(s) vacías
-                if ("SERIE" in self.headers and is_empty_value(row.get("SERIE"))) or \
-                   ("SERIE TUBO RX" in self.headers and is_empty_value(row.get("SERIE TUBO RX"))):
-                    reuse_candidate = r
-                    break
-            if reuse_candidate is None:
-                # Heurística: si ≥3 de los campos destino están vacíos, reutiliza
-                for r in candidates:
-                    row = rows_data.get(r, {})
-                    empties = 0
-                    total = 0
-                    for col in to_apply.keys():
-                        if col not in self.headers:
-                            continue
-                        total += 1
-                        if is_empty_value(row.get(col, "")):
-                            empties += 1
-                    if total >= 4 and empties >= 3:
-                        reuse_candidate = r
-                        break
-            if reuse_candidate is not None:
-                row_num = reuse_candidate
-
-        # 6) Si no hay fila aún, usa una de las VACÍAS consecutivas debajo del bloque del RADICADO
-        using_free_row = False
-        if row_num is None:
-            candidates = self._find_rows_by_key(col_radicado, rad, start_row=2)
-            if candidates:
-                probe = max(candidates) + 1
-                # Avanza por todas las filas vacías consecutivas disponibles
-                while True:
-                    row = self._get_rows_as_dicts([probe]).get(probe, {})
-                    is_row_empty = all(_norm(row.get(h, "")) == "" for h in self.headers)
-                    if is_row_empty:
-                        row_num = probe
-                        using_free_row = True
-                        break
-                    else:
-                        # Si encontramos otro RADICADO u otra data, no hay huecos; salimos
-                        break
-
-        # 7) Si todavía no hay fila, APPEND al final
-        creating_new_row = row_num is None
-
-        # 8) Escribir
-        if creating_new_row or using_free_row:
-            base = {h: "" for h in self.headers}
-            # RADICADO, ARCHIVO, timestamp
-            if col_radicado in base:
-                base[col_radicado] = rad
-            if filename and (col_archivo in self.headers if col_archivo else False):
-                base[col_archivo] = filename
-            if col_updated in self.headers if col_updated else False:
-                base[col_updated] = now
-            # Asentar claves de la llave
-            for k_col, k_val in extra_keys.items():
-                if k_col in base and _norm(k_val) != "":
-                    base[k_col] = k_val
-            # Volcar campos del JSON
-            filled, missing = [], []
-            for col, val in to_apply.items():
-                if col in base and _norm(val) != "":
-                    base[col] = val
-                    filled.append(col)
-                elif col not in self.headers:
-                    missing.append(col)
-            # Observaciones
-            if col_obs in self.headers:
-                obs = f"{now.replace('T',' ')}: Fila nueva. Llenadas: {', '.join(filled) or 'ninguna'}."
-                if missing:
-                    obs += f" Sin columna: {', '.join(missing)}."
-                base[col_obs] = obs
-
-            if using_free_row:
-                self._update_row_from_dict(row_num, base)
-                return {"action": "insert_at_free", "radicado": rad, "row": row_num, "filled": filled, "missing": missing}
+        for r in row_nums:
+            seen, theirs = self._snap_seen[r], current[r]
+            if self._fingerprint(seen) == self._fingerprint(theirs):
+                continue
+            mine = self._snap[r - 2]
+            if self._fingerprint(seen) == blank:
+                # La fila libre que íbamos a usar ya la ocupó otro: la nuestra va al final
+                self._snap[r - 2] = theirs
+                self._snap_dirty.discard(r)
+                self._snap.append(mine)
+                self._snap_dirty.add(len(self._snap) + 1)
+                self.conflicts += 1
+                self._record_trail(now, {"action": "relocated", "row": r}, None)
+                continue
+            merged, kept = self._merge_row(seen, theirs, mine)
+            self._snap[r - 2] = merged
+            if kept:
+                self.conflicts += 1
+                self._record_trail(now, {"action": "conflict", "row": r, "skipped": kept}, None)
+        self._snap_index = {}
+
+    def _merge_row(self, seen: List[Any], theirs: List[Any], mine: List[Any]) -> Tuple[List[Any], List[str]]:
+        """
+        Combinación a tres vías por celda: donde solo cambiamos nosotros va lo
+        nuestro; donde cambió el otro, lo suyo. Si ambos cambiaron una celda se
+        conserva la del otro (se devuelve en la lista de conservadas): así se
+        mantiene "solo llenar vacíos" frente a ediciones hechas mientras tanto.
+        """
+        def _n(v: Any) -> str:
+            return str("" if v is None else v).strip()
+
+        merged, kept = [], []
+        for h, s, t, m in zip(self.headers, seen, theirs, mine):
+            if _n(m) == _n(s) or _n(t) == _n(m):
+                merged.append(t)
+            elif _n(t) == _n(s):
+                merged.append(m)
             else:
-                self._append_row_from_dict(base)
-                return {"action": "append", "radicado": rad, "filled": filled, "missing": missing}
+                merged.append(t)
+                kept.append(h)
+        return merged, kept
 
-        # -------- Fila existente → llenar solo vacíos --------
-        current = self._get_row_as_dict(row_num)
-        updated = dict(current)
-        filled, skipped, missing = [], [], []
+    # ------- Archivo histórico -------
 
-        for col, val in to_apply.items():
-            if col not in self.headers:
-                missing.append(col)
-                continue
-            curr = _norm(current.get(col, ""))
-            new = _norm(val)
-            if curr == "" and new != "":
-                updated[col] = val
-                filled.append(col)
+    def _sheet_ids(self) -> Dict[str, int]:
+        meta = self._execute_with_backoff(
+            self.service.spreadsheets().get(
+                spreadsheetId=self.spreadsheet_id, fields="sheets.properties(sheetId,title)"
+            )
+        )
+        return {sh["properties"]["title"]: sh["properties"]["sheetId"] for sh in meta.get("sheets", [])}
+
+    def find_archived(self, key_col: str, key_value: str) -> Optional[Dict[str, Any]]:
+        """
+        Bloque archivado de un radicado según el índice local: {"sheet", "rows"}.
+        Camino frío: lee la pestaña de archivo completa solo cuando se pide.
+        """
+        tab = self.archive_index.lookup(key_value) if self.archive_index is not None else None
+        if not tab or key_col not in self.headers:
+            return None
+        last_col = self._num_to_col(len(self.headers))
+        resp = self._get_range(f"{tab}!A2:{last_col}")
+        j = self.headers.index(key_col)
+        rows = [
+            dict(zip(self.headers, self._pad(vals)))
+            for vals in resp.get("values", [])
+            if str(self._pad(vals)[j]).strip() == str(key_value).strip()
+        ]
+        return {"sheet": tab, "rows": rows}
+
+    def rollover(
+        self,
+        key_col: str,
+        tab_for: Callable[[str, List[Dict[str, Any]]], Optional[str]],
+        batch_rows: int = 500,
+    ) -> Dict[str, int]:
+        """
+        Mueve bloques completos (todas las filas de un radicado) a pestañas de
+        archivo: `tab_for(radicado, filas)` devuelve la pestaña destino o None.
+        Una lectura de la hoja, un `values.append` por pestaña (en grupos de
+        `batch_rows`) y un solo `batchUpdate` con los borrados. Las filas se
+        copian e indexan antes de borrarse. Devuelve filas movidas por pestaña.
+        """
+        if self._snap is not None:
+            raise RuntimeError("rollover() no puede ejecutarse dentro de snapshot().")
+        values = self.read_all()
+        last_col = self._num_to_col(len(self.headers))
+        j = self.headers.index(key_col)
+        blocks: Dict[str, List[int]] = {}
+        for i, vals in enumerate(values):
+            key = str(vals[j]).strip()
+            if key:
+                blocks.setdefault(key, []).append(i)
+
+        moves: Dict[str, List[int]] = {}
+        moved_keys: Dict[str, List[str]] = {}
+        for key, idxs in blocks.items():
+            tab = tab_for(key, [dict(zip(self.headers, values[i])) for i in idxs])
+            if tab:
+                moves.setdefault(tab, []).extend(idxs)
+                moved_keys.setdefault(tab, []).append(key)
+        if not moves:
+            return {}
+
+        # 1) Pestañas de archivo (se crean con los mismos encabezados)
+        ids = self._sheet_ids()
+        missing = [t for t in moves if t not in ids]
+        if missing:
+            self._execute_with_backoff(
+                self.service.spreadsheets().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={"requests": [{"addSheet": {"properties": {"title": t}}} for t in missing]},
+                )
+            )
+            self._execute_with_backoff(
+                self.service.spreadsheets().values().batchUpdate(
+                    spreadsheetId=self.spreadsheet_id,
+                    body={
+                        "valueInputOption": "RAW",
+                        "data": [{"range": f"{t}!A1", "values": [self.headers]} for t in missing],
+                    },
+                )
+            )
+            ids = self._sheet_ids()
+
+        # 2) Copiar e indexar
+        for tab, idxs in moves.items():
+            rows = [values[i] for i in sorted(idxs)]
+            for k in range(0, len(rows), batch_rows):
+                self._execute_with_backoff(
+                    self.service.spreadsheets().values().append(
+                        spreadsheetId=self.spreadsheet_id,
+                        range=f"{tab}!A1:{last_col}1",
+                        valueInputOption="USER_ENTERED",
+                        insertDataOption="INSERT_ROWS",
+                        body={"values": rows[k:k + batch_rows]},
+                    )
+                )
+            if self.archive_index is not None:
+                for key in moved_keys[tab]:
+                    self.archive_index.add(key, tab, len(blocks[key]))
+        if self.archive_index is not None:
+            self.archive_index.save()
+
+        # 3) Borrar de la hoja principal, por tramos contiguos y de abajo hacia arriba
+        spans: List[List[int]] = []
+        for i in sorted(i for idxs in moves.values() for i in idxs):
+            if spans and i == spans[-1][1] + 1:
+                spans[-1][1] = i
             else:
-                skipped.append(col)
-
-        # ARCHIVO y timestamp
-        if filename and (col_archivo in self.headers if col_archivo else False):
-            if _norm(current.get(col_archivo, "")) == "":
-                updated[col_archivo] = filename
-                filled.append(col_archivo)
-        if col_updated in self.headers if col_updated else False:
-            updated[col_updated] = now
-
-        # Asentar columnas de la llave si estaban vacías
-        for k_col, k_val in extra_keys.items():
-            if k_col in self.headers and _norm(updated.get(k_col, "")) == "" and _norm(k_val) != "":
-                updated[k_col] = k_val
-                filled.append(k_col)
-
-        if col_obs in self.headers:
-            prev = _norm(current.get(col_obs, ""))
-            lines = []
-            if filled:
-                lines.append(f"Llenadas: {', '.join(sorted(set(filled)))}.")
-            if skipped:
-                lines.append(f"Saltadas: {', '.join(sorted(set(skipped)))}.")
-            if missing:
-                lines.append(f"Sin columna: {', '.join(sorted(set(missing)))}.")
-            if lines:
-                obs_line = f"{now.replace('T',' ')}: " + " ".join(lines)
-                updated[col_obs] = (prev + "\n" + obs_line).strip() if prev else obs_line
-
-        if updated != current:
-            self._update_row_from_dict(row_num, updated)
-            return {"action": "update", "radicado": rad, "row": row_num, "filled": filled, "skipped": skipped, "missing": missing}
-        return {"action": "noop", "radicado": rad, "row": row_num, "filled": [], "skipped": skipped, "missing": missing}
+                spans.append([i, i])
+        sheet_id = ids[self.sheet_name]
+        # Índice 0-based de la fila en la hoja: los datos empiezan en la fila 2
+        requests = [
+            {"deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS", "startIndex": a + 1, "endIndex": b + 2}}}
+            for a, b in reversed(spans)
+        ]
+        self._execute_with_backoff(
+            self.service.spreadsheets().batchUpdate(spreadsheetId=self.spreadsheet_id, body={"requests": requests})
+        )
+        self._cache.clear()
+        # La copia entre corridas tiene las filas movidas: la próxima corrida lee la hoja completa
+        self._persisted = None
+        if self.snapshot_store is not None:
+            self.snapshot_store.clear()
+        return {tab: len(idxs) for tab, idxs in moves.items()}
@@ -0,0 +1,64 @@
+# app/services/snapshot_store.py
+"""Copia local de la última lectura completa de la hoja, entre corridas.
+
+`SheetsTable` la guarda al cerrar un `snapshot()` junto con la versión del
+archivo en Drive y la reutiliza al abrir el siguiente si la versión no
+cambió (una consulta de metadatos en vez de leer la hoja entera).
+"""
+import gzip
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+
+class SnapshotStore:
+    """Un snapshot (encabezados + filas) por archivo JSON comprimido."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def load(self, spreadsheet_id: str, sheet_name: str) -> Optional[Dict[str, Any]]:
+        """Snapshot guardado para esa hoja, o None si no hay (o es de otra hoja/ilegible)."""
+        if not os.path.isfile(self.path):
+            return None
+        try:
+            with gzip.open(self.path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("spreadsheet_id") != spreadsheet_id or data.get("sheet") != sheet_name:
+            return None
+        return data
+
+    def save(
+        self, spreadsheet_id: str, sheet_name: str, version: str, headers: List[str], values: List[List[Any]]
+    ) -> None:
+        with self._lock:
+            folder = os.path.dirname(self.path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            tmp = self.path + ".tmp"
+            with gzip.open(tmp, "wt", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "spreadsheet_id": spreadsheet_id,
+                        "sheet": sheet_name,
+                        "version": version,
+                        "saved_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+                        "headers": headers,
+                        "values": values,
+                    },
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp, self.path)
+
+    def clear(self) -> None:
+        with self._lock:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
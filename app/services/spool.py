@@ -0,0 +1,146 @@
+# app/services/spool.py
+"""Buffers de descarga con memoria acotada.
+
+Cada descarga se acumula en RAM hasta `threshold` bytes y, por encima, se
+pasa a un archivo temporal. Un `MemoryBudget` compartido limita los bytes en
+RAM sumando todas las descargas en curso: si no queda presupuesto, la
+descarga que lo pide se pasa a disco en vez de esperar.
+"""
+import io
+import os
+import tempfile
+import threading
+from typing import BinaryIO, Optional
+
+
+class MemoryBudget:
+    """Presupuesto global de bytes en RAM para las descargas en curso."""
+
+    def __init__(self, limit_bytes: int):
+        self.limit = limit_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.spilled = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self, n: int) -> bool:
+        with self._lock:
+            if self.in_use + n > self.limit:
+                return False
+            self.in_use += n
+            self.peak = max(self.peak, self.in_use)
+            return True
+
+    def release(self, n: int) -> None:
+        with self._lock:
+            self.in_use -= n
+
+    def record_spill(self) -> None:
+        with self._lock:
+            self.spilled += 1
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.peak = self.in_use
+            self.spilled = 0
+
+    def report(self) -> str:
+        mb = 1024 * 1024
+        return (
+            f"Descargas: pico en memoria {self.peak / mb:.1f} MB de {self.limit / mb:.0f} MB, "
+            f"{self.spilled} pasada(s) a disco"
+        )
+
+
+class SpooledBuffer:
+    """
+    Destino de escritura para una descarga (`write`), en RAM hasta
+    `threshold` bytes o mientras haya presupuesto; si no, en un archivo
+    temporal (`path`). Cerrarlo libera el presupuesto y borra el archivo.
+    """
+
+    def __init__(self, threshold: int, budget: Optional[MemoryBudget] = None, suffix: str = ".docx"):
+        self.threshold = threshold
+        self.budget = budget
+        self.suffix = suffix
+        self.size = 0
+        self.path: Optional[str] = None
+        self._mem: Optional[io.BytesIO] = io.BytesIO()
+        self._file: Optional[BinaryIO] = None
+        self._held = 0
+
+    def __enter__(self) -> "SpooledBuffer":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    @property
+    def in_memory(self) -> bool:
+        return self._file is None
+
+    def write(self, data: bytes) -> int:
+        n = len(data)
+        if self._file is None and (
+            self._held + n > self.threshold or (self.budget is not None and not self.budget.try_acquire(n))
+        ):
+            self._rollover()
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._mem.write(data)
+            self._held += n
+        self.size += n
+        return n
+
+    def _rollover(self) -> None:
+        fd, self.path = tempfile.mkstemp(suffix=self.suffix)
+        self._file = os.fdopen(fd, "w+b")
+        self._file.write(self._mem.getbuffer())
+        self._mem = None
+        self._release()
+        if self.budget is not None:
+            self.budget.record_spill()
+
+    def _release(self) -> None:
+        if self.budget is not None and self._held:
+            self.budget.release(self._held)
+        self._held = 0
+
+    def sync(self) -> Optional[str]:
+        """Vacía el buffer de escritura al disco y devuelve `path` (None si está en RAM)."""
+        if self._file is not None:
+            self._file.flush()
+        return self.path
+
+    def getvalue(self) -> bytes:
+        if self._file is not None:
+            self._file.flush()
+            with open(self.path, "rb") as fh:
+                return fh.read()
+        return self._mem.getvalue()
+
+    def reader(self) -> BinaryIO:
+        """Archivo del propio buffer, al inicio, para leer (se cierra con el buffer)."""
+        fh = self._file if self._file is not None else self._mem
+        fh.flush()
+        fh.seek(0)
+        return fh
+
+    def reset(self) -> None:
+        """Descarta lo escrito (p. ej. antes de reintentar la descarga)."""
+        self.close()
+        self._mem = io.BytesIO()
+        self.size = 0
+
+    def close(self) -> None:
+        self._release()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+        self._mem = None
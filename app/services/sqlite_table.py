@@ -0,0 +1,229 @@
+# app/services/sqlite_table.py
+"""Tabla maestra en un archivo SQLite local, con la misma lógica que SheetsTable.
+
+Las filas conservan el número de fila de la hoja, así que una copia importada
+con `import_from` y sincronizada con `sync_to` escribe cada fila en la misma
+posición de Google Sheets. Todas las búsquedas van a disco (con índice sobre
+la columna clave) y las escrituras quedan marcadas como pendientes hasta el
+siguiente `sync_to`, que las envía en lote.
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional
+
+from app.services.audit_log import AuditLog
+from app.services.sheets_table import SheetsTable
+from app.services.table_backend import MasterTable
+
+
+class SqliteTable(MasterTable):
+    """
+    Backend local de la tabla maestra. Una columna `c<i>` por encabezado,
+    `row_num` como clave primaria, `dirty` para las filas aún no enviadas a
+    la hoja y `base` con la fila tal como estaba en la hoja antes del primer
+    cambio local (la huella que usa `sync_to`). Seguro para usar desde varios
+    hilos (una conexión con candado).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        sheet_name: str,
+        audit_log: Optional[AuditLog] = None,
+        archive_index=None,
+    ):
+        super().__init__(audit_log=audit_log, archive_index=archive_index)
+        self.path = path
+        self.sheet_name = sheet_name
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Un commit por escritura: WAL evita reescribir el archivo en cada una
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+        self._indexed: set = set()
+        self._load_headers()
+        if self.headers:
+            cols = {r[1] for r in self._conn.execute("PRAGMA table_info(rows)")}
+            if "base" not in cols:
+                self._conn.execute("ALTER TABLE rows ADD COLUMN base TEXT")
+                self._conn.commit()
+
+    def _load_headers(self) -> None:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'headers'").fetchone()
+        self.headers = json.loads(row[0]) if row else []
+
+    def __len__(self) -> int:
+        if not self.headers:
+            return 0
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rows WHERE blank = 0").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # ------- Esquema -------
+
+    def _col(self, header: str) -> str:
+        return f"c{self.headers.index(header)}"
+
+    def reset(self, headers: List[str]) -> None:
+        """Borra el contenido y define los encabezados (columnas) de la tabla."""
+        cols = ", ".join(f"c{i} TEXT NOT NULL DEFAULT ''" for i in range(len(headers)))
+        with self._lock:
+            self._conn.execute("DROP TABLE IF EXISTS rows")
+            self._conn.execute(
+                f"CREATE TABLE rows (row_num INTEGER PRIMARY KEY, {cols}, "
+                "blank INTEGER NOT NULL DEFAULT 0, dirty INTEGER NOT NULL DEFAULT 0, base TEXT)"
+            )
+            self._conn.execute("CREATE INDEX ix_rows_dirty ON rows (dirty)")
+            self._conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES ('headers', ?)",
+                (json.dumps(headers, ensure_ascii=False),),
+            )
+            self._conn.commit()
+            self.headers = list(headers)
+            self._indexed = set()
+
+    def _ensure_index(self, key_col: str) -> None:
+        if key_col in self._indexed:
+            return
+        col = self._col(key_col)
+        self._conn.execute(f"CREATE INDEX IF NOT EXISTS ix_rows_{col} ON rows ({col})")
+        self._conn.commit()
+        self._indexed.add(key_col)
+
+    # ------- Primitivas -------
+
+    def _row_dict(self, vals) -> Dict[str, Any]:
+        return {h: vals[i] for i, h in enumerate(self.headers)}
+
+    def _find_rows_by_key(self, key_col: str, key_value: str, start_row: int = 2) -> List[int]:
+        if key_col not in self.headers:
+            raise ValueError(f"Columna clave '{key_col}' no existe")
+        with self._lock:
+            self._ensure_index(key_col)
+            cur = self._conn.execute(
+                f"SELECT row_num FROM rows WHERE {self._col(key_col)} = ? AND row_num >= ? ORDER BY row_num",
+                (str(key_value), start_row),
+            )
+            return [r[0] for r in cur]
+
+    def _get_row_as_dict(self, row_num: int) -> Dict[str, Any]:
+        return self._get_rows_as_dicts([row_num])[row_num]
+
+    def _get_rows_as_dicts(self, row_nums: List[int], cols: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        if not row_nums:
+            return {}
+        select = ", ".join(f"c{i}" for i in range(len(self.headers)))
+        found: Dict[int, Dict[str, Any]] = {}
+        with self._lock:
+            # En tandas: SQLite limita la cantidad de parámetros por consulta
+            for k in range(0, len(row_nums), 500):
+                part = row_nums[k:k + 500]
+                marks = ", ".join("?" * len(part))
+                cur = self._conn.execute(f"SELECT row_num, {select} FROM rows WHERE row_num IN ({marks})", part)
+                for row in cur:
+                    found[row[0]] = self._row_dict(row[1:])
+        empty = {h: "" for h in self.headers}
+        return {r: dict(found.get(r, empty)) for r in row_nums}
+
+    def _write(self, row_num: int, row_dict: Dict[str, Any]) -> None:
+        vals = ["" if row_dict.get(h) is None else str(row_dict.get(h)) for h in self.headers]
+        blank = int(all(v.strip() == "" for v in vals))
+        cols = ", ".join(f"c{i}" for i in range(len(vals)))
+        marks = ", ".join("?" * (len(vals) + 4))
+        with self._lock:
+            prev = self._conn.execute(f"SELECT dirty, base, {cols} FROM rows WHERE row_num = ?", (row_num,)).fetchone()
+            if prev is None:
+                base = None
+            elif prev[0]:
+                base = prev[1]
+            else:
+                base = json.dumps(list(prev[2:]), ensure_ascii=False)
+            self._conn.execute(
+                f"INSERT OR REPLACE INTO rows (row_num, {cols}, blank, dirty, base) VALUES ({marks})",
+                (row_num, *vals, blank, 1, base),
+            )
+            self._conn.commit()
+
+    def _update_row_from_dict(self, row_num: int, row_dict: Dict[str, Any]) -> None:
+        self._write(row_num, row_dict)
+
+    def _append_row_from_dict(self, row_dict: Dict[str, Any]) -> None:
+        # Como `values.append`: debajo de la última fila con datos
+        with self._lock:
+            last = self._conn.execute("SELECT MAX(row_num) FROM rows WHERE blank = 0").fetchone()[0]
+            self._write((last or 1) + 1, row_dict)
+
+    def _key_index(self, key_col: str) -> Dict[str, List[int]]:
+        index: Dict[str, List[int]] = {}
+        with self._lock:
+            cur = self._conn.execute(f"SELECT {self._col(key_col)}, row_num FROM rows ORDER BY row_num")
+            for value, row_num in cur:
+                index.setdefault(str(value), []).append(row_num)
+        return index
+
+    # ------- Intercambio con Google Sheets -------
+
+    def import_from(self, sheets: SheetsTable) -> int:
+        """
+        Reemplaza el contenido local por la hoja (una sola lectura). Las filas
+        importadas quedan sincronizadas. Devuelve la cantidad de filas con datos.
+        """
+        values = sheets.read_all()
+        self.reset(sheets.headers)
+        cols = ", ".join(f"c{i}" for i in range(len(self.headers)))
+        marks = ", ".join("?" * (len(self.headers) + 1))
+        data = [
+            (i + 2, *["" if v is None else str(v) for v in vals])
+            for i, vals in enumerate(values)
+            if any(str(v).strip() != "" for v in vals)
+        ]
+        with self._lock:
+            self._conn.executemany(f"INSERT INTO rows (row_num, {cols}, blank) VALUES ({marks}, 0)", data)
+            self._conn.commit()
+        return len(data)
+
+    def pending_rows(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM rows WHERE dirty = 1").fetchone()[0]
+
+    def sync_to(self, sheets: SheetsTable, batch_rows: int = 500) -> int:
+        """
+        Envía a la hoja las filas modificadas desde el último `import_from` o
+        `sync_to`, en la misma posición, con una lectura y pocas escrituras en
+        lote (`SheetsTable.snapshot`). Cada fila lleva como huella su versión
+        anterior (`base`): si alguien la editó en la hoja mientras tanto, se
+        combina celda a celda en vez de pisarla. Devuelve las filas enviadas.
+        """
+        missing = [h for h in self.headers if h not in sheets.headers]
+        if missing:
+            raise ValueError(f"Faltan columnas en '{sheets.sheet_name}': {missing}. Encabezados: {sheets.headers}")
+        with self._lock:
+            cur = self._conn.execute(
+                f"SELECT row_num, base, {', '.join(f'c{i}' for i in range(len(self.headers)))} "
+                "FROM rows WHERE dirty = 1 ORDER BY row_num"
+            )
+            rows = [(r[0], json.loads(r[1]) if r[1] else [], self._row_dict(r[2:])) for r in cur]
+        if not rows:
+            return 0
+        with sheets.snapshot():
+            for row_num, base, row in rows:
+                # Las filas creadas en local se vieron vacías
+                seen = dict(zip(self.headers, base)) if base else {h: "" for h in self.headers}
+                sheets.stage(row_num, row, seen=seen)
+            sheets.flush(batch_rows)
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE rows SET dirty = 0, base = NULL WHERE row_num = ?", [(r,) for r, _, _ in rows]
+            )
+            self._conn.commit()
+        return len(rows)
@@ -0,0 +1,538 @@
+# app/services/table_backend.py
+"""Lógica de ubicación de la tabla maestra, independiente del almacenamiento.
+
+`MasterTable` implementa la política de `fill_from_json_only_empty` (llave
+compuesta, reutilización de filas incompletas, fila libre bajo el bloque y
+"solo vacíos"), la búsqueda por bloque y la auditoría sobre unas pocas
+primitivas de filas. Cada backend las implementa: `SheetsTable` (Google
+Sheets) y `SqliteTable` (archivo SQLite local con índice).
+"""
+import re
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from app.services.audit_log import AuditLog
+
+# Estado corto que escribe `_status_line`; cualquier otro contenido de la celda es traza anterior
+STATUS_LINE_RE = re.compile(r"^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}Z: (?:Fila nueva|Actualizada) \([^\n]*\)\.$")
+
+
+class MasterTable(ABC):
+    """
+    Base de los backends. Las filas se numeran como en la hoja (datos desde
+    la fila 2) y se representan como dict encabezado → valor.
+    """
+
+    def __init__(self, audit_log: Optional[AuditLog] = None, archive_index=None):
+        self.headers: List[str] = []
+        # Detalle de cada escritura (la celda de observaciones guarda solo el último estado)
+        self.audit_log = audit_log
+        # Radicados movidos a pestañas de archivo (ver `SheetsTable.rollover`)
+        self.archive_index = archive_index
+
+    # ------- Primitivas del backend -------
+
+    @abstractmethod
+    def _find_rows_by_key(self, key_col: str, key_value: str, start_row: int = 2) -> List[int]:
+        """Filas cuyo valor en `key_col` es exactamente `key_value`."""
+
+    @abstractmethod
+    def _get_row_as_dict(self, row_num: int) -> Dict[str, Any]:
+        """Fila completa (todas las columnas; vacías si la fila no existe)."""
+
+    @abstractmethod
+    def _get_rows_as_dicts(self, row_nums: List[int], cols: Optional[List[str]] = None) -> Dict[int, Dict[str, Any]]:
+        """Varias filas; con `cols`, basta con traer esas columnas."""
+
+    @abstractmethod
+    def _update_row_from_dict(self, row_num: int, row_dict: Dict[str, Any]) -> None:
+        """Reemplaza la fila `row_num` completa."""
+
+    @abstractmethod
+    def _append_row_from_dict(self, row_dict: Dict[str, Any]) -> None:
+        """Agrega una fila después de la última fila con datos."""
+
+    @abstractmethod
+    def _key_index(self, key_col: str) -> Dict[str, List[int]]:
+        """Todas las filas agrupadas por valor de `key_col` (para la auditoría)."""
+
+    def flush(self) -> int:
+        """Envía las escrituras diferidas, si el backend las tiene. Devuelve las filas escritas."""
+        return 0
+
+    def refresh(self) -> None:
+        """Descarta lo que el backend tenga en memoria de la tabla (p. ej. tras escrituras de otro proceso)."""
+
+    def find_archived(self, key_col: str, key_value: str) -> Optional[Dict[str, Any]]:
+        """Bloque archivado de un radicado, si el backend tiene archivo histórico."""
+        return None
+
+    def ensure_columns(self, cols: List[str]):
+        missing = [c for c in cols if c not in self.headers]
+        if missing:
+            raise ValueError(
+                f"Faltan columnas en '{self.sheet_name}': {missing}. Encabezados: {self.headers}"
+            )
+
+    # ------- Búsquedas y utilidades de bloque por RADICADO -------
+    def has_value_in_column(self, key_col: str, key_value: str, target_col: str) -> bool:
+        """Verifica si alguna fila del bloque identificado por `key_col`/`key_value`
+        tiene contenido no vacío en `target_col`."""
+        if target_col not in self.headers:
+            return False
+        rows = self._find_rows_by_key(key_col, key_value)
+        if not rows:
+            archived = self.find_archived(key_col, key_value)
+            return any(str(r.get(target_col, "")).strip() != "" for r in (archived or {}).get("rows", []))
+        rows_data = self._get_rows_as_dicts(rows, cols=[target_col])
+        for row_num in rows:
+            row = rows_data.get(row_num, {})
+            if str(row.get(target_col, "")).strip() != "":
+                return True
+        return False
+
+    def prefetch_block(self, key_col: str, key_value: str) -> List[int]:
+        """Precarga (en el cache) la columna clave y devuelve las filas del bloque."""
+        return self._find_rows_by_key(key_col, key_value)
+
+    def _is_row_empty(self, row_num: int) -> bool:
+        row = self._get_row_as_dict(row_num)
+        return all(str((row.get(h) or "")).strip() == "" for h in self.headers)
+
+    def _find_row_by_compound_key(
+        self,
+        primary_col: str,
+        primary_value: str,
+        extra_keys: Dict[str, str],
+        start_row: int = 2
+    ) -> Optional[int]:
+        """
+        Coincidencia exacta: RADICADO + (SERIE si informativa) + (ITEM si existe) + (ARCHIVO si existe).
+        """
+        matches = self._find_rows_by_compound_key(primary_col, primary_value, extra_keys, start_row)
+        return matches[0] if matches else None
+
+    def _find_rows_by_compound_key(
+        self,
+        primary_col: str,
+        primary_value: str,
+        extra_keys: Dict[str, str],
+        start_row: int = 2
+    ) -> List[int]:
+        """Todas las filas que coinciden con la clave compuesta (más de una = duplicado)."""
+        candidates = self._find_rows_by_key(primary_col, primary_value, start_row)
+        if not candidates or not extra_keys:
+            return candidates
+        rows_data = self._get_rows_as_dicts(candidates, cols=list(extra_keys))
+        return self._match_compound(candidates, rows_data, extra_keys)
+
+    def _match_compound(
+        self, candidates: List[int], rows_data: Dict[int, Dict[str, Any]], extra_keys: Dict[str, str]
+    ) -> List[int]:
+        if not extra_keys:
+            return list(candidates)
+        matches: List[int] = []
+        for row_num in candidates:
+            row = rows_data.get(row_num, {})
+            ok = True
+            for col, val in extra_keys.items():
+                if col not in self.headers:
+                    continue
+                if str(row.get(col, "")).strip() != str(val).strip():
+                    ok = False
+                    break
+            if ok:
+                matches.append(row_num)
+        return matches
+
+    def _find_incomplete_row_in_block(
+        self,
+        rad_col: str,
+        rad_value: str,
+        to_apply: Dict[str, Any],
+        start_row: int = 2
+    ) -> Optional[int]:
+        """
+        Reutiliza una fila 'incompleta' del mismo RADICADO si existe.
+        Criterios:
+          1) SERIE o SERIE TUBO RX vacías/'NO REGISTRA', o
+          2) ≥3 columnas destino vacías entre las que vamos a llenar.
+        """
+        candidates = self._find_rows_by_key(rad_col, rad_value, start_row)
+        if not candidates:
+            return None
+        prefer_missing_cols = {"SERIE", "SERIE TUBO RX"}
+        rows_data = self._get_rows_as_dicts(candidates, cols=list(prefer_missing_cols | set(to_apply)))
+
+        def is_empty(v: Any) -> bool:
+            s = str(v or "").strip()
+            return s == "" or s.upper() in {"NO REGISTRA", "NO REGISTRADA", "NO APLICA"}
+
+        # Prioriza filas con series vacías
+        for row_num in candidates:
+            row = rows_data.get(row_num, {})
+            if any((c in self.headers) and is_empty(row.get(c, "")) for c in prefer_missing_cols):
+                return row_num
+
+        # Si no, usa heurística de vacíos general
+        for row_num in candidates:
+            row = rows_data.get(row_num, {})
+            empties = 0
+            total = 0
+            for col in to_apply.keys():
+                if col not in self.headers:
+                    continue
+                total += 1
+                if is_empty(row.get(col, "")):
+                    empties += 1
+            if total >= 4 and empties >= 3:
+                return row_num
+
+        return None
+
+    def _first_free_row_after_block(self, rad_col: str, rad_value: str, start_row: int = 2) -> Optional[int]:
+        """
+        Retorna la primera fila completamente vacía justo debajo del bloque del RADICADO (si existe).
+        """
+        candidates = self._find_rows_by_key(rad_col, rad_value, start_row)
+        if not candidates:
+            return None
+        probe = max(candidates) + 1
+        return probe if self._is_row_empty(probe) else None
+
+    # ------- Llave compuesta -------
+
+    @staticmethod
+    def _map_fields(json_data: Dict[str, Any], field_map: Dict[str, str]) -> Dict[str, Any]:
+        """Claves del JSON → encabezados de la hoja."""
+        return {field_map.get(k, k): v for k, v in json_data.items()}
+
+    def _compound_key(
+        self,
+        to_apply: Dict[str, Any],
+        col_archivo: Optional[str],
+        filename: Optional[str],
+        backup: bool = True,
+    ) -> Dict[str, str]:
+        """
+        Columnas (además del RADICADO) que identifican la fila de un equipo.
+        `backup` agrega TIPO DE EQUIPO/MARCA/MODELO como respaldo al ubicar.
+        """
+        def _norm(s: Any) -> str:
+            return str(s or "").strip()
+
+        extra_keys: Dict[str, str] = {}
+        serie_val = _norm(to_apply.get("SERIE"))
+        serie_info = bool(serie_val) and serie_val.upper() not in {"NO REGISTRA", "NO REGISTRADA", "NO APLICA"}
+        if "SERIE" in self.headers and serie_info:
+            extra_keys["SERIE"] = serie_val
+        if "ITEM" in self.headers and _norm(to_apply.get("ITEM")):
+            extra_keys["ITEM"] = _norm(to_apply["ITEM"])
+        if (col_archivo in self.headers if col_archivo else False) and filename:
+            extra_keys[col_archivo] = filename
+        if not backup:
+            return extra_keys
+        # Respaldo cuando no hay serie/ítem: ayuda a no duplicar equipos típicos
+        for bcol in ("TIPO DE EQUIPO", "MARCA", "MODELO"):
+            if bcol in self.headers and _norm(to_apply.get(bcol)):
+                extra_keys.setdefault(bcol, _norm(to_apply[bcol]))
+        return extra_keys
+
+    # ------- API principal -------
+
+    def fill_from_json_only_empty(self,
+                                  json_data: Dict[str, Any],
+                                  *,
+                                  col_radicado: str,
+                                  col_obs: str,
+                                  col_archivo: Optional[str] = None,
+                                  col_updated: Optional[str] = None,
+                                  filename: Optional[str] = None,
+                                  field_map: Optional[Dict[str, str]] = None,
+                                  previous: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Rellena SOLO celdas vacías. Evita duplicados y coloca equipos en el bloque correcto:
+        1) Coincidencia exacta por clave compuesta: RADICADO + (SERIE) + (ITEM) + (ARCHIVO) + respaldo (TIPO DE EQUIPO/MARCA/MODELO).
+        2) Reutiliza una fila INCOMPLETA dentro del bloque del RADICADO.
+        3) Usa la PRIMERA fila VACÍA disponible entre las vacías consecutivas bajo el bloque del RADICADO.
+        4) Si nada de lo anterior, APPEND al final.
+        Un radicado que solo está en una pestaña de archivo no se escribe (acción "archived").
+        `previous` (mismas claves que `json_data`) son los valores de una extracción anterior:
+        una celda llena que aún tiene ese valor se reemplaza por el nuevo (lista "replaced");
+        si tiene otro, alguien la editó y se salta.
+        """
+        now = datetime.utcnow().isoformat(timespec="seconds") + "Z"
+        field_map = field_map or {}
+
+        # 1) Radicado
+        rad = str(json_data.get("RADICADO") or json_data.get("radicado") or "").strip()
+        if not rad:
+            raise ValueError("JSON sin 'RADICADO'/'radicado' para ubicar la fila.")
+
+        # 2) Mapeo JSON → encabezados
+        to_apply = self._map_fields(json_data, field_map)
+
+        # 3) Llave compuesta (acumulativa)
+        def _norm(s: Any) -> str:
+            return str(s or "").strip()
+
+        extra_keys = self._compound_key(to_apply, col_archivo, filename)
+
+        # 4) Coincidencia exacta dentro del bloque. Una sola lectura del bloque,
+        #    solo con las columnas que deciden la ubicación (llave, series y campos a llenar)
+        candidates = self._find_rows_by_key(col_radicado, rad, start_row=2)
+        archived_in = self.archive_index.lookup(rad) if self.archive_index is not None and not candidates else None
+        if archived_in:
+            # Bloque archivado (ver `SheetsTable.rollover`): no se reabre en la hoja principal
+            result = {"action": "archived", "radicado": rad, "tab": archived_in, "filled": [], "skipped": [], "missing": []}
+            self._record_trail(now, result, filename)
+            return result
+        rows_data = self._get_rows_as_dicts(candidates, cols=[*extra_keys, "SERIE", "SERIE TUBO RX", *to_apply])
+        matches = self._match_compound(candidates, rows_data, extra_keys)
+        row_num = matches[0] if matches else None
+
+        # 5) Si no hay, intenta reutilizar una fila INCOMPLETA del bloque
+        if row_num is None:
+            def is_empty_value(x: Any) -> bool:
+                s = _norm(x)
+                return s == "" or s.upper() in {"NO REGISTRA", "NO REGISTRADA", "NO APLICA"}
+
+            reuse_candidate: Optional[int] = None
+            for r in candidates:
+                row = rows_data.get(r, {})
+                # Preferencia: serie(s) vacías
+                if ("SERIE" in self.headers and is_empty_value(row.get("SERIE"))) or \
+                   ("SERIE TUBO RX" in self.headers and is_empty_value(row.get("SERIE TUBO RX"))):
+                    reuse_candidate = r
+                    break
+            if reuse_candidate is None:
+                # Heurística: si ≥3 de los campos destino están vacíos, reutiliza
+                for r in candidates:
+                    row = rows_data.get(r, {})
+                    empties = 0
+                    total = 0
+                    for col in to_apply.keys():
+                        if col not in self.headers:
+                            continue
+                        total += 1
+                        if is_empty_value(row.get(col, "")):
+                            empties += 1
+                    if total >= 4 and empties >= 3:
+                        reuse_candidate = r
+                        break
+            if reuse_candidate is not None:
+                row_num = reuse_candidate
+
+        # 6) Si no hay fila aún, usa una de las VACÍAS consecutivas debajo del bloque del RADICADO
+        using_free_row = False
+        if row_num is None:
+            candidates = self._find_rows_by_key(col_radicado, rad, start_row=2)
+            if candidates:
+                probe = max(candidates) + 1
+                # Avanza por todas las filas vacías consecutivas disponibles
+                while True:
+                    row = self._get_rows_as_dicts([probe]).get(probe, {})
+                    is_row_empty = all(_norm(row.get(h, "")) == "" for h in self.headers)
+                    if is_row_empty:
+                        row_num = probe
+                        using_free_row = True
+                        break
+                    else:
+                        # Si encontramos otro RADICADO u otra data, no hay huecos; salimos
+                        break
+
+        # 7) Si todavía no hay fila, APPEND al final
+        creating_new_row = row_num is None
+
+        # 8) Escribir
+        if creating_new_row or using_free_row:
+            base = {h: "" for h in self.headers}
+            # RADICADO, ARCHIVO, timestamp
+            if col_radicado in base:
+                base[col_radicado] = rad
+            if filename and (col_archivo in self.headers if col_archivo else False):
+                base[col_archivo] = filename
+            if col_updated in self.headers if col_updated else False:
+                base[col_updated] = now
+            # Asentar claves de la llave
+            for k_col, k_val in extra_keys.items():
+                if k_col in base and _norm(k_val) != "":
+                    base[k_col] = k_val
+            # Volcar campos del JSON
+            filled, missing = [], []
+            for col, val in to_apply.items():
+                if col in base and _norm(val) != "":
+                    base[col] = val
+                    filled.append(col)
+                elif col not in self.headers:
+                    missing.append(col)
+            # Observaciones: solo el último estado; el detalle va a la traza
+            if col_obs in self.headers:
+                base[col_obs] = self._status_line(now, "Fila nueva", filled, [], missing)
+
+            if using_free_row:
+                self._update_row_from_dict(row_num, base)
+                result = {"action": "insert_at_free", "radicado": rad, "row": row_num, "filled": filled, "missing": missing}
+            else:
+                self._append_row_from_dict(base)
+                result = {"action": "append", "radicado": rad, "filled": filled, "missing": missing}
+            self._record_trail(now, result, filename)
+            return result
+
+        # -------- Fila existente → llenar solo vacíos --------
+        current = self._get_row_as_dict(row_num)
+        updated = dict(current)
+        filled, skipped, missing, replaced = [], [], [], []
+        extracted = self._map_fields(previous or {}, field_map)
+
+        for col, val in to_apply.items():
+            if col not in self.headers:
+                missing.append(col)
+                continue
+            curr = _norm(current.get(col, ""))
+            new = _norm(val)
+            if curr == "" and new != "":
+                updated[col] = val
+                filled.append(col)
+            elif col in extracted and new != "" and curr != new and curr == _norm(extracted[col]):
+                # La celda conserva lo extraído antes (nadie la editó): va la nueva extracción
+                updated[col] = val
+                filled.append(col)
+                replaced.append(col)
+            else:
+                skipped.append(col)
+
+        # ARCHIVO y timestamp
+        if filename and (col_archivo in self.headers if col_archivo else False):
+            if _norm(current.get(col_archivo, "")) == "":
+                updated[col_archivo] = filename
+                filled.append(col_archivo)
+        if col_updated in self.headers if col_updated else False:
+            updated[col_updated] = now
+
+        # Asentar columnas de la llave si estaban vacías
+        for k_col, k_val in extra_keys.items():
+            if k_col in self.headers and _norm(updated.get(k_col, "")) == "" and _norm(k_val) != "":
+                updated[k_col] = k_val
+                filled.append(k_col)
+
+        if col_obs in self.headers:
+            prev = _norm(current.get(col_obs, ""))
+            if filled or skipped or missing:
+                updated[col_obs] = self._status_line(now, "Actualizada", filled, skipped, missing)
+
+        if updated != current:
+            self._update_row_from_dict(row_num, updated)
+            result = {"action": "update", "radicado": rad, "row": row_num, "filled": filled, "skipped": skipped, "missing": missing}
+        else:
+            result = {"action": "noop", "radicado": rad, "row": row_num, "filled": [], "skipped": skipped, "missing": missing}
+        if replaced:
+            result["replaced"] = replaced
+        # Traza histórica que antes se acumulaba en la celda (una o varias líneas): se conserva al reemplazarla
+        replaced = col_obs in self.headers and updated.get(col_obs) != current.get(col_obs)
+        legacy = prev if replaced and prev and not STATUS_LINE_RE.match(prev) else None
+        self._record_trail(now, result, filename, legacy)
+        return result
+
+    @staticmethod
+    def _status_line(now: str, label: str, filled: List[str], skipped: List[str], missing: List[str]) -> str:
+        """Estado corto para la celda de observaciones (longitud acotada)."""
+        parts = [f"{len(set(filled))} llenadas"]
+        if skipped:
+            parts.append(f"{len(set(skipped))} saltadas")
+        if missing:
+            parts.append(f"{len(set(missing))} sin columna")
+        return f"{now.replace('T', ' ')}: {label} ({', '.join(parts)})."
+
+    def _record_trail(
+        self, now: str, result: Dict[str, Any], filename: Optional[str], legacy: Optional[str] = None
+    ) -> None:
+        if self.audit_log is None:
+            return
+        entry = {"ts": now, **result, "filename": filename}
+        for k in ("filled", "skipped", "missing"):
+            entry[k] = sorted(set(entry.get(k) or []))
+        if legacy:
+            entry["previous_obs"] = legacy
+        self.audit_log.record(entry)
+
+    # ------- Auditoría -------
+
+    def audit(
+        self,
+        expected: List[Dict[str, Any]],
+        *,
+        col_radicado: str,
+        col_archivo: Optional[str] = None,
+        field_map: Optional[Dict[str, str]] = None,
+        ignore_cols: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Compara la hoja con las filas esperadas (cada una con `json_data` y
+        `filename`, como se pasarían a `fill_from_json_only_empty`) usando la
+        misma llave compuesta, sin escrituras (en SheetsTable, dentro de
+        `snapshot()`: una sola lectura de la hoja). Devuelve filas faltantes, celdas
+        divergentes, duplicados y filas de la hoja sin resultado local.
+        """
+        field_map = field_map or {}
+        ignore = set(ignore_cols or [])
+
+        def _norm(s: Any) -> str:
+            return " ".join(str(s or "").split())
+
+        missing: List[Dict[str, Any]] = []
+        divergent: List[Dict[str, Any]] = []
+        duplicates: List[Dict[str, Any]] = []
+        matched_rows: set = set()
+        radicados: set = set()
+        ok = 0
+        for item in expected:
+            to_apply = self._map_fields(item["json_data"], field_map)
+            filename = item.get("filename")
+            rad = _norm(to_apply.get(col_radicado) or item["json_data"].get("RADICADO"))
+            radicados.add(rad)
+            # Llave RADICADO + SERIE + ITEM + ARCHIVO; el resto de columnas se compara celda a celda
+            extra_keys = self._compound_key(to_apply, col_archivo, filename, backup=False)
+            key = {col_radicado: rad, **extra_keys}
+            rows = self._find_rows_by_compound_key(col_radicado, rad, extra_keys)
+            if not rows:
+                missing.append({"key": key, "block_exists": bool(self._find_rows_by_key(col_radicado, rad))})
+                continue
+            if len(rows) > 1:
+                duplicates.append({"key": key, "rows": rows})
+            row_num = rows[0]
+            matched_rows.update(rows)
+            current = self._get_row_as_dict(row_num)
+            cells = []
+            for col, val in to_apply.items():
+                if col not in self.headers or col in ignore or _norm(val) == "":
+                    continue
+                have = _norm(current.get(col))
+                if have != _norm(val):
+                    cells.append({"column": col, "sheet": have, "expected": _norm(val), "kind": "empty" if have == "" else "different"})
+            if cells:
+                divergent.append({"key": key, "row": row_num, "cells": cells})
+            else:
+                ok += 1
+
+        orphans = []
+        for rad, rows in self._key_index(col_radicado).items():
+            if rad.strip() and rad.strip() not in radicados:
+                orphans.extend({"row": r, "radicado": rad} for r in rows)
+        orphans.sort(key=lambda o: o["row"])
+
+        return {
+            "summary": {
+                "expected_rows": len(expected),
+                "ok": ok,
+                "missing": len(missing),
+                "divergent": len(divergent),
+                "duplicates": len(duplicates),
+                "orphans": len(orphans),
+            },
+            "missing": missing,
+            "divergent": divergent,
+            "duplicates": duplicates,
+            "orphans": orphans,
+        }
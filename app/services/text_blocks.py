@@ -0,0 +1,61 @@
+# app/services/text_blocks.py
+"""Segmentación del texto de una licencia en encabezado + bloques de equipo."""
+import re
+from typing import List, Tuple
+
+from app.services.extraction_rules import normalize
+
+# "EQUIPO_1" (plantilla del checklist), "EQUIPO 1", "Equipo No. 2", "EQUIPO N° 3" al inicio de línea
+EQUIPO_MARKER_RE = re.compile(r"^EQUIPO[\s_]*(?:N[\s_]*[O°º.]*[\s_]*)?(\d{1,2})\b")
+# Rótulo que abre cada equipo cuando no hay numeración explícita ("TIPO_DE_EQUIPO:" en la plantilla)
+TIPO_EQUIPO_RE = re.compile(r"^TIPO[\s_]+DE[\s_]+EQUIPO\b")
+# Secciones de la plantilla que siguen al último equipo (requisitos, observaciones): van con el encabezado
+AFTER_EQUIPOS_RE = re.compile(r"^(?:REQUISITOS|OBSERVACIONES)\b")
+QC_RE = re.compile(r"CONTROL DE CALIDAD|CONTROL CALIDAD|REALIZADO POR")
+# Encabezado del texto unido de varios archivos de un radicado (ver `IngestPipeline._merged_text`)
+COALESCE_HEADER = (
+    "Los siguientes archivos son del mismo radicado (original, correcciones y anexos), "
+    "del más antiguo al más reciente. Si se contradicen, vale el más reciente.\n\n"
+)
+
+
+def _block_starts(lines: List[str], min_blocks: int) -> List[int]:
+    norm = [normalize(line) for line in lines]
+    numbered = [i for i, line in enumerate(norm) if EQUIPO_MARKER_RE.match(line)]
+    numbers = {EQUIPO_MARKER_RE.match(norm[i]).group(1) for i in numbered}
+    if numbers and len(numbers) >= min_blocks:
+        return numbered
+    labelled = [i for i, line in enumerate(norm) if TIPO_EQUIPO_RE.match(line)]
+    return labelled if len(labelled) >= 2 else []
+
+
+def split_equipment_blocks(text: str, min_blocks: int = 2) -> Tuple[str, List[str]]:
+    """
+    Devuelve (encabezado, bloques). Un bloque por equipo cuando el documento
+    tiene marcadores "EQUIPO n" o rótulos "TIPO DE EQUIPO" repetidos; si no
+    se reconoce la estructura, `bloques` queda vacío. El encabezado incluye
+    lo que sigue al último equipo (requisitos, observaciones). Con
+    `min_blocks=1` también separa un único equipo numerado ("EQUIPO_1").
+    Un texto unido de varios archivos (`COALESCE_HEADER`) no se separa: sus
+    bloques repiten equipos entre versiones y solo el texto completo dice
+    cuál vale.
+    """
+    if text.startswith(COALESCE_HEADER):
+        return text, []
+    lines = text.splitlines()
+    starts = _block_starts(lines, min_blocks)
+    if not starts:
+        return text, []
+    end = next(
+        (i for i in range(starts[-1] + 1, len(lines)) if AFTER_EQUIPOS_RE.match(normalize(lines[i]))),
+        len(lines),
+    )
+    head = "\n".join(lines[:starts[0]] + lines[end:])
+    bounds = starts + [end]
+    blocks = ["\n".join(lines[a:b]) for a, b in zip(bounds, bounds[1:])]
+    return head, blocks
+
+
+def qc_lines(text: str) -> List[str]:
+    """Líneas del documento que mencionan el control de calidad."""
+    return [line for line in text.splitlines() if QC_RE.search(normalize(line))]
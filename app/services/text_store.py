@@ -0,0 +1,45 @@
+# app/services/text_store.py
+"""Textos extraídos de los .docx, comprimidos y direccionados por contenido.
+
+Cada texto se guarda una sola vez en `<raíz>/<2 primeros>/<sha256>.txt.gz`
+(dos archivos con el mismo texto comparten entrada) y el `.meta.json` de cada
+resultado anota su hash. Permite volver a extraer sin descargar de Drive
+(ver `IngestPipeline.reprocess`) y comparar ediciones
+(`AIClient.summarize_incremental`).
+"""
+import gzip
+import hashlib
+import os
+from typing import Optional
+
+
+class TextStore:
+    def __init__(self, root: str):
+        self.root = root
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], f"{digest}.txt.gz")
+
+    def put(self, text: str) -> str:
+        """Guarda el texto (si no estaba) y devuelve su sha256."""
+        data = text.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Nombre temporal único: dos hilos pueden guardar el mismo texto a la vez
+            tmp = f"{path}.{os.getpid()}.{id(data)}.tmp"
+            with gzip.open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        return digest
+
+    def get(self, digest: Optional[str]) -> Optional[str]:
+        """Texto con ese hash, o None si no está (o el archivo está dañado)."""
+        if not digest:
+            return None
+        try:
+            with gzip.open(self._path(digest), "rb") as f:
+                return f.read().decode("utf-8")
+        except (OSError, EOFError, UnicodeDecodeError):
+            return None
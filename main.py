@@ -5,4 +5,21 @@ if __name__ == "__main__":
     #Seleccionar el adecuado para el trabajo deseados
     #pipeline.process_folder()
     #pipeline.process_folder_only_new()
-    pipeline.process_folder_only_pending()
\ No newline at end of file
+    pipeline.process_folder_only_pending()
+    #Por prioridad (nuevos, modificaciones, reproceso) con presupuestos diarios, hora límite y punto de control
+    #pipeline.process_folder_scheduled()
+    #Reescribe la hoja desde out_json (sin Drive ni IA)
+    #pipeline.backfill()
+    #Tras subir PROMPT_VERSION: re-extrae desde los textos guardados los resultados de versiones anteriores
+    #pipeline.reprocess()
+    #Concilia la hoja con out_json y guarda un reporte en out_json/auditorias
+    #pipeline.audit()
+    #Mueve bloques antiguos/cerrados a pestañas por año (ARCHIVE_BEFORE / ARCHIVE_CLOSED_FILE)
+    #pipeline.rollover("2024-01-01")
+    #Con TABLE_BACKEND=sqlite: envía a la hoja las filas pendientes de la tabla local
+    #pipeline.sync_table()
+    #Modo asíncrono (requiere aiohttp): "all", "only_new" o "only_pending"
+    #pipeline.run("only_pending")
+    #Varias carpetas/hojas (TENANTS_FILE) a la vez, con cupos compartidos: "all", "only_new" o "only_pending"
+    #from app.pipeline.multi_tenant import MultiTenantRunner
+    #MultiTenantRunner.from_file().run("only_pending")